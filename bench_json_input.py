@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+import sys
+import os
+import argparse
+import contextlib
+import json
+import subprocess
+import tempfile
+import time
+from bench_lzutf8 import generate_corpus, peak_rss_kb
+from xbsync.bookmark_rules import RuleSet
+from xbsync.bookmarks import filter_bookmarks, filter_bookmark_events
+
+METHODS = ['load', 'stream']
+
+
+def run_method(method, input_path):
+    """
+    Filter the bookmarks in input_path the way urls_from_xbs_json.py does with
+    --input-format json (load) or stream, and return the number of bookmarks kept.
+    """
+    rules = RuleSet().compile()
+    if method == 'load':
+        with open(input_path, 'r') as inputFile:
+            text = inputFile.read()
+        bookmarks = json.loads(text)
+        del text
+        kept = filter_bookmarks(bookmarks, rules, 'skip')
+    elif method == 'stream':
+        from xbsync.json_stream import iter_tree_events
+        kept = filter_bookmark_events(iter_tree_events(input_path), rules, 'skip')
+    else:
+        raise ValueError('unknown method: ' + method)
+    return sum(1 for _ in kept)
+
+
+def measure(method, input_path):
+    """
+    Time method on input_path in a fresh interpreter so that peak RSS is not polluted by
+    earlier runs.
+    """
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', method, input_path],
+        check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def worker(method, input_path):
+    start_rss = peak_rss_kb()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    #Scheme warnings and the like would end up in the results
+    with contextlib.redirect_stdout(sys.stderr):
+        bookmarks = run_method(method, input_path)
+    result = {
+        'seconds': time.perf_counter() - start_wall,
+        'cpu_seconds': time.process_time() - start_cpu,
+        'bookmarks': bookmarks,
+        'start_rss_kb': start_rss,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+    print(json.dumps(result))
+
+
+def main():
+    # Setup arguments
+    parser = argparse.ArgumentParser(
+        description='Benchmark reading a json bookmark export whole against reading it incrementally')
+
+    parser.add_argument('-s', '--sizes',
+                        nargs='+',
+                        type=int,
+                        default=[1000000, 10000000, 50000000],
+                        help='corpus sizes in bytes before indenting, space separated, defaults to 1000000 10000000 50000000',
+                        )
+    parser.add_argument('--indent',
+                        type=int,
+                        default=4,
+                        help='indent the corpus like a pretty printed export, 0 for compact json, defaults to 4',
+                        )
+    parser.add_argument('-i', '--input',
+                        help='benchmark this bookmark json file instead of generated ones',
+                        )
+    parser.add_argument('--methods',
+                        nargs='+',
+                        choices=METHODS,
+                        default=METHODS,
+                        help='methods to benchmark, defaults to all',
+                        )
+    parser.add_argument('-o', '--output',
+                        help='file to write json results to',
+                        )
+    parser.add_argument('--worker',
+                        nargs=2,
+                        help=argparse.SUPPRESS,
+                        )
+
+    #Get args
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], args.worker[1])
+        return
+
+    results = {'python': sys.version.split()[0], 'indent': args.indent, 'results': []}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.input:
+            inputs = [(os.path.getsize(args.input), args.input)]
+        else:
+            inputs = []
+            for size in args.sizes:
+                input_path = os.path.join(temp_dir, 'corpus-%d.json' % size)
+                corpus = json.loads(generate_corpus(size))
+                with open(input_path, 'w', encoding='utf-8') as corpusFile:
+                    json.dump(corpus, corpusFile, ensure_ascii=False, indent=args.indent or None)
+                del corpus
+                inputs.append((size, input_path))
+
+        for size, input_path in inputs:
+            file_size = os.path.getsize(input_path)
+            for method in args.methods:
+                result = measure(method, input_path)
+                result['method'] = method
+                result['size'] = size
+                result['file_bytes'] = file_size
+                result['bytes_per_second'] = file_size / max(result['seconds'], 1e-9)
+                results['results'].append(result)
+                print('%-7s %11d bytes  %8.3f s  %12.0f B/s  %8d KiB peak RSS  %8d KiB at start' % (
+                    method, file_size, result['seconds'], result['bytes_per_second'], result['peak_rss_kb'],
+                    result['start_rss_kb']))
+
+    if args.output:
+        with open(args.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/python3
+
+import sys
+import os
+import argparse
+import json
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from lzutf8 import Compressor, Decompressor
+
+FOLDER_NAMES = ['Work', 'Reading list', 'Recettes de cuisine', 'Музыка', '旅行', 'Tools', 'Archive', 'Ελληνικά']
+DOMAINS = ['github.com', 'en.wikipedia.org', 'news.ycombinator.com', 'www.youtube.com',
+           'docs.python.org', 'stackoverflow.com', 'ja.wikipedia.org', 'example.co.uk']
+TITLE_WORDS = ['How', 'to', 'build', 'a', 'release', 'pipeline', 'Überblick', 'naïve', 'café',
+               '日本語の記事', 'документация', '😀', 'guide', 'API', 'reference', '2019']
+
+OPERATIONS = ['compress-block', 'compress-stream', 'decompress-block', 'decompress-stream']
+
+
+def generate_corpus(size, seed=0):
+    """
+    Build xBrowserSync shaped bookmark json of roughly size bytes (utf-8 encoded).
+
+    Bookmarks are spread over nested folders with repetitive urls and multibyte titles,
+    similar to what the sync api returns once decrypted and decompressed.
+    """
+    rand = random.Random(seed)
+    next_id = [1]
+
+    def new_id():
+        next_id[0] += 1
+        return next_id[0]
+
+    def bookmark():
+        domain = rand.choice(DOMAINS)
+        path = '/'.join(rand.choice(TITLE_WORDS).lower() for _ in range(rand.randint(1, 4)))
+        return {
+            'id': new_id(),
+            'title': ' '.join(rand.choice(TITLE_WORDS) for _ in range(rand.randint(2, 8))),
+            'url': 'https://' + domain + '/' + path + '?id=' + str(rand.randint(1, 5000)),
+            'description': ' '.join(rand.choice(TITLE_WORDS) for _ in range(rand.randint(0, 12))),
+            'tags': rand.sample(TITLE_WORDS, rand.randint(0, 3)),
+        }
+
+    def folder(depth, budget):
+        children = []
+        used = 0
+        while used < budget:
+            if depth < 6 and rand.random() < 0.1:
+                child = folder(depth + 1, min(budget - used, rand.randint(1000, 50000)))
+            else:
+                child = bookmark()
+            children.append(child)
+            used += len(json.dumps(child, ensure_ascii=False).encode('utf-8'))
+        return {'id': new_id(), 'title': rand.choice(FOLDER_NAMES), 'children': children}
+
+    roots = []
+    used = 0
+    while used < size:
+        root = folder(0, min(size - used, 1000000))
+        roots.append(root)
+        used += len(json.dumps(root, ensure_ascii=False).encode('utf-8'))
+    return json.dumps(roots, ensure_ascii=False)
+
+
+def iter_chunks(data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+def read_chunks(inputFile, chunk_size):
+    while True:
+        chunk = inputFile.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_operation(operation, data):
+    """
+    Run one benchmark operation, discarding the output. data is the whole input for the
+    block operations and an iterable of chunks for the stream ones.
+    """
+    if operation == 'compress-block':
+        Compressor().compressBlockToBytes(data)
+    elif operation == 'compress-stream':
+        compressor = Compressor()
+        for chunk in data:
+            compressor.compressBlock(chunk)
+    elif operation == 'decompress-block':
+        Decompressor().decompressBlockToString(data)
+    elif operation == 'decompress-stream':
+        for _ in Decompressor().decompressStream(data):
+            pass
+    else:
+        raise ValueError('unknown operation: ' + operation)
+
+
+def measure(operation, input_path, chunk_size):
+    """
+    Time operation on the contents of input_path in a fresh interpreter so that peak RSS
+    is not polluted by earlier runs.
+    """
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', operation, input_path, str(chunk_size)],
+        check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def peak_rss_kb():
+    """
+    Return the peak RSS of this process. ru_maxrss keeps the peak of the parent it was
+    forked from on Linux, so the VmHWM of /proc is preferred where there is one.
+    """
+    try:
+        with open('/proc/self/status', 'r') as statusFile:
+            for line in statusFile:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def worker(operation, input_path, chunk_size):
+    start_rss = peak_rss_kb()
+    with open(input_path, 'rb') as inputFile:
+        #The stream operations read the input a chunk at a time, so that their peak RSS
+        #does not include the whole of it
+        if operation.endswith('-stream'):
+            data = read_chunks(inputFile, chunk_size)
+        else:
+            data = inputFile.read()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        run_operation(operation, data)
+        result = {
+            'seconds': time.perf_counter() - start_wall,
+            'cpu_seconds': time.process_time() - start_cpu,
+            'start_rss_kb': start_rss,
+            'peak_rss_kb': peak_rss_kb(),
+        }
+    print(json.dumps(result))
+
+
+def check_round_trips(seed=0):
+    """
+    Compress a small corpus and decompress it split at every offset, and in every small
+    chunk size, so that pointers and multibyte sequences straddle chunk boundaries.
+    Also compress it in two blocks split at every offset around multibyte codepoints.
+
+    Returns a list of failure descriptions.
+    """
+    failures = []
+    text = generate_corpus(4000, seed)
+    compressed = Compressor().compressBlockToBytes(text)
+
+    if Decompressor().decompressBlockToString(compressed) != text:
+        failures.append('single block round trip')
+
+    for offset in range(len(compressed) + 1):
+        chunks = [compressed[:offset], compressed[offset:]]
+        if ''.join(Decompressor().decompressStream(chunks)) != text:
+            failures.append('decompress split at offset %d' % offset)
+
+    for chunk_size in range(1, 9):
+        if ''.join(Decompressor().decompressStream(iter_chunks(compressed, chunk_size))) != text:
+            failures.append('decompress in chunks of %d bytes' % chunk_size)
+
+    # Compressing is much slower, so use a smaller corpus for the compressor splits
+    text = generate_corpus(1000, seed)
+    raw = text.encode('utf-8')
+    multibyte_offsets = set()
+    for position, value in enumerate(raw):
+        if value >= 0xc0:
+            multibyte_offsets.update(range(max(position - 1, 0), min(position + 5, len(raw) + 1)))
+    for offset in sorted(multibyte_offsets):
+        compressor = Compressor()
+        chunks = [compressor.compressBlockToBytes(raw[:offset]) if offset else b'',
+                  compressor.compressBlockToBytes(raw[offset:]) if offset < len(raw) else b'']
+        if ''.join(Decompressor().decompressStream(chunks)) != text:
+            failures.append('compress split at offset %d' % offset)
+
+    return failures
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Return a list of regressions of results against baseline, allowing for tolerance
+    (a fraction) of slowdown or RSS growth.
+    """
+    regressions = []
+    baseline_results = {(r['operation'], r['size']): r for r in baseline['results']}
+    for result in results['results']:
+        old = baseline_results.get((result['operation'], result['size']))
+        if not old:
+            continue
+        name = '%s %d bytes' % (result['operation'], result['size'])
+        if result['bytes_per_second'] < old['bytes_per_second'] * (1 - tolerance):
+            regressions.append('%s: throughput %.0f B/s, baseline %.0f B/s' % (
+                name, result['bytes_per_second'], old['bytes_per_second']))
+        if result['peak_rss_kb'] > old['peak_rss_kb'] * (1 + tolerance):
+            regressions.append('%s: peak RSS %d KiB, baseline %d KiB' % (
+                name, result['peak_rss_kb'], old['peak_rss_kb']))
+    return regressions
+
+
+def main():
+    # Setup arguments
+    parser = argparse.ArgumentParser(
+        description='Benchmark the lzutf8 compressor and decompressor on synthetic bookmark data')
+
+    parser.add_argument('-s', '--sizes',
+                        nargs='+',
+                        type=int,
+                        default=[10000, 100000, 1000000],
+                        help='corpus sizes in bytes, space separated, defaults to 10000 100000 1000000, up to 100000000 is sensible',
+                        )
+    parser.add_argument('-c', '--chunk-size',
+                        type=int,
+                        default=65536,
+                        help='chunk size for the streaming benchmarks, defaults to 65536',
+                        )
+    parser.add_argument('--operations',
+                        nargs='+',
+                        choices=OPERATIONS,
+                        default=OPERATIONS,
+                        help='operations to benchmark, defaults to all',
+                        )
+    parser.add_argument('-o', '--output',
+                        help='file to write json results to',
+                        )
+    parser.add_argument('-b', '--baseline',
+                        help='json results of an earlier run to compare against, exits with 1 on regressions',
+                        )
+    parser.add_argument('-t', '--tolerance',
+                        type=float,
+                        default=0.2,
+                        help='allowed fraction of throughput loss or RSS growth against the baseline, defaults to 0.2',
+                        )
+    parser.add_argument('--skip-checks',
+                        action='store_true',
+                        help='skip the chunk boundary round trip checks',
+                        )
+    parser.add_argument('--worker',
+                        nargs=3,
+                        help=argparse.SUPPRESS,
+                        )
+
+    #Get args
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], args.worker[1], int(args.worker[2]))
+        return
+
+    if not args.skip_checks:
+        failures = check_round_trips()
+        for failure in failures:
+            print('ERROR: round trip failed: ' + failure)
+        if failures:
+            sys.exit(1)
+        print('round trip checks passed')
+
+    results = {'python': sys.version.split()[0], 'chunk_size': args.chunk_size, 'results': []}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in args.sizes:
+            text = generate_corpus(size)
+            raw_path = os.path.join(temp_dir, 'corpus.json')
+            compressed_path = os.path.join(temp_dir, 'corpus.lzutf8')
+            with open(raw_path, 'wb') as rawFile:
+                rawFile.write(text.encode('utf-8'))
+            if any(operation.startswith('decompress') for operation in args.operations):
+                with open(compressed_path, 'wb') as compressedFile:
+                    compressedFile.write(Compressor().compressBlockToBytes(text))
+
+            for operation in args.operations:
+                input_path = compressed_path if operation.startswith('decompress') else raw_path
+                result = measure(operation, input_path, args.chunk_size)
+                result['operation'] = operation
+                result['size'] = size
+                result['input_bytes'] = os.path.getsize(input_path)
+                # Throughput is always measured in uncompressed bytes
+                result['bytes_per_second'] = os.path.getsize(raw_path) / max(result['seconds'], 1e-9)
+                results['results'].append(result)
+                print('%-18s %11d bytes  %8.3f s  %12.0f B/s  %8d KiB peak RSS  %8d KiB at start' % (
+                    operation, size, result['seconds'], result['bytes_per_second'], result['peak_rss_kb'],
+                    result['start_rss_kb']))
+
+    if args.output:
+        with open(args.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baselineFile:
+            baseline = json.load(baselineFile)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
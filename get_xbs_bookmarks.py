@@ -1,91 +1,146 @@
-#!/usr/bin/python3
-
-import sys
-import argparse
-import urllib.request
-import json
-import base64
-import hashlib
-from Cryptodome.Cipher import AES
-from Cryptodome.Util.Padding import unpad
-from lzutf8 import Decompressor
-
-# Setup arguments
-parser = argparse.ArgumentParser(
-    description='Get bookmarks from an XBrowserSync api')
-
-parser.add_argument('-u', '--url',
-                    default='https://api.xbrowsersync.org',
-                    help='url of the xbrowsersync api service, defaults to https://api.xbrowsersync.org',
-                    )
-
-required = parser.add_argument_group('required arguments')
-required.add_argument('-s', '--sync-id',
-                      required=True,
-                      help='sync ID to get bookmarks from',
-                      )
-required.add_argument('-p', '--password',
-                      required=True,
-                      help='decryption password',
-                      )
-required.add_argument('-o', '--output',
-                      required=True,
-                      help='output file with json',
-                      )
-
-#Get args
-args = parser.parse_args()
-base_url = args.url.strip().rstrip('/')
-password = args.password
-sync_id = args.sync_id
-
-#Check sync service url
-try:
-    if urllib.request.urlopen(base_url).getcode() != 200:
-        raise BadURL("URL cannot be reached or is not working correctly")
-except:
-    print("ERROR: URL cannot be reached or is not working correctly. URl: " + base_url)
-    sys.exit()
-
-sync_id_url = base_url + "/bookmarks/" + sync_id
-
-#check and download data from sync service
-try:
-    sync_id_url_response = urllib.request.urlopen(sync_id_url)
-    if sync_id_url_response.getcode() != 200:
-        raise BadURL("URL cannot be reached or is not working correctly")
-    sync_data_encrypted_raw = sync_id_url_response.read().decode('utf-8')
-    sync_id_url_response.close()
-except:
-    print("ERROR: URL cannot be reached or is not working correctly.")
-    print("Check that your sync ID is correct.")
-    print("URl: " + base_url)
-    sys.exit()
-
-#Get encrypted bookmark data from json response from api query
-sync_data_encrypted = json.loads(sync_data_encrypted_raw)
-all_bookmarks_encrypted = base64.b64decode(sync_data_encrypted["bookmarks"])
-
-#Setup decryption key and parameters
-key = hashlib.pbkdf2_hmac('sha256', password.encode(
-    'utf-8'), sync_id.encode('utf-8'), 250000, 32)
-nonce_iv = all_bookmarks_encrypted[:16]
-ciphertext = all_bookmarks_encrypted[16:-16]
-tag = all_bookmarks_encrypted[-16:]
-
-#Decrypt bookmark data
-cipher = AES.new(key, AES.MODE_GCM, nonce=nonce_iv)
-all_bookmarks_decrypted = cipher.decrypt_and_verify(ciphertext, tag)
-
-#Decompress bookmark data with lzutf8
-decompressor = Decompressor()
-all_bookmarks_decompressed = decompressor.decompressBlockToString(
-    all_bookmarks_decrypted)
-
-#Prettify decrypted bookmark data
-all_bookmarks_json = json.loads(all_bookmarks_decompressed)
-all_bookmarks_decompressed = json.dumps(all_bookmarks_json, indent=4)
-
-#Write bookmark data to file
-with open(args.output, "w") as outputFile:
-    outputFile.write(all_bookmarks_decompressed)
+#!/usr/bin/python3
+
+import sys
+import argparse
+import http.client
+import os
+from xbsync.cli import read_manifest, run_manifest
+from xbsync.stage_stats import NO_STATS, Stats, add_stats_arguments, write_stats
+from xbsync.http_transport import BadURL
+from xbsync.sync import (EXIT_UNCHANGED, load_key_cache, save_key_cache, get_cached_key, load_sync_state,
+                         write_json_atomically, sync_bookmarks, update_key_cache, update_sync_state)
+
+def main():
+    # Setup arguments
+    parser = argparse.ArgumentParser(
+        description='Get bookmarks from an XBrowserSync api')
+
+    parser.add_argument('-u', '--url',
+                        default='https://api.xbrowsersync.org',
+                        help='url of the xbrowsersync api service, defaults to https://api.xbrowsersync.org',
+                        )
+
+    parser.add_argument('-k', '--key-cache',
+                        help='file to cache derived decryption keys in, skips the slow key derivation on later runs',
+                        )
+    parser.add_argument('--key-cache-ttl',
+                        type=int,
+                        default=7 * 24 * 60 * 60,
+                        help='seconds a cached key stays valid, defaults to 604800 (7 days)',
+                        )
+    parser.add_argument('--clear-key-cache',
+                        action='store_true',
+                        help='remove the cached key for this sync ID, or those of the accounts in --manifest, before running',
+                        )
+
+    parser.add_argument('--state',
+                        help='file to remember the last synced update time in, exits with status %d without downloading when nothing changed' % EXIT_UNCHANGED,
+                        )
+
+    parser.add_argument('-f', '--format',
+                        choices=['json', 'pretty', 'ndjson'],
+                        default='json',
+                        help='output format, json is written as it is downloaded, pretty is indented, ndjson has one '
+                             'line per bookmark with its folder path, both of these need all bookmarks in memory, defaults to json',
+                        )
+
+    add_stats_arguments(parser, profile=True)
+
+    parser.add_argument('-m', '--manifest',
+                        help='json file with a list of accounts to sync instead of a single one, each with sync_id, output, '
+                             'one of password, password_env or password_file, and optionally url and format',
+                        )
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='number of accounts to sync at once with --manifest, defaults to the number of CPUs',
+                        )
+
+    required = parser.add_argument_group('required arguments, unless --manifest is given')
+    required.add_argument('-s', '--sync-id',
+                          help='sync ID to get bookmarks from',
+                          )
+    required.add_argument('-p', '--password',
+                          help='decryption password',
+                          )
+    required.add_argument('-o', '--output',
+                          help='output file with json',
+                          )
+
+    #Get args
+    args = parser.parse_args()
+    if not args.manifest and not (args.sync_id and args.password and args.output):
+        parser.error('the following arguments are required: -s/--sync-id, -p/--password, -o/--output')
+    base_url = args.url.strip().rstrip('/')
+    password = args.password
+    sync_id = args.sync_id
+
+    key_cache = load_key_cache(args.key_cache) if args.key_cache else {}
+    if args.key_cache and args.clear_key_cache:
+        #Save the removal right away, so that it holds however the run ends
+        cleared_ids = [entry.get('sync_id') for entry in read_manifest(args.manifest)] if args.manifest else [sync_id]
+        for cleared_id in cleared_ids:
+            key_cache.pop(cleared_id, None)
+        save_key_cache(args.key_cache, key_cache)
+    sync_state = load_sync_state(args.state) if args.state else {}
+
+    stats_reports = [] if args.stats else None
+    if args.manifest:
+        failures = run_manifest(args, key_cache, sync_state, stats_reports)
+    else:
+        failures = 0
+        stats = NO_STATS
+        if args.stats or args.profile:
+            stats = Stats(trace_memory=bool(args.stats), profile_stages=['decompress'] if args.profile else [])
+
+        cached_key = get_cached_key(key_cache, sync_id, password) if args.key_cache else None
+        previous = sync_state.get(sync_id, {})
+
+        #The download itself tells whether the service can be reached
+        try:
+            result = sync_bookmarks(base_url, sync_id, password, args.output, args.format, cached_key,
+                                    previous.get('lastUpdated'), stats, previous.get('etag'))
+        except (OSError, http.client.HTTPException, BadURL) as e:
+            print("ERROR: URL cannot be reached or is not working correctly.")
+            print("Check that your sync ID is correct.")
+            print("URl: " + base_url)
+            print(e)
+            sys.exit(1)
+        except ValueError as e:
+            #A MAC check that fails with a freshly derived key, or a payload cut short
+            print("ERROR: bookmarks cannot be decrypted: %s" % e)
+            print("Check that your password is correct.")
+            sys.exit(1)
+
+        if args.stats:
+            write_stats(args.stats, args.stats_format, [({'script': 'get_xbs_bookmarks'}, stats.report())])
+        if args.profile:
+            stats.dump_profile(args.profile)
+
+        if result['status'] == 'unchanged':
+            print("No changes since last sync at %s" % result['lastUpdated'])
+            sys.exit(EXIT_UNCHANGED)
+
+        if result['key_from_cache']:
+            print("Key setup (warm start, cached key): %.3f s" % result['key_setup_time'])
+        else:
+            print("Key setup (cold start, derived key): %.3f s" % result['key_setup_time'])
+            if args.key_cache:
+                update_key_cache(key_cache, result, password, args.key_cache_ttl)
+
+        #Remember what was synced, only once the output has been written
+        if args.state:
+            update_sync_state(sync_state, result)
+
+    if args.key_cache:
+        save_key_cache(args.key_cache, key_cache)
+    if args.state:
+        write_json_atomically(args.state, sync_state)
+    if args.manifest and args.stats:
+        write_stats(args.stats, args.stats_format, stats_reports)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,6 @@ SOFTWARE.
 
 name = "lzutf8"
 
-__all__ = ["CompressorHashTable", "CompressorSimpleHashTable", "Compressor", "Decompressor"]
+__all__ = ["CompressorHashTable", "CompressorSimpleHashTable", "CompressorCustomHashTable", "Compressor", "Decompressor"]
 
-from .lzutf8 import Compressor, Decompressor, CompressorHashTable, CompressorSimpleHashTable
\ No newline at end of file
+from .lzutf8 import Compressor, Decompressor, CompressorHashTable, CompressorSimpleHashTable, CompressorCustomHashTable
\ No newline at end of file
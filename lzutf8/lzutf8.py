@@ -24,6 +24,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import abc
+import array
+import re
 
 
 def rshift(val, n):
@@ -86,6 +88,124 @@ class CompressorSimpleHashTable(CompressorHashTable):
         return sum(map(len, self._buckets.values()))
 
 
+class CompressorCustomHashTable(CompressorHashTable):
+    """
+    Fixed capacity hash table backed by flat unsigned 32 bit arrays.
+
+    Each bucket holds at most maximumBucketCapacity - 1 values, when a bucket is full its
+    oldest half is evicted, so lookups stay bounded no matter how repetitive the input is.
+
+    @see https://github.com/rotemdan/lzutf8.js/blob/a651a467a3456ecac302afb4ea9e320731f182f6/src/Compression/CompressorCustomHashTable.ts#L1
+    """
+    minimumBucketCapacity = 4
+    maximumBucketCapacity = 64
+
+    def __init__(self, bucketCount=65537):
+        super().__init__()
+        self.storage = array.array("I", [0]) * (bucketCount * 4)
+        self.bucketLocators = array.array("I", [0]) * (bucketCount * 2)
+        self.storageIndex = 1  # Skip 0
+
+    def addValueToBucket(self, bucketIndex, valueToAdd):
+        bucketIndex <<= 1
+
+        if self.storageIndex >= (len(self.storage) >> 1):
+            self._compact()
+
+        startPosition = self.bucketLocators[bucketIndex]
+
+        if startPosition == 0:
+            startPosition = self.storageIndex
+            length = 1
+            self.storage[self.storageIndex] = valueToAdd
+            self.storageIndex += self.minimumBucketCapacity  # Set initial capacity of bucket
+        else:
+            length = self.bucketLocators[bucketIndex + 1]
+
+            if length == self.maximumBucketCapacity - 1:
+                length = self._truncateBucketToNewerElements(startPosition, length, self.maximumBucketCapacity // 2)
+
+            endPosition = startPosition + length
+
+            if self.storage[endPosition] == 0:
+                self.storage[endPosition] = valueToAdd
+
+                if endPosition == self.storageIndex:
+                    self.storageIndex += length
+            else:
+                self.storage[self.storageIndex:self.storageIndex + length] = \
+                    self.storage[startPosition:startPosition + length]
+                startPosition = self.storageIndex
+                self.storageIndex += length
+                self.storage[self.storageIndex] = valueToAdd
+                self.storageIndex += 1
+                self.storageIndex += length  # Double the capacity of the bucket
+
+            length += 1
+
+        self.bucketLocators[bucketIndex] = startPosition
+        self.bucketLocators[bucketIndex + 1] = length
+
+    def _truncateBucketToNewerElements(self, startPosition, bucketLength, truncatedBucketLength):
+        sourcePosition = startPosition + bucketLength - truncatedBucketLength
+
+        self.storage[startPosition:startPosition + truncatedBucketLength] = \
+            self.storage[sourcePosition:sourcePosition + truncatedBucketLength]
+        self.storage[startPosition + truncatedBucketLength:startPosition + bucketLength] = \
+            array.array("I", [0]) * (bucketLength - truncatedBucketLength)
+
+        return truncatedBucketLength
+
+    def _compact(self):
+        oldBucketLocators = self.bucketLocators
+        oldStorage = self.storage
+
+        self.bucketLocators = array.array("I", [0]) * len(oldBucketLocators)
+        self.storageIndex = 1
+
+        for bucketIndex in range(0, len(oldBucketLocators), 2):
+            length = oldBucketLocators[bucketIndex + 1]
+
+            if length == 0:
+                continue
+
+            self.bucketLocators[bucketIndex] = self.storageIndex
+            self.bucketLocators[bucketIndex + 1] = length
+
+            self.storageIndex += max(min(length * 2, self.maximumBucketCapacity), self.minimumBucketCapacity)
+
+        self.storage = array.array("I", [0]) * (self.storageIndex * 8)
+
+        for bucketIndex in range(0, len(oldBucketLocators), 2):
+            sourcePosition = oldBucketLocators[bucketIndex]
+
+            if sourcePosition == 0:
+                continue
+
+            destPosition = self.bucketLocators[bucketIndex]
+            length = self.bucketLocators[bucketIndex + 1]
+
+            self.storage[destPosition:destPosition + length] = oldStorage[sourcePosition:sourcePosition + length]
+
+    def getArraySegmentForBucketIndex(self, bucketIndex, outputObject=None):
+        bucketIndex <<= 1
+
+        startPosition = self.bucketLocators[bucketIndex]
+
+        if startPosition == 0:
+            return None
+
+        if not outputObject:
+            outputObject = self.storage[startPosition:startPosition + self.bucketLocators[bucketIndex + 1]]
+        return outputObject
+
+    def getUsedBucketCount(self):
+        return sum(1 for bucketIndex in range(0, len(self.bucketLocators), 2) if self.bucketLocators[bucketIndex])
+
+    def getTotalElementCount(self):
+        return sum(self.bucketLocators[1::2])
+
+
 class Compressor:
     MinimumSequenceLength = 4
     MaximumSequenceLength = 31
@@ -106,13 +226,13 @@ class Compressor:
         if customHashTable:
             self.prefixHashTable = customHashTable()
         else:
-            self.prefixHashTable = CompressorSimpleHashTable()
+            self.prefixHashTable = CompressorCustomHashTable(self.PrefixHashTableSize)
 
     def _compressUtf8Block(self, utf8Bytes):
         if not utf8Bytes:
-            return list()
+            return bytearray()
 
-        self.outputBuffer = list()
+        self.outputBuffer = bytearray()
         self.outputBufferPosition = 0
 
         # const
@@ -244,7 +364,7 @@ class Compressor:
             self._outputRawByte(distance & 255)
 
     def _outputRawByte(self, value):
-        self.outputBuffer.insert(self.outputBufferPosition, value)
+        self.outputBuffer.append(value)
         self.outputBufferPosition += 1
 
     def _cropAndAddNewBytesToInputBuffer(self, newInput):
@@ -279,6 +399,84 @@ class Compressor:
         return self.compressBlockToBytes(input_bytes).decode("utf-8")
 
 
+# Splits compressed input into literal runs and the pointer sequences between them. A
+# pointer starts with a byte that has its two high bits set and is not followed by a
+# UTF-8 continuation byte, and is three bytes long if the distance needs 15 bits.
+_POINTER_SPLIT = re.compile(b'([\xc0-\xdf][\x00-\x7f]|[\xe0-\xff][\x00-\x7f][\x00-\xff])')
+# A 3 byte pointer cut off by the end of the input
+_TRUNCATED_POINTER = re.compile(b'[\xe0-\xff][\x00-\x7f]\\Z')
+
+
+def _decompressBlockInto(inputBytes, output):
+    """
+    Decode a block of compressed bytes, appending the output to the bytearray output.
+
+    The input is split into literal runs and pointers in one pass of the regex engine,
+    literal runs are appended as they are and matches are copied as slices of the output,
+    repeating the copied span for overlapping matches.
+
+    Returns the input position at which decoding stopped because the rest of the input
+    is a truncated sequence.
+    """
+    parts = _POINTER_SPLIT.split(inputBytes)
+    inputLength = len(inputBytes)
+
+    # A leading byte at the very end of the input may start either a codepoint or a
+    # pointer, and a 3 byte pointer may be missing its last byte. Keep either as the
+    # remainder to be decoded with the next buffer
+    trailing = parts[-1]
+    if trailing and trailing[-1] >= 192:
+        truncatedLength = 1
+    elif _TRUNCATED_POINTER.search(trailing):
+        truncatedLength = 2
+    else:
+        truncatedLength = 0
+    if truncatedLength:
+        parts[-1] = trailing[:-truncatedLength]
+        inputLength -= truncatedLength
+
+    output += parts[0]
+    remainingParts = iter(parts)
+    next(remainingParts)
+    # Every pointer is followed by the literal run up to the next one, which may be empty
+    for pointer, literal in zip(remainingParts, remainingParts):
+        inputValue = pointer[0]
+        matchLength = inputValue & 31
+        if inputValue < 224:  # 2 byte pointer type, distance was smaller than 128
+            matchDistance = pointer[1]
+        else:  # 3 byte pointer type, distance was greater or equal to 128
+            matchDistance = (pointer[1] << 8) | pointer[2]  # Big endian
+
+        matchPosition = len(output) - matchDistance
+        # Corrupt input, usually data decrypted with the wrong key, could otherwise point
+        # before the start of the output or loop forever on a zero distance
+        if matchPosition < 0 or matchDistance == 0:
+            raise ValueError('invalid match distance %d at output position %d' % (matchDistance, len(output)))
+        if matchDistance >= matchLength:
+            output += output[matchPosition:matchPosition + matchLength]
+        else:
+            # Overlapping match: the output repeats with a period of matchDistance, so
+            # repeat one period until it is long enough
+            output += (output[matchPosition:] * (matchLength // matchDistance + 1))[:matchLength]
+        output += literal
+    return inputLength
+
+
+def _truncatedMultibyteSequenceLength(output, outputPosition):
+    """
+    Return the number of trailing output bytes that form an incomplete UTF-8 codepoint.
+    """
+    for offset in range(1, 4):
+        if outputPosition - offset < 0:
+            return 0
+        value = output[outputPosition - offset]
+        if ((value >> 3 == 30) or  # Leading byte of a 4 byte UTF8 sequence
+                (offset < 3 and value >> 4 == 14) or  # Leading byte of a 3 byte UTF8 sequence
+                (offset < 2 and value >> 5 == 6)):  # Leading byte of a 2 byte UTF8 sequence
+            return offset
+    return 0
+
+
 class Decompressor:
     """
     LZ-UTF8 Decompressor
@@ -294,88 +492,110 @@ class Decompressor:
         self.inputBufferRemainder = None
         self.outputBufferRemainder = None
 
-    def _outputByte(self, value):
-        self.outputBuffer.append(value)
-        self.outputPosition += 1
-
-    def _cropOutputBufferToWindowAndInitialize(self, initialCapacity):
+    def _cropOutputBufferToWindowAndInitialize(self):
         if not self.outputBuffer:
-            self.outputBuffer = []
+            self.outputBuffer = bytearray()
             return 0
 
+        # Keep only the last window of output so that memory use stays bounded
+        # across blocks. Bytes rolled back from the previous block still follow
+        # outputPosition in the buffer and become the start of this block's output.
         cropLength = min(self.outputPosition, Decompressor.MAXIMUMMATCHDISTANCE)
-        self.outputBuffer = self.outputBuffer[(self.outputPosition - cropLength):cropLength]
-
-        self.outputPosition = cropLength
+        remainderLength = len(self.outputBufferRemainder) if self.outputBufferRemainder else 0
+        del self.outputBuffer[self.outputPosition + remainderLength:]
+        del self.outputBuffer[:self.outputPosition - cropLength]
 
-        if self.outputBufferRemainder:
-            for i in range(len(self.outputBufferRemainder)):
-                self._outputByte(self.outputBufferRemainder[i])
-            self.outputBufferRemainder = None
+        self.outputPosition = cropLength + remainderLength
+        self.outputBufferRemainder = None
         return cropLength
 
     def _rollBackIfOutputBufferEndsWithATruncatedMultibyteSequence(self):
-        for offset in range(1, 5):
-            if self.outputPosition - offset < 0:
-                return
-            value = self.outputBuffer[self.outputPosition - offset]
-            if ((offset < 4 and rshift(value, 3) == 30) or  # Leading byte of a 4 byte UTF8 sequence
-                (offset < 3 and rshift(value, 4) == 14) or  # Leading byte of a 3 byte UTF8 sequence
-                (offset < 2 and rshift(value, 5) == 6)):  # Leading byte of a 2 byte UTF8 sequence
-
-                self.outputBufferRemainder = self.outputBuffer[self.outputPosition - offset, self.outputPosition]
-                self.outputPosition = self.outputPosition - offset
-                return
-
-    def decompressBlock(self, input_list):
+        offset = _truncatedMultibyteSequenceLength(self.outputBuffer, self.outputPosition)
+        if offset:
+            self.outputBufferRemainder = bytes(self.outputBuffer[self.outputPosition - offset:self.outputPosition])
+            self.outputPosition = self.outputPosition - offset
+
+    def _decompressBlockToBuffer(self, input_bytes):
+        """
+        Decompress a block into the internal window buffer and return the start offset of its output.
+        """
+        if not isinstance(input_bytes, (bytes, bytearray, memoryview)):
+            input_bytes = bytes(input_bytes)
+
         if self.inputBufferRemainder:
-            input_list = self.inputBufferRemainder + input_list
-            self.inputBufferRemainder = []
-
-        outputStartPosition = self._cropOutputBufferToWindowAndInitialize(max(len(input_list) * 4, 1024))
-
-        inputLength = len(input_list)
-        readPosition = 0
-        while readPosition < inputLength:
-            inputValue = input_list[readPosition]
-            if rshift(inputValue, 6) != 3:
-                # If at the continuation byte of a UTF-8 codepoint sequence, output the literal value and continue
-                self._outputByte(inputValue)
-                # increment read position
-                readPosition += 1
-                continue
-            # At this point it is known that the current byte is the lead byte of either a UTF-8 codepoint or a sized pointer sequence.
-            sequenceLengthIdentifier = rshift(inputValue, 5)  # 6 for 2 bytes, 7 for at least 3 bytes
-            # If bytes in read position imply the start of a truncated input sequence (either a literal codepoint or a pointer)
-            # keep the remainder to be decoded with the next buffer
-            if readPosition == (inputLength - 1) or (readPosition == (inputLength - 2) and
-                                                     sequenceLengthIdentifier == 7):
-                self.inputBufferRemainder = input_list[readPosition:]
-                break
-            # If at the leading byte of a UTF-8 codepoint byte sequence
-            if rshift(input_list[readPosition + 1], 7) == 1:
-                # Output the literal value
-                self._outputByte(inputValue)
-            else:
-                # Beginning of a pointer sequence
-                matchLength = inputValue & 31
-                matchDistance = 0
-                if sequenceLengthIdentifier == 6:  # 2 byte pointer type, distance was smaller than 128
-                    matchDistance = input_list[readPosition + 1]
-                    readPosition += 1
-                else:  # 3 byte pointer type, distance was greater or equal to 128
-                    matchDistance = (input_list[readPosition + 1] << 8) | (input_list[readPosition + 2])  # Big endian
-                    readPosition += 2
-
-                matchPosition = self.outputPosition - matchDistance
-                # Copy the match bytes to output
-                for offset in range(matchLength):
-                    self._outputByte(self.outputBuffer[matchPosition + offset])
-            # increment read position
-            readPosition += 1
-        self._rollBackIfOutputBufferEndsWithATruncatedMultibyteSequence()
-        return self.outputBuffer[outputStartPosition:(
-            outputStartPosition + (self.outputPosition - outputStartPosition))]
+            input_bytes = self.inputBufferRemainder + bytes(input_bytes)
+            self.inputBufferRemainder = None
 
-    def decompressBlockToString(self, input_list):
-        return bytes(self.decompressBlock(input_list)).decode("utf-8")
+        outputStartPosition = self._cropOutputBufferToWindowAndInitialize()
+
+        readPosition = _decompressBlockInto(input_bytes, self.outputBuffer)
+        self.outputPosition = len(self.outputBuffer)
+        if readPosition < len(input_bytes):
+            self.inputBufferRemainder = bytes(input_bytes[readPosition:])
+
+        self._rollBackIfOutputBufferEndsWithATruncatedMultibyteSequence()
+        return outputStartPosition
+
+    def decompressBlock(self, input_bytes):
+        outputStartPosition = self._decompressBlockToBuffer(input_bytes)
+        return bytes(self.outputBuffer[outputStartPosition:self.outputPosition])
+
+    def decompressBlockToString(self, input_bytes):
+        outputStartPosition = self._decompressBlockToBuffer(input_bytes)
+        with memoryview(self.outputBuffer) as output:
+            return str(output[outputStartPosition:self.outputPosition], "utf-8")
+
+    def decompressInto(self, input_bytes, buffer, offset=0):
+        """
+        Decompress a complete block directly into a caller supplied buffer, starting at offset.
+
+        A bytearray is grown if the output does not fit, any other writable buffer (e.g. a
+        memoryview over preallocated storage) must be large enough or a ValueError is raised.
+        Corrupt or truncated input, or an offset past the end of the buffer, also raises a
+        ValueError, and nothing is written then. This does not use or change the state kept
+        between decompressBlock calls.
+
+        Returns the number of bytes written.
+        """
+        if not isinstance(input_bytes, (bytes, bytearray, memoryview)):
+            input_bytes = bytes(input_bytes)
+
+        if offset < 0 or offset > len(buffer):
+            raise ValueError("decompressInto: offset %d is outside the output buffer" % offset)
+
+        if isinstance(buffer, bytearray) and offset == len(buffer):
+            # Decode in place, matches may refer to what the buffer already holds. Corrupt
+            # or truncated input leaves the buffer as it was
+            try:
+                readPosition = _decompressBlockInto(input_bytes, buffer)
+                if readPosition < len(input_bytes):
+                    raise ValueError("decompressInto: input ends with a truncated sequence")
+            except ValueError:
+                del buffer[offset:]
+                raise
+            outputLength = len(buffer) - offset
+        else:
+            output = bytearray()
+            readPosition = _decompressBlockInto(input_bytes, output)
+            if readPosition < len(input_bytes):
+                raise ValueError("decompressInto: input ends with a truncated sequence")
+            outputLength = len(output)
+            if not isinstance(buffer, bytearray) and offset + outputLength > len(buffer):
+                raise ValueError("decompressInto: output buffer is too small")
+            buffer[offset:offset + outputLength] = output
+        return outputLength
+
+    def decompressStream(self, chunks):
+        """
+        Decompress an iterable of compressed chunks, yielding the decoded text of each one.
+
+        Only the last MAXIMUMMATCHDISTANCE bytes of output are kept between chunks, so memory
+        use does not grow with the size of the stream. Pointers and multibyte sequences that
+        are split across chunk boundaries are carried over to the next chunk.
+        """
+        for chunk in chunks:
+            if not chunk:
+                continue
+            text = self.decompressBlockToString(chunk)
+            if text:
+                yield text
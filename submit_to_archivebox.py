@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import sys
+import shlex
+import argparse
+from xbsync.submit_queue import SubmissionJournal, SubmissionQueue, bookmark_priorities, load_bookmarks_file, submit
+
+def main():
+    #Setup args
+    parser = argparse.ArgumentParser(
+        description='Submit a list of urls to archivebox add in batches over several workers, rate limited per '
+                    'domain, with a journal so an interrupted run resumes where it stopped')
+
+    parser.add_argument('-c', '--command',
+                        default='archivebox add',
+                        help='command each batch of urls is piped into, defaults to "archivebox add"',
+                        )
+    parser.add_argument('-a', '--archivebox-dir',
+                        help='ArchiveBox data directory to run the command in',
+                        )
+    parser.add_argument('-b', '--batch-size',
+                        type=int,
+                        default=100,
+                        help='urls per batch, defaults to 100',
+                        )
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=2,
+                        help='batches submitted at the same time, defaults to 2',
+                        )
+    parser.add_argument('--domain-interval',
+                        type=float,
+                        default=5.0,
+                        help='seconds a domain waits after a batch with its urls finished before it goes into another batch, defaults to 5',
+                        )
+    parser.add_argument('--bookmarks',
+                        help='bookmark json or ndjson file from get_xbs_bookmarks.py the urls came from, '
+                             'needed for --first-folder and --newest-first',
+                        )
+    parser.add_argument('--first-folder',
+                        dest='first_folders',
+                        action='append',
+                        help='submit urls in this folder path first, with globs as in rules files, '
+                             'can be given several times in order of priority',
+                        )
+    parser.add_argument('--newest-first',
+                        action='store_true',
+                        help='submit the most recently added bookmarks first',
+                        )
+
+    required = parser.add_argument_group('required arguments')
+    required.add_argument('-i', '--input',
+                          required=True,
+                          help='file with one url per line, such as the output of urls_from_xbs_json.py',
+                          )
+    required.add_argument('--journal',
+                          required=True,
+                          help='file to record submitted batches in, urls already recorded as done are skipped',
+                          )
+
+    #Get args
+    args = parser.parse_args()
+    if args.batch_size < 1 or args.workers < 1:
+        parser.error('--batch-size and --workers must be at least 1')
+    if (args.first_folders or args.newest_first) and not args.bookmarks:
+        parser.error('--first-folder and --newest-first need --bookmarks')
+
+    priority = None
+    if args.bookmarks:
+        priority = bookmark_priorities(load_bookmarks_file(args.bookmarks), args.first_folders or (),
+                                       args.newest_first)
+
+    journal = SubmissionJournal(args.journal)
+    with open(args.input, "r") as inputFile:
+        urls = list(dict.fromkeys(line.strip() for line in inputFile if line.strip()))
+    pending = [url for url in urls if url not in journal.done]
+    print("%d urls, %d already submitted" % (len(urls), len(urls) - len(pending)))
+
+    queue = SubmissionQueue(pending, priority, args.domain_interval)
+    try:
+        failures = submit(queue, journal, shlex.split(args.command), args.batch_size, args.workers,
+                          args.archivebox_dir)
+    except KeyboardInterrupt:
+        print("interrupted, run again with the same journal to resume")
+        sys.exit(130)
+    finally:
+        journal.close()
+
+    if failures:
+        print("ERROR: %d batches failed, run again with the same journal to retry them" % failures)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Shared fixtures: a stand-in xBrowserSync api served from a thread, and the helpers
+to build encrypted bookmark payloads for it.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xbsync import http_transport  # noqa: E402
+from xbsync.sync import derive_key  # noqa: E402
+
+TREE = [
+    {'title': 'Menu', 'id': 1, 'children': [
+        {'title': 'Work', 'id': 2, 'children': [
+            {'title': 'Docs', 'url': 'https://docs.python.org/3/', 'id': 3},
+            {'title': 'Ünïcode', 'url': 'https://example.com/ü?utm_source=x', 'id': 4},
+        ]},
+        {'title': 'Private', 'id': 5, 'children': [
+            {'title': 'Secret', 'url': 'https://secret.example.org/', 'id': 6},
+        ]},
+    ]},
+    {'title': 'Other', 'id': 7, 'children': [
+        {'title': '日本', 'url': 'http://example.jp/', 'id': 8},
+    ]},
+]
+
+_keys = {}
+
+
+def key_for(sync_id, password):
+    """
+    Derive the key of a sync once per test session, the derivation is slow on purpose.
+    """
+    if (sync_id, password) not in _keys:
+        _keys[sync_id, password] = derive_key(sync_id, password)
+    return _keys[sync_id, password]
+
+
+def encrypt_bookmarks(tree, sync_id, password):
+    """
+    Return raw encrypted bookmarks the way the api stores them: nonce, ciphertext, tag.
+    """
+    from Cryptodome.Cipher import AES
+    from lzutf8 import Compressor
+    nonce = os.urandom(16)
+    cipher = AES.new(key_for(sync_id, password), AES.MODE_GCM, nonce=nonce)
+    ciphertext, tag = cipher.encrypt_and_digest(Compressor().compressBlockToBytes(json.dumps(tree, ensure_ascii=False)))
+    return nonce + ciphertext + tag
+
+
+class FakeApi:
+    """
+    State of the stand-in api. Tests change it between requests: syncs maps sync IDs to
+    their api fields, fail answers the next requests with 503, resets drops the next
+    connections without an answer and truncate cuts the next response bodies in half.
+    """
+
+    def __init__(self):
+        self.syncs = {}
+        self.requests = []
+        self.connections = 0
+        self.fail = 0
+        self.retry_after = None
+        self.resets = 0
+        self.truncate = 0
+        self.gzip = True
+        self.etags = True
+        self.url = None
+
+    def add_sync(self, sync_id, password, tree=TREE, last_updated='2020-01-01T00:00:00.000Z'):
+        self.set_bookmarks(sync_id, encrypt_bookmarks(tree, sync_id, password), last_updated)
+
+    def set_bookmarks(self, sync_id, data, last_updated='2020-01-01T00:00:00.000Z'):
+        self.syncs[sync_id] = {'bookmarks': base64.b64encode(data).decode('ascii'),
+                               'lastUpdated': last_updated, 'version': '1.1.13'}
+
+    def paths(self):
+        return [path for _, path, _ in self.requests]
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.api.connections += 1
+
+    def log_message(self, *arguments):
+        pass
+
+    def send_body(self, status, body, headers=()):
+        api = self.server.api
+        data = json.dumps(body).encode('utf-8')
+        compressed = api.gzip and 'gzip' in (self.headers.get('Accept-Encoding') or '')
+        if compressed:
+            data = gzip.compress(data)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if api.truncate:
+            api.truncate -= 1
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(data)
+
+    def do_GET(self):
+        api = self.server.api
+        api.requests.append(('GET', self.path, dict(self.headers)))
+        if api.resets:
+            api.resets -= 1
+            #Close with a RST rather than a FIN
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = True
+            return
+        if api.fail:
+            api.fail -= 1
+            headers = [('Retry-After', str(api.retry_after))] if api.retry_after is not None else []
+            return self.send_body(503, {'code': 'ServiceUnavailable'}, headers)
+
+        parts = self.path.strip('/').split('/')
+        if len(parts) < 2 or parts[0] != 'bookmarks' or parts[1] not in api.syncs:
+            return self.send_body(404, {'code': 'SyncNotFoundException'})
+        sync = api.syncs[parts[1]]
+        if parts[2:] == ['lastUpdated']:
+            return self.send_body(200, {'lastUpdated': sync['lastUpdated']})
+        if parts[2:]:
+            return self.send_body(404, {'code': 'NotImplementedException'})
+
+        etag = '"%s"' % hashlib.sha256(json.dumps(sync, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        if api.etags and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(200, sync, [('ETag', etag)] if api.etags else [])
+
+
+@pytest.fixture
+def fake_api():
+    api = FakeApi()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiHandler)
+    server.daemon_threads = True
+    server.api = api
+    api.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield api
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def empty_connection_pool():
+    """
+    Connections pooled by one test would otherwise be reused by the next one.
+    """
+    yield
+    for connection in http_transport.connection_pool.values():
+        connection.close()
+    http_transport.connection_pool.clear()
@@ -0,0 +1,75 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from xbsync.archivebox_index import ArchiveBoxIndex, ArchiveBoxIndexError
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARCHIVED = ['https://example.com/a', 'https://Example.com:443/b/?utm_source=feed#top', 'http://example.org/']
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """
+    An ArchiveBox data directory whose index.sqlite3 has a trimmed down snapshot table.
+    """
+    connection = sqlite3.connect(str(tmp_path / 'index.sqlite3'))
+    connection.execute('CREATE TABLE core_snapshot (id char(32) PRIMARY KEY, url varchar(2000) UNIQUE, '
+                       'timestamp varchar(32), title varchar(512))')
+    connection.executemany('INSERT INTO core_snapshot VALUES (?, ?, ?, ?)',
+                           [('%032x' % i, url, str(1600000000 + i), None) for i, url in enumerate(ARCHIVED)])
+    connection.commit()
+    connection.close()
+    return str(tmp_path)
+
+
+def test_exact_lookup(data_dir):
+    index = ArchiveBoxIndex(data_dir)
+    urls = ['https://example.com/a', 'https://example.com/b', 'http://example.org/', 'https://example.com/a']
+    assert list(index.filter_missing(urls, batch_size=3)) == ['https://example.com/b']
+    assert index.archived == 3
+    index.close()
+
+
+def test_canonical_lookup(data_dir):
+    index = ArchiveBoxIndex(data_dir, canonical=True)
+    urls = ['https://example.com/b', 'HTTPS://EXAMPLE.COM/a/', 'https://example.com/c']
+    assert list(index.filter_missing(urls)) == ['https://example.com/c']
+    index.close()
+
+
+def test_index_is_opened_read_only(data_dir):
+    index = ArchiveBoxIndex(data_dir)
+    with pytest.raises(sqlite3.OperationalError):
+        index.connection.execute("INSERT INTO core_snapshot (id, url) VALUES ('x', 'https://x/')")
+    index.close()
+
+
+def test_missing_and_unreadable_index(tmp_path):
+    with pytest.raises(ArchiveBoxIndexError, match='no ArchiveBox index'):
+        ArchiveBoxIndex(str(tmp_path))
+    sqlite3.connect(str(tmp_path / 'index.sqlite3')).close()
+    with pytest.raises(ArchiveBoxIndexError, match='cannot read'):
+        ArchiveBoxIndex(str(tmp_path))
+
+
+def test_cli_skips_archived_urls(data_dir, tmp_path):
+    bookmarks = [{'title': 'Menu', 'children': [
+        {'title': 'a', 'url': 'https://example.com/a'},
+        {'title': 'b', 'url': 'https://example.com/b'},
+        {'title': 'c', 'url': 'http://example.org/'},
+    ]}]
+    input_path = tmp_path / 'bookmarks.json'
+    input_path.write_text(json.dumps(bookmarks))
+    output_path = tmp_path / 'urls.txt'
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, 'urls_from_xbs_json.py'), '-i', str(input_path),
+         '-o', str(output_path), '-a', data_dir],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+    assert output_path.read_text().split() == ['https://example.com/b']
+    assert 'skipped 2 urls already in ArchiveBox' in result.stdout
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from xbsync.bookmark_rules import RuleError, RuleSet
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rejected_by(lines, url, path=()):
+    rules = RuleSet()
+    rules.add_rules_from_lines(lines)
+    return rules.check_bookmark(url, rules.state_for_path(path))
+
+
+def test_regex_backreference():
+    lines = [r'exclude regex ^https?://([^/.]+)\.example\.com/\1/']
+    assert rejected_by(lines, 'https://docs.example.com/docs/page') == 'url'
+    assert rejected_by(lines, 'https://docs.example.com/blog/page') is None
+
+
+def test_regex_global_flag():
+    lines = ['exclude regex (?i)/LOGIN', 'exclude prefix https://example.org/tmp/']
+    assert rejected_by(lines, 'https://example.com/login') == 'url'
+    assert rejected_by(lines, 'https://example.org/tmp/x') == 'url'
+    assert rejected_by(lines, 'https://example.com/logout') is None
+
+
+def test_regexes_keep_their_own_groups():
+    lines = [r'include regex ^https://(a)\.com/\1$', r'include regex ^https://(b)(c)\.com/\2$']
+    assert rejected_by(lines, 'https://a.com/a') is None
+    assert rejected_by(lines, 'https://bc.com/c') is None
+    assert rejected_by(lines, 'https://bc.com/b') == 'url'
+
+
+def test_plain_regexes_are_joined():
+    rules = RuleSet()
+    rules.add_rules_from_lines(['exclude regex ^https://site%d\\.com/(a|b)/' % i for i in range(50)] +
+                               [r'exclude regex ^https://(x)\.com/\1', 'exclude regex (?i)/LOGIN',
+                                'exclude regex (?P<page>/page)', 'exclude regex (?P<page>/other)'])
+    rules.compile()
+    #Only the backreference, the global flag and the repeated group name stay apart
+    assert [regex.pattern for regex in rules.urls['exclude'].compiled_regexes] == [
+        r'^https://(x)\.com/\1', '(?i)/LOGIN', '(?P<page>/other)']
+    assert rules.check_bookmark('https://site42.com/b/', rules.root_state()) == 'url'
+    assert rules.check_bookmark('https://site42.com/c/', rules.root_state()) is None
+    assert rules.check_bookmark('https://x.com/x', rules.root_state()) == 'url'
+    assert rules.check_bookmark('https://a.com/Login', rules.root_state()) == 'url'
+    assert rules.check_bookmark('https://a.com/other', rules.root_state()) == 'url'
+
+
+def test_folder_names_match_exactly():
+    rules = RuleSet()
+    rules.exclude_folder_name(' Private*')
+    assert rules.state_for_path(['Menu', ' private*']) is None
+    assert rules.state_for_path(['Menu', 'Private*']) is not None
+    assert rules.state_for_path(['Menu', ' Private list']) is not None
+
+
+def test_prefix_suffix_domain_and_folders():
+    lines = ['exclude domain example.com', 'exclude suffix .pdf', 'include folder **/Reading*']
+    assert rejected_by(lines, 'https://sub.example.com/', ['Menu', 'Reading list']) == 'url'
+    assert rejected_by(lines, 'https://other.org/a.pdf', ['Menu', 'Reading list']) == 'url'
+    assert rejected_by(lines, 'https://other.org/', ['Menu', 'Reading list']) is None
+    assert rejected_by(lines, 'https://other.org/', ['Menu']) == 'folder'
+    assert rejected_by(lines, 'ftp://other.org/', ['Reading']) == 'scheme'
+
+
+def test_invalid_regex_is_a_rule_error():
+    with pytest.raises(RuleError, match='line 2'):
+        RuleSet().add_rules_from_lines(['exclude domain example.com', 'exclude regex (unclosed'])
+
+
+def test_cli_reports_bad_rules(tmp_path):
+    rules_path = tmp_path / 'rules.txt'
+    rules_path.write_text('exclude regex (unclosed\n')
+    input_path = tmp_path / 'bookmarks.json'
+    input_path.write_text('[]')
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, 'urls_from_xbs_json.py'), '-i', str(input_path),
+         '-o', str(tmp_path / 'urls.txt'), '-r', str(rules_path)],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 1
+    assert 'ERROR: cannot load rules' in result.stdout
@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from xbsync.bookmark_rules import RuleSet
+from xbsync.bookmarks import filter_flat_bookmarks
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LINES = [
+    json.dumps({'title': 'Docs', 'url': 'https://docs.python.org/3/', 'path': ['Menu', 'Work']}),
+    json.dumps({'title': 'No url', 'path': ['Menu']}),
+    '',
+    json.dumps(['not', 'a', 'record']),
+    '{"title": "torn", "url": "https://exa',
+    json.dumps({'title': '日本', 'url': 'http://example.jp/', 'path': ['Other']}),
+]
+
+
+def test_flat_bookmarks_skip_malformed_lines(capsys):
+    bookmarks = list(filter_flat_bookmarks(LINES, RuleSet(), 'warn'))
+    assert [(bookmark['url'], path) for bookmark, path in bookmarks] == [
+        ('https://docs.python.org/3/', ('Menu', 'Work')), ('http://example.jp/', ('Other',))]
+    printed = capsys.readouterr().out.splitlines()
+    assert printed[0] == 'did not find url in record on line 2'
+    assert printed[1] == 'unexpected record of type list on line 4'
+    assert printed[2].startswith('invalid json on line 5')
+
+    assert len(list(filter_flat_bookmarks(LINES, RuleSet(), 'skip'))) == 2
+    assert capsys.readouterr().out == ''
+
+
+def test_flat_bookmarks_stop_on_malformed_lines():
+    with pytest.raises(ValueError, match='did not find url in record on line 2'):
+        list(filter_flat_bookmarks(LINES, RuleSet(), 'error'))
+
+
+def test_cli_reads_ndjson_with_a_bad_line(tmp_path):
+    (tmp_path / 'bookmarks.ndjson').write_text('\n'.join(LINES) + '\n', encoding='utf-8')
+    command = [sys.executable, os.path.join(REPO, 'urls_from_xbs_json.py'), '-i', str(tmp_path / 'bookmarks.ndjson'),
+               '-o', str(tmp_path / 'urls.txt'), '--input-format', 'ndjson']
+    result = subprocess.run(command + ['--on-malformed', 'skip'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == ''
+    assert (tmp_path / 'urls.txt').read_text().splitlines() == ['https://docs.python.org/3/', 'http://example.jp/']
+
+    result = subprocess.run(command + ['--on-malformed', 'error'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    assert result.returncode != 0
+    assert 'did not find url in record on line 2' in result.stderr
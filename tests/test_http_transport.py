@@ -0,0 +1,148 @@
+import json
+import time
+
+import pytest
+
+from xbsync import http_transport
+from xbsync.http_transport import BadURL, NotModified, open_url
+
+SYNC_ID = '00001111222233334444555566667777'
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Record retry waits instead of sleeping through them.
+    """
+    waits = []
+    monkeypatch.setattr(time, 'sleep', waits.append)
+    return waits
+
+
+def get_json(url, **options):
+    with open_url(url, **options) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def sync_url(fake_api):
+    fake_api.set_bookmarks(SYNC_ID, b'\1' * 5000, '2023-03-03T00:00:00.000Z')
+    return fake_api.url + '/bookmarks/' + SYNC_ID
+
+
+def test_connections_are_reused(fake_api):
+    url = sync_url(fake_api)
+    for _ in range(3):
+        assert get_json(url + '/lastUpdated') == {'lastUpdated': '2023-03-03T00:00:00.000Z'}
+        assert get_json(url)['version'] == '1.1.13'
+    assert fake_api.connections == 1
+    assert list(http_transport.connection_pool) == [('http', fake_api.url.split('//')[1])]
+
+
+def test_partly_read_response_is_not_pooled(fake_api):
+    url = sync_url(fake_api)
+    with open_url(url) as response:
+        response.read(10)
+    assert not http_transport.connection_pool
+    get_json(url)
+    assert fake_api.connections == 2
+
+
+def test_dropped_idle_connection_is_replaced(fake_api, sleeps):
+    url = sync_url(fake_api)
+    get_json(url)
+    fake_api.resets = 1
+    assert get_json(url)['lastUpdated'] == '2023-03-03T00:00:00.000Z'
+    assert fake_api.connections == 2
+    #A stale pooled connection is not a failed attempt
+    assert sleeps == []
+
+
+@pytest.mark.parametrize('compressed', [True, False])
+def test_gzip_is_decoded_in_chunks(fake_api, compressed):
+    fake_api.gzip = compressed
+    url = sync_url(fake_api)
+    with open_url(url) as response:
+        assert (response.getheader('Content-Encoding') == 'gzip') == compressed
+        chunks = []
+        while True:
+            chunk = response.read(100)
+            if not chunk:
+                break
+            assert len(chunk) <= 100
+            chunks.append(chunk)
+    assert json.loads(b''.join(chunks).decode('utf-8')) == fake_api.syncs[SYNC_ID]
+    assert fake_api.requests[-1][2]['Accept-Encoding'] == 'gzip'
+    #The whole body was read, so the connection goes back to the pool
+    assert http_transport.connection_pool
+
+
+def test_5xx_is_retried_with_backoff(fake_api, sleeps):
+    url = sync_url(fake_api)
+    fake_api.fail = 2
+    assert get_json(url)['version'] == '1.1.13'
+    assert len(fake_api.requests) == 3
+    assert sleeps == [http_transport.RETRY_BACKOFF, http_transport.RETRY_BACKOFF * 2]
+    #Retries go over the same kept-alive connection
+    assert fake_api.connections == 1
+
+
+def test_retry_after_is_honoured_up_to_a_limit(fake_api, sleeps):
+    url = sync_url(fake_api)
+    fake_api.fail = 1
+    fake_api.retry_after = 7
+    get_json(url)
+    fake_api.fail = 1
+    fake_api.retry_after = 3600
+    get_json(url)
+    assert sleeps == [7, http_transport.MAX_RETRY_AFTER]
+
+
+def test_gives_up_after_retries(fake_api, sleeps):
+    url = sync_url(fake_api)
+    fake_api.fail = 100
+    with pytest.raises(BadURL, match='HTTP error 503'):
+        get_json(url, retries=2)
+    assert len(fake_api.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_resets_are_retried_then_raised(fake_api, sleeps):
+    url = sync_url(fake_api)
+    fake_api.resets = 2
+    assert get_json(url)['version'] == '1.1.13'
+    assert fake_api.connections == 3
+    assert len(sleeps) == 2
+
+    http_transport.connection_pool.clear()
+    fake_api.resets = 100
+    with pytest.raises(OSError):
+        get_json(url, retries=1)
+
+
+def test_4xx_is_not_retried(fake_api, sleeps):
+    with pytest.raises(BadURL, match='HTTP error 404'):
+        get_json(fake_api.url + '/bookmarks/unknown')
+    assert len(fake_api.requests) == 1
+    assert sleeps == []
+    #The error body was read, so the connection can still be reused
+    get_json(sync_url(fake_api))
+    assert fake_api.connections == 1
+
+
+def test_etag_revalidation(fake_api):
+    url = sync_url(fake_api)
+    with open_url(url) as response:
+        etag = response.getheader('ETag')
+        response.read()
+    assert etag
+    with pytest.raises(NotModified):
+        get_json(url, etag=etag)
+    assert fake_api.requests[-1][2]['If-None-Match'] == etag
+
+    #Changed bookmarks get a full response and a new ETag
+    fake_api.set_bookmarks(SYNC_ID, b'\2' * 100, '2023-03-04T00:00:00.000Z')
+    with open_url(url, etag=etag) as response:
+        assert response.status == 200
+        assert response.getheader('ETag') != etag
+        assert json.loads(response.read().decode('utf-8'))['lastUpdated'] == '2023-03-04T00:00:00.000Z'
+    assert fake_api.connections == 1
@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import TREE
+from xbsync import json_stream
+from xbsync.json_stream import iter_node_events, iter_tree_events
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Escapes, surrogate pairs and multibyte characters, repeated so that some straddle every window end
+ESCAPED = 'quote " backslash \\ tab \t newline \n é   😀 \\u0041 /slash/ '
+
+
+def make_tree(depth=60):
+    """
+    Return a bookmark tree with a deep chain of folders, folders with keys before and after
+    their children, a folder with children before its title, and bookmarks without urls.
+    """
+    folder = {'title': 'Deepest', 'children': [{'title': 'deep', 'url': 'https://deep.example.com/'}]}
+    for level in range(depth):
+        folder = {'title': 'Level %d %s' % (level, ESCAPED * (level % 3)), 'id': level, 'children': [
+            {'title': ESCAPED * (level % 5), 'url': 'https://example.com/%d?q=%s' % (level, ESCAPED * (level % 4))},
+            folder,
+            {'title': 'no url', 'id': level, 'tags': ['a', {'nested': [1, 2, {'children': []}]}]},
+        ], 'dateAdded': level * 1000, 'extra': {'skipped': [ESCAPED, None, True, 1.5e10]}}
+    return [
+        {'title': 'Menu', 'children': [folder, {'title': 'Empty', 'children': []}, {}]},
+        {'children': [{'title': 'first', 'url': 'https://first.example.com/'}], 'title': 'Children first'},
+        {'title': 'Other', 'children': TREE},
+    ]
+
+
+def normalized(events):
+    """
+    Reduce events to what both walks agree on: a streamed folder only holds its keys up to
+    "children".
+    """
+    return [(kind, node['title'] if kind == 'folder' else node) for kind, node in events]
+
+
+@pytest.fixture
+def small_margin(monkeypatch):
+    monkeypatch.setattr(json_stream, 'MARGIN', 64)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 4096])
+@pytest.mark.parametrize('indent', [None, 1])
+def test_stream_matches_json_load(tmp_path, small_margin, chunk_size, indent):
+    tree = make_tree()
+    path = tmp_path / 'bookmarks.json'
+    path.write_text(json.dumps(tree, indent=indent, ensure_ascii=False), encoding='utf-8')
+    with open(str(path), encoding='utf-8') as inputFile:
+        expected = normalized(iter_node_events(json.load(inputFile)))
+    assert normalized(iter_tree_events(str(path), chunk_size)) == expected
+
+
+def test_deeply_nested_folders(tmp_path, small_margin):
+    #Hundreds of folders deep, the stream keeps its own stack of open folders and lists
+    tree = make_tree(400)
+    path = tmp_path / 'bookmarks.json'
+    path.write_text(json.dumps(tree, ensure_ascii=False), encoding='utf-8')
+    events = normalized(iter_tree_events(str(path), 100))
+    assert events == normalized(iter_node_events(tree))
+    assert events.count(('folder', 'Deepest')) == 1
+
+
+def test_stream_with_default_window(tmp_path):
+    #Long enough to be read in several chunks of the default size
+    tree = [{'title': 'Big', 'children': [{'title': ESCAPED * 3, 'url': 'https://example.com/%d' % i}
+                                          for i in range(40000)]}]
+    path = tmp_path / 'bookmarks.json'
+    path.write_text('﻿' + json.dumps(tree, ensure_ascii=False), encoding='utf-8')
+    assert path.stat().st_size > 2 * json_stream.CHUNK_SIZE
+    assert normalized(iter_tree_events(str(path))) == normalized(iter_node_events(tree))
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '[{"title": "Menu", "children": [',
+    '[{"title": "Menu", "children": [{"url": "https://a.com/"}]',
+    '[{"title": "Menu", "children": [] "id": 1}]',
+    '[{"title": "Menu" "children": []}]',
+    '[{"url": "https://a.com/"} {"url": "https://b.com/"}]',
+    '[{1: 2}]',
+    '[{"title": "Menu", "children": [tru]}]',
+    '[] []',
+])
+def test_malformed_input(tmp_path, small_margin, text):
+    path = tmp_path / 'bookmarks.json'
+    path.write_text(text)
+    with pytest.raises(ValueError):
+        list(iter_tree_events(str(path), 7))
+
+
+def test_cli_stream_output_matches_json(tmp_path):
+    path = tmp_path / 'bookmarks.json'
+    path.write_text(json.dumps(make_tree(50), indent=2), encoding='utf-8')
+    outputs = []
+    for input_format in ('json', 'stream'):
+        output = tmp_path / ('urls-%s.txt' % input_format)
+        result = subprocess.run(
+            [sys.executable, os.path.join(REPO, 'urls_from_xbs_json.py'), '-i', str(path), '-o', str(output),
+             '-f', input_format, '-m', 'Level 6 '],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        assert result.returncode == 0, result.stdout
+        outputs.append((output.read_text(encoding='utf-8'), result.stdout))
+    assert outputs[0] == outputs[1]
+    #Level 6 holds the levels below it
+    assert 'https://example.com/7?q=' in outputs[0][0]
+    assert 'https://example.com/6?q=' not in outputs[0][0]
+    assert 'https://deep.example.com/' not in outputs[0][0]
+    assert 'skipping folder Level 6 ' in outputs[0][1]
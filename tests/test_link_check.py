@@ -0,0 +1,190 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from xbsync.link_check import LinkCache, LinkChecker
+from xbsync.snapshot_store import UrlSnapshot
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    """
+    A site with pages that are there, gone, slow, redirecting or picky about HEAD.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *arguments):
+        pass
+
+    def reply(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '5')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(b'hello')
+
+    def route(self):
+        self.server.requests.append((self.command, self.path))
+        path = self.path.split('?')[0]
+        if path == '/slow':
+            time.sleep(1)
+            return self.reply(200)
+        if path in ('/gone', '/gone410'):
+            return self.reply(404 if path == '/gone' else 410)
+        if path == '/redirect':
+            return self.reply(301, [('Location', '/ok')])
+        if path == '/redirect-gone':
+            return self.reply(302, [('Location', '/gone')])
+        if path == '/redirect-down':
+            return self.reply(302, [('Location', 'http://127.0.0.1:1/x')])
+        if path == '/loop':
+            return self.reply(302, [('Location', '/loop')])
+        if path == '/head-gone':
+            return self.reply(404 if self.command == 'HEAD' else 200)
+        if path == '/unavailable':
+            return self.reply(503)
+        return self.reply(200)
+
+    do_GET = do_HEAD = route
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.requests = []
+    server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fake_resolver():
+    """
+    Resolve the made up hosts of these tests: gone.test does not exist, flaky.test fails
+    to resolve for now, and two.test has an address that refuses connections before the
+    one the site listens on.
+    """
+    async def getaddrinfo(host, port, type=0):
+        if host == 'gone.test':
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        if host == 'flaky.test':
+            raise socket.gaierror(socket.EAI_AGAIN, 'Temporary failure in name resolution')
+        addresses = ['127.0.0.2', '127.0.0.1'] if host == 'two.test' else ['127.0.0.1']
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port)) for address in addresses]
+    return getaddrinfo
+
+
+def check(urls, timeout=5.0, **options):
+    checker = LinkChecker(timeout=timeout, **options)
+    checker.loop.getaddrinfo = fake_resolver()
+    dead = []
+    try:
+        alive = list(checker.filter_alive(urls, dead.append))
+    finally:
+        checker.close()
+    return alive, dead, checker
+
+
+def test_only_gone_pages_and_hosts_are_dead(site):
+    port = site.server_address[1]
+    live = [site.url + path for path in ('/ok', '/redirect', '/loop', '/head-gone', '/unavailable')]
+    live += ['http://flaky.test:%d/' % port, 'http://two.test:%d/ok' % port, site.url + '/redirect-down',
+             'ftp://example.com/file']
+    dead = [site.url + path for path in ('/gone', '/gone410', '/redirect-gone')] + ['http://gone.test/']
+    alive, found_dead, checker = check(live[:4] + dead + live[4:])
+    assert alive == live
+    assert found_dead == dead
+    assert checker.dead == {'status 404': 2, 'status 410': 1, 'nxdomain': 1}
+    assert checker.failed == {'dns': 1, 'connect': 1}
+    #HEAD answered with an error is asked again with GET
+    assert ('GET', '/head-gone') in site.requests
+
+
+def test_timeouts_are_kept_and_not_cached(site, tmp_path):
+    cache_path = str(tmp_path / 'link-cache.json')
+    urls = [site.url + '/slow', site.url + '/gone', site.url + '/ok', 'http://flaky.test/', 'http://gone.test/']
+    alive, dead, checker = check(urls, timeout=0.3, cache=LinkCache(cache_path, 3600))
+    assert alive == [site.url + '/slow', site.url + '/ok', 'http://flaky.test/']
+    assert checker.failed == {'timeout': 1, 'dns': 1}
+    with open(cache_path) as cacheFile:
+        assert sorted(json.load(cacheFile)) == sorted([site.url + '/gone', site.url + '/ok', 'http://gone.test/'])
+
+    del site.requests[:]
+    alive, dead, checker = check(urls, timeout=0.3, cache=LinkCache(cache_path, 3600))
+    assert checker.cached == 3
+    assert checker.checked == 2
+    assert dead == [site.url + '/gone', 'http://gone.test/']
+    assert [path for _, path in site.requests] == ['/slow']
+
+
+def test_old_cache_entries_of_failures_are_ignored(site, tmp_path):
+    cache_path = tmp_path / 'link-cache.json'
+    cache_path.write_text(json.dumps({site.url + '/ok': [True, 'timeout', time.time()],
+                                      site.url + '/x': [True, 'connect', time.time()]}))
+    alive, dead, checker = check([site.url + '/ok', site.url + '/x'], cache=LinkCache(str(cache_path), 3600))
+    assert dead == []
+    assert checker.checked == 2
+
+
+def test_connections_are_reused_per_host(site):
+    urls = [site.url + '/page%d' % i for i in range(40)]
+    alive, dead, checker = check(urls)
+    assert alive == urls
+    assert site.connections <= 2
+
+
+def test_dead_links_file_is_merged(site, tmp_path):
+    dead_path = tmp_path / 'dead.txt'
+    dead_path.write_text('https://earlier.example.com/\n' + site.url + '/gone\n')
+    urls = [site.url + '/gone', site.url + '/gone410', site.url + '/ok']
+    check(urls, dead_path=str(dead_path))
+    check(urls, dead_path=str(dead_path))
+    assert dead_path.read_text().splitlines() == ['https://earlier.example.com/', site.url + '/gone',
+                                                  site.url + '/gone410']
+
+
+def test_dead_urls_stay_out_of_the_snapshot(site, tmp_path):
+    bookmarks = [{'title': 'Menu', 'children': [{'title': path, 'url': site.url + path}
+                                                for path in ('/ok', '/gone', '/redirect')]}]
+    input_path = tmp_path / 'bookmarks.json'
+    input_path.write_text(json.dumps(bookmarks))
+    snapshot_path = str(tmp_path / 'urls.snapshot')
+    command = [sys.executable, os.path.join(REPO, 'urls_from_xbs_json.py'), '-i', str(input_path),
+               '-o', str(tmp_path / 'urls.txt'), '--snapshot', snapshot_path,
+               '--dead-links', str(tmp_path / 'dead.txt'), '--link-cache', str(tmp_path / 'link-cache.json')]
+
+    first = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert first.returncode == 0, first.stdout
+    assert (tmp_path / 'urls.txt').read_text().splitlines() == [site.url + '/ok', site.url + '/redirect']
+    assert (tmp_path / 'dead.txt').read_text().splitlines() == [site.url + '/gone']
+    assert 'skipped 1 dead urls (1 status 404)' in first.stdout
+
+    #The dead url is compared as new again and found dead in the link cache
+    second = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert second.returncode == 0, second.stdout
+    assert (tmp_path / 'urls.txt').read_text() == ''
+    assert 'skipped 2 urls already in the snapshot' in second.stdout
+    assert 'skipped 1 dead urls (1 status 404)' in second.stdout
+    assert '1 known from the link cache' in second.stdout
+    assert (tmp_path / 'dead.txt').read_text().splitlines() == [site.url + '/gone']
+
+    snapshot = UrlSnapshot(snapshot_path)
+    assert list(snapshot.diff([site.url + '/ok', site.url + '/gone', site.url + '/redirect'])) == [site.url + '/gone']
+    snapshot.close()
@@ -0,0 +1,232 @@
+import random
+
+import pytest
+
+from lzutf8 import Compressor, CompressorCustomHashTable, CompressorSimpleHashTable, Decompressor
+
+WORDS = ['bookmark', 'folder', 'https://', 'example.com', 'Überblick', 'café', '日本語', 'документация',
+         '😀', 'naïve', 'reading list', '"title":', '"url":', '{', '}', ',']
+
+
+def make_text(size, seed=0):
+    rand = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = rand.choice(WORDS)
+        words.append(word)
+        length += len(word.encode('utf-8')) + 1
+    return ' '.join(words)
+
+
+def reference_decompress(data):
+    """
+    Decode one block a byte at a time, the way the original lzutf8 decoder does.
+    """
+    output = bytearray()
+    position = 0
+    while position < len(data):
+        value = data[position]
+        if value >> 6 != 3 or (position + 1 < len(data) and data[position + 1] >> 7 == 1):
+            output.append(value)
+            position += 1
+            continue
+        length = value & 31
+        if value >> 5 == 6:
+            distance = data[position + 1]
+            position += 2
+        else:
+            distance = (data[position + 1] << 8) | data[position + 2]
+            position += 3
+        for _ in range(length):
+            output.append(output[-distance])
+    return bytes(output)
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_round_trip_matches_reference():
+    text = make_text(20000)
+    compressed = Compressor().compressBlockToBytes(text)
+    assert len(compressed) < len(text.encode('utf-8')) // 2
+    assert reference_decompress(compressed) == text.encode('utf-8')
+    assert Decompressor().decompressBlockToString(compressed) == text
+
+
+def test_stream_split_at_every_offset():
+    text = make_text(1500, seed=1)
+    compressed = Compressor().compressBlockToBytes(text)
+    for offset in range(len(compressed) + 1):
+        chunks = [compressed[:offset], compressed[offset:]]
+        assert ''.join(Decompressor().decompressStream(chunks)) == text, offset
+
+
+@pytest.mark.parametrize('size', range(1, 9))
+def test_stream_in_small_chunks(size):
+    #With chunks this small, pointers and multibyte codepoints are split across chunks
+    text = make_text(3000, seed=size)
+    compressed = Compressor().compressBlockToBytes(text)
+    assert ''.join(Decompressor().decompressStream(chunked(compressed, size))) == text
+
+
+def test_pointer_split_across_chunks():
+    #A 3 byte pointer to a distance of 200, cut after its first and after its second byte
+    literal = bytes(range(32, 127)) * 3
+    compressed = literal[:230] + bytes([0xe0 | 10, 0, 200]) + b'!'
+    expected = literal[:230] + literal[30:40] + b'!'
+    for cut in (231, 232):
+        chunks = [compressed[:cut], compressed[cut:]]
+        assert ''.join(Decompressor().decompressStream(chunks)).encode('ascii') == expected
+
+
+def test_stream_memory_stays_within_the_window():
+    text = make_text(300000, seed=2)
+    compressed = Compressor().compressBlockToBytes(text)
+    decompressor = Decompressor()
+    pieces = []
+    for piece in decompressor.decompressStream(chunked(compressed, 4096)):
+        pieces.append(piece)
+        assert len(decompressor.outputBuffer) <= Decompressor.MAXIMUMMATCHDISTANCE + 4096 * 32
+    assert ''.join(pieces) == text
+
+
+def test_compressed_in_several_blocks():
+    text = make_text(5000, seed=3)
+    raw = text.encode('utf-8')
+    compressor = Compressor()
+    chunks = [compressor.compressBlockToBytes(part) for part in chunked(raw, 777)]
+    assert ''.join(Decompressor().decompressStream(chunks)) == text
+
+
+def test_overlapping_matches():
+    #Distance 1 repeats one byte, distance 3 repeats a period of three bytes
+    assert Decompressor().decompressBlock(b'a' + bytes([0xc0 | 20, 1])) == b'a' * 21
+    assert Decompressor().decompressBlock(b'abc' + bytes([0xc0 | 31, 3]) + b'!') == b'abc' * 11 + b'a!'
+    text = 'x' * 1000 + 'abcabc' * 500
+    compressed = Compressor().compressBlockToBytes(text)
+    assert Decompressor().decompressBlockToString(compressed) == text
+    assert reference_decompress(compressed) == text.encode('ascii')
+
+
+def test_match_at_the_window_edge():
+    rand = random.Random(4)
+    literal = bytes(rand.randrange(32, 127) for _ in range(Decompressor.MAXIMUMMATCHDISTANCE))
+    compressed = literal + bytes([0xe0 | 8, 0x7f, 0xff])
+    expected = literal + literal[:8]
+    assert Decompressor().decompressBlock(compressed) == expected
+    #Streamed, the match reaches back to the first chunk of the window
+    chunks = chunked(compressed, 1000)
+    assert ''.join(Decompressor().decompressStream(chunks)).encode('ascii') == expected
+
+    #The compressor finds a repeat exactly a window away, but not one further back
+    for distance in (Decompressor.MAXIMUMMATCHDISTANCE, Decompressor.MAXIMUMMATCHDISTANCE + 1):
+        filler = ''.join(chr(rand.randrange(0x41, 0x5b)) for _ in range(distance - 20))
+        text = 'QQQQqqqqWWWWwwwwEEEE' + filler + 'QQQQqqqqWWWWwwwwEEEE'
+        compressed = Compressor().compressBlockToBytes(text)
+        assert Decompressor().decompressBlockToString(compressed) == text
+        assert reference_decompress(compressed) == text.encode('ascii')
+
+
+@pytest.mark.parametrize('compressed', [
+    b'abc' + bytes([0xc0 | 4, 5]),
+    bytes([0xc0 | 4, 1]),
+    b'abc' + bytes([0xc0 | 4, 0]),
+    b'abc' + bytes([0xe0 | 4, 0x10, 0x00]),
+])
+def test_invalid_match_distance(compressed):
+    with pytest.raises(ValueError, match='invalid match distance'):
+        Decompressor().decompressBlock(compressed)
+    with pytest.raises(ValueError, match='invalid match distance'):
+        list(Decompressor().decompressStream(chunked(compressed, 2)))
+
+
+@pytest.mark.parametrize('tail', [bytes([0xe0 | 4]), bytes([0xe0 | 4, 0]), bytes([0xc0 | 4])])
+def test_truncated_pointer(tail):
+    compressed = b'abcdefgh' + tail
+    #Streaming keeps the start of the pointer for the next chunk
+    assert Decompressor().decompressBlock(compressed) == b'abcdefgh'
+    with pytest.raises(ValueError, match='truncated'):
+        Decompressor().decompressInto(compressed, bytearray())
+
+
+def test_decompress_into_bytearray():
+    text = make_text(2000, seed=5)
+    compressed = Compressor().compressBlockToBytes(text)
+    buffer = bytearray(b'header:')
+    assert Decompressor().decompressInto(compressed, buffer, len(buffer)) == len(text.encode('utf-8'))
+    assert buffer == b'header:' + text.encode('utf-8')
+
+    #Overwriting inside the buffer grows it as needed
+    buffer = bytearray(b'0123456789')
+    written = Decompressor().decompressInto(compressed, buffer, 4)
+    assert buffer == b'0123' + text.encode('utf-8')
+    assert written == len(text.encode('utf-8'))
+
+
+def test_decompress_into_memoryview():
+    text = make_text(2000, seed=6)
+    raw = text.encode('utf-8')
+    compressed = Compressor().compressBlockToBytes(text)
+    storage = bytearray(len(raw) + 10)
+    assert Decompressor().decompressInto(compressed, memoryview(storage), 10) == len(raw)
+    assert storage[10:] == raw
+
+    small = bytearray(b'.' * (len(raw) - 1))
+    with pytest.raises(ValueError, match='too small'):
+        Decompressor().decompressInto(compressed, memoryview(small))
+    assert small == b'.' * (len(raw) - 1)
+
+
+def test_decompress_into_leaves_the_buffer_alone_on_errors():
+    buffer = bytearray(b'kept')
+    for compressed in (b'abc' + bytes([0xc0 | 4, 9]), b'abcdefgh' + bytes([0xe0 | 4, 0])):
+        with pytest.raises(ValueError):
+            Decompressor().decompressInto(compressed, buffer, len(buffer))
+        assert buffer == b'kept'
+    storage = bytearray(b'.' * 20)
+    with pytest.raises(ValueError, match='truncated'):
+        Decompressor().decompressInto(b'abcdefgh' + bytes([0xe0 | 4]), memoryview(storage))
+    assert storage == b'.' * 20
+    with pytest.raises(ValueError, match='outside the output buffer'):
+        Decompressor().decompressInto(b'abc', buffer, len(buffer) + 1)
+    assert buffer == b'kept'
+
+
+def test_full_bucket_keeps_its_newest_values():
+    table = CompressorCustomHashTable(17)
+    for value in range(1, 201):
+        table.addValueToBucket(3, value)
+        bucket = list(table.getArraySegmentForBucketIndex(3))
+        assert len(bucket) < CompressorCustomHashTable.maximumBucketCapacity
+        assert bucket == list(range(value - len(bucket) + 1, value + 1))
+    assert table.getUsedBucketCount() == 1
+    assert table.getArraySegmentForBucketIndex(4) is None
+
+
+def test_compaction_keeps_every_bucket():
+    table = CompressorCustomHashTable(101)
+    simple = CompressorSimpleHashTable()
+    rand = random.Random(7)
+    #Enough growing buckets to run out of storage several times
+    for value in range(1, 20000):
+        bucketIndex = rand.randrange(101)
+        table.addValueToBucket(bucketIndex, value)
+        simple.addValueToBucket(bucketIndex, value)
+    for bucketIndex in range(101):
+        expected = simple.getArraySegmentForBucketIndex(bucketIndex)
+        bucket = list(table.getArraySegmentForBucketIndex(bucketIndex))
+        assert bucket == expected[len(expected) - len(bucket):]
+        assert len(bucket) >= CompressorCustomHashTable.maximumBucketCapacity // 2
+    assert table.getUsedBucketCount() == 101
+
+
+def test_evicting_compressor_output_decodes_with_the_reference():
+    #Very repetitive input overflows the buckets of its common prefixes
+    text = ('{"url": "https://example.com/%d"}, ' * 5) * 600 % tuple(range(3000))
+    for hashTable in (CompressorCustomHashTable, CompressorSimpleHashTable):
+        compressed = Compressor(hashTable).compressBlockToBytes(text)
+        assert len(compressed) < len(text) // 2
+        assert reference_decompress(compressed) == text.encode('ascii')
+        assert Decompressor().decompressBlockToString(compressed) == text
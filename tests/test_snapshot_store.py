@@ -0,0 +1,105 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from xbsync import snapshot_store
+from xbsync.snapshot_store import UrlSnapshot
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(path, urls, excluded=()):
+    """
+    Compare urls with the snapshot at path and commit them, return (added, removed).
+    """
+    snapshot = UrlSnapshot(path)
+    try:
+        added = list(snapshot.diff(urls))
+        removed = list(snapshot.removed_urls())
+        for url in excluded:
+            snapshot.exclude(url)
+        snapshot.commit()
+    finally:
+        snapshot.close()
+    return added, removed
+
+
+def test_added_and_removed_across_runs(tmp_path):
+    path = str(tmp_path / 'urls.snapshot')
+    first = ['https://c.com/', 'https://a.com/ü', 'https://b.com/', 'https://a.com/ü']
+    assert run(path, first) == (['https://c.com/', 'https://a.com/ü', 'https://b.com/'], [])
+
+    added, removed = run(path, ['https://d.com/', 'https://b.com/', 'https://e.com/'])
+    assert added == ['https://d.com/', 'https://e.com/']
+    assert sorted(removed) == ['https://a.com/ü', 'https://c.com/']
+
+    snapshot = UrlSnapshot(path)
+    assert list(snapshot.diff(['https://e.com/', 'https://d.com/', 'https://b.com/'])) == []
+    assert snapshot.unchanged == 3
+    snapshot.close()
+
+
+def test_excluded_urls_stay_out_of_the_snapshot(tmp_path):
+    path = str(tmp_path / 'urls.snapshot')
+    urls = ['https://a.com/', 'https://dead.com/', 'https://b.com/']
+    assert run(path, urls, excluded=['https://dead.com/'])[0] == urls
+    #The excluded url is new again, and was never in the snapshot to be removed
+    assert run(path, urls[:2]) == (['https://dead.com/'], ['https://b.com/'])
+
+
+def test_interrupted_run_leaves_the_snapshot_untouched(tmp_path, monkeypatch):
+    path = tmp_path / 'urls.snapshot'
+    run(str(path), ['https://a.com/', 'https://b.com/'])
+    before = path.read_bytes()
+
+    def interrupted():
+        yield 'https://c.com/'
+        raise KeyboardInterrupt
+    snapshot = UrlSnapshot(str(path))
+    with pytest.raises(KeyboardInterrupt):
+        list(snapshot.diff(interrupted()))
+    snapshot.close()
+    assert path.read_bytes() == before
+
+    def fail(*arguments):
+        raise OSError('disk full')
+    monkeypatch.setattr(snapshot_store.shutil, 'copyfileobj', fail)
+    snapshot = UrlSnapshot(str(path))
+    list(snapshot.diff(['https://c.com/']))
+    with pytest.raises(OSError):
+        snapshot.commit()
+    snapshot.close()
+    assert path.read_bytes() == before
+    assert os.listdir(str(tmp_path)) == ['urls.snapshot']
+
+
+def test_unreadable_snapshot_is_ignored(tmp_path, capsys):
+    path = tmp_path / 'urls.snapshot'
+    path.write_bytes(b'XBSSNAP1' + b'\xff' * 8)
+    assert run(str(path), ['https://a.com/']) == (['https://a.com/'], [])
+    assert 'WARNING: ignoring unreadable snapshot' in capsys.readouterr().out
+    assert run(str(path), ['https://a.com/']) == ([], [])
+
+
+def test_cli_writes_removed_urls(tmp_path):
+    def write_bookmarks(urls):
+        bookmarks = [{'title': 'Menu', 'children': [{'title': url, 'url': url} for url in urls]}]
+        (tmp_path / 'bookmarks.json').write_text(json.dumps(bookmarks))
+    command = [sys.executable, os.path.join(REPO, 'urls_from_xbs_json.py'), '-i', str(tmp_path / 'bookmarks.json'),
+               '-o', str(tmp_path / 'urls.txt'), '--snapshot', str(tmp_path / 'urls.snapshot'),
+               '--removed', str(tmp_path / 'removed.txt')]
+
+    write_bookmarks(['https://a.com/', 'https://b.com/', 'https://c.com/'])
+    first = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert first.returncode == 0, first.stdout
+    assert (tmp_path / 'removed.txt').read_text() == ''
+
+    write_bookmarks(['https://c.com/', 'https://d.com/', 'https://a.com/'])
+    second = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert second.returncode == 0, second.stdout
+    assert (tmp_path / 'urls.txt').read_text().splitlines() == ['https://d.com/']
+    assert (tmp_path / 'removed.txt').read_text().splitlines() == ['https://b.com/']
+    assert 'skipped 2 urls already in the snapshot, 1 removed since' in second.stdout
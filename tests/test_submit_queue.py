@@ -0,0 +1,158 @@
+import json
+import os
+import subprocess
+import sys
+
+from xbsync.submit_queue import SubmissionJournal, SubmissionQueue, bookmark_priorities, submit
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Stands in for archivebox add: appends the urls it gets to a file, and fails for batches
+#with a url containing the text in the file named by its second argument, if there is one
+FAKE_ARCHIVEBOX = '''
+import os, sys
+urls = sys.stdin.read().split()
+if os.path.exists(sys.argv[2]):
+    with open(sys.argv[2]) as failFile:
+        marker = failFile.read().strip()
+    if any(marker in url for url in urls):
+        sys.exit(3)
+with open(sys.argv[1], "a") as receivedFile:
+    receivedFile.write(" ".join(urls) + "\\n")
+'''
+
+
+def urls_of(domain, count):
+    return ['https://%s/%d' % (domain, i) for i in range(count)]
+
+
+def test_batches_fill_from_several_domains():
+    urls = urls_of('a.com', 5) + urls_of('b.com', 3) + urls_of('c.com', 1)
+    queue = SubmissionQueue(urls, domain_interval=10)
+    batch, wait = queue.next_batch(6, 0)
+    assert batch == ['https://a.com/0', 'https://b.com/0', 'https://c.com/0',
+                     'https://a.com/1', 'https://b.com/1', 'https://a.com/2']
+    #a.com and b.com are held until their batch finished and the interval passed
+    assert queue.next_batch(6, 100) == ([], None)
+    queue.finished(batch, 100)
+    assert queue.next_batch(6, 105) == ([], 5)
+    batch, wait = queue.next_batch(6, 110)
+    assert batch == ['https://a.com/3', 'https://b.com/2', 'https://a.com/4']
+    queue.finished(batch, 120)
+    assert len(queue) == 0
+    assert queue.next_batch(6, 200) == ([], None)
+
+
+def test_domains_left_out_of_a_full_batch_stay_ready():
+    urls = urls_of('a.com', 2) + urls_of('b.com', 2) + urls_of('c.com', 2)
+    queue = SubmissionQueue(urls, domain_interval=10)
+    first, _ = queue.next_batch(2, 0)
+    assert first == ['https://a.com/0', 'https://b.com/0']
+    second, _ = queue.next_batch(2, 0)
+    assert second == ['https://c.com/0', 'https://c.com/1']
+    queue.finished(first, 1)
+    assert queue.next_batch(2, 5) == ([], 6)
+    assert queue.next_batch(2, 11)[0] == ['https://a.com/1', 'https://b.com/1']
+
+
+def test_without_interval_batches_follow_priority():
+    urls = urls_of('a.com', 3) + urls_of('b.com', 2)
+    priorities = {url: (0 if url.startswith('https://b.com') else 1,) for url in urls}
+    queue = SubmissionQueue(urls, priorities.get)
+    assert queue.next_batch(3, 0)[0] == ['https://b.com/0', 'https://b.com/1', 'https://a.com/0']
+    assert queue.next_batch(3, 0)[0] == ['https://a.com/1', 'https://a.com/2']
+
+
+def test_bookmark_priorities():
+    bookmarks = [({'id': 1, 'url': 'https://old.com/'}, ('Menu', 'Other')),
+                 ({'id': 5, 'url': 'https://new.com/'}, ('Menu', 'Other')),
+                 ({'id': 2, 'url': 'https://read.com/?utm_source=x'}, ('Menu', 'Reading list'))]
+    priority = bookmark_priorities(bookmarks, ['Menu/Reading*'], newest_first=True)
+    urls = ['https://old.com/', 'https://new.com/', 'https://read.com/', 'https://unknown.com/']
+    assert sorted(urls, key=priority) == ['https://read.com/', 'https://new.com/', 'https://old.com/',
+                                          'https://unknown.com/']
+
+
+def test_journal_ignores_a_torn_last_line(tmp_path):
+    path = str(tmp_path / 'journal.txt')
+    with open(path, 'w') as journalFile:
+        journalFile.write('done\thttps://a.com/0\nfailed\thttps://a.com/1\nfailed\thttps://a.com/2\n'
+                          'done\thttps://a.com/2\ndone\thttps://a.c')
+    journal = SubmissionJournal(path)
+    assert journal.done == {'https://a.com/0', 'https://a.com/2'}
+    assert journal.failed == {'https://a.com/1'}
+    journal.close()
+
+
+def test_submit_records_batches(tmp_path):
+    script = tmp_path / 'fake_archivebox.py'
+    script.write_text(FAKE_ARCHIVEBOX)
+    (tmp_path / 'fail').write_text('b.com')
+    command = [sys.executable, str(script), str(tmp_path / 'received.txt'), str(tmp_path / 'fail')]
+    journal = SubmissionJournal(str(tmp_path / 'journal.txt'))
+    queue = SubmissionQueue(urls_of('a.com', 4) + urls_of('b.com', 1), domain_interval=0.01)
+    logged = []
+    assert submit(queue, journal, command, batch_size=2, workers=2, log=logged.append) == 1
+    journal.close()
+    assert journal.done == set(urls_of('a.com', 4)) - {'https://a.com/0'}
+    assert journal.failed == {'https://a.com/0', 'https://b.com/0'}
+    assert any(line.startswith('ERROR: batch of 2 urls failed with status 3') for line in logged)
+
+
+def run_script(tmp_path, *extra):
+    return subprocess.run(
+        [sys.executable, os.path.join(REPO, 'submit_to_archivebox.py'), '-i', str(tmp_path / 'urls.txt'),
+         '--journal', str(tmp_path / 'journal.txt'), '-b', '3', '-w', '2', '--domain-interval', '0.01',
+         '-c', '%s %s %s %s' % (sys.executable, tmp_path / 'fake_archivebox.py', tmp_path / 'received.txt',
+                                tmp_path / 'fail')] + list(extra),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=60)
+
+
+def received(tmp_path):
+    with open(str(tmp_path / 'received.txt')) as receivedFile:
+        return [url for line in receivedFile for url in line.split()]
+
+
+def test_resume_and_retry_failed_batches(tmp_path):
+    urls = urls_of('a.com', 6) + urls_of('b.com', 2) + urls_of('c.com', 3)
+    (tmp_path / 'urls.txt').write_text('\n'.join(urls + urls[:2]) + '\n')
+    (tmp_path / 'fake_archivebox.py').write_text(FAKE_ARCHIVEBOX)
+    #An earlier run that was interrupted after its first batch
+    (tmp_path / 'journal.txt').write_text('done\thttps://a.com/0\ndone\thttps://c.com/0\n')
+    (tmp_path / 'fail').write_text('b.com/1')
+
+    first = run_script(tmp_path)
+    assert first.returncode == 1
+    assert '11 urls, 2 already submitted' in first.stdout
+    assert 'run again with the same journal to retry them' in first.stdout
+    submitted = received(tmp_path)
+    assert len(submitted) == len(set(submitted))
+    assert 'https://a.com/0' not in submitted and 'https://b.com/1' not in submitted
+    failed = set(urls) - set(submitted) - {'https://a.com/0', 'https://c.com/0'}
+    assert 'https://b.com/1' in failed
+
+    os.remove(str(tmp_path / 'fail'))
+    os.remove(str(tmp_path / 'received.txt'))
+    second = run_script(tmp_path)
+    assert second.returncode == 0, second.stdout
+    assert '11 urls, %d already submitted' % (11 - len(failed)) in second.stdout
+    assert set(received(tmp_path)) == failed
+
+    third = run_script(tmp_path)
+    assert third.returncode == 0
+    assert '11 urls, 11 already submitted' in third.stdout
+
+
+def test_first_folder_and_newest_first(tmp_path):
+    bookmarks = [{'title': 'Menu', 'children': [
+        {'title': 'Other', 'children': [{'id': 1, 'title': 'old', 'url': 'https://old.com/'},
+                                        {'id': 4, 'title': 'new', 'url': 'https://new.com/'}]},
+        {'title': 'Reading list', 'children': [{'id': 2, 'title': 'read', 'url': 'https://read.com/'}]},
+    ]}]
+    (tmp_path / 'bookmarks.json').write_text(json.dumps(bookmarks))
+    (tmp_path / 'urls.txt').write_text('https://old.com/\nhttps://new.com/\nhttps://read.com/\n')
+    (tmp_path / 'fake_archivebox.py').write_text(FAKE_ARCHIVEBOX)
+    result = run_script(tmp_path, '-w', '1', '-b', '1', '--bookmarks', str(tmp_path / 'bookmarks.json'),
+                        '--first-folder', 'Menu/Reading*', '--newest-first')
+    assert result.returncode == 0, result.stdout
+    assert received(tmp_path) == ['https://read.com/', 'https://new.com/', 'https://old.com/']
@@ -0,0 +1,103 @@
+import copy
+import json
+
+from xbsync.bookmark_rules import RuleSet
+from xbsync.bookmarks import filter_bookmarks
+from xbsync.subtree_cache import SubtreeCache
+
+TREE = [{'title': 'Menu', 'children': [
+    {'title': 'A', 'children': [
+        {'title': 'a1', 'url': 'https://a.com/1'},
+        {'title': 'Deeper', 'children': [{'title': 'a2', 'url': 'https://a.com/2'},
+                                         {'title': 'pdf', 'url': 'https://a.com/2.pdf'}]},
+    ]},
+    {'title': 'B', 'children': [{'title': 'b1', 'url': 'https://b.com/1'},
+                                {'title': 'b2', 'url': 'ftp://b.com/2'}]},
+    {'title': 'Private', 'children': [{'title': 'p', 'url': 'https://private.com/'}]},
+    {'title': 'C', 'children': [{'title': 'c1', 'url': 'https://c.com/1'}]},
+]}]
+
+
+def make_rules(*lines):
+    rules = RuleSet()
+    rules.add_rules_from_lines(['exclude folder Menu/Private', 'exclude suffix .pdf'] + list(lines))
+    #Record the urls the rules are asked about
+    rules.checked = []
+    check_bookmark = rules.check_bookmark
+
+    def counting_check(url, state):
+        rules.checked.append(url)
+        return check_bookmark(url, state)
+    rules.check_bookmark = counting_check
+    return rules
+
+
+def run(tree, rules, path):
+    cache = SubtreeCache(rules, path)
+    result = [(bookmark['url'], folder) for bookmark, folder in cache.filter(tree)]
+    cache.save()
+    return result, cache
+
+
+def expected(tree, rules):
+    return [(bookmark['url'], folder) for bookmark, folder in filter_bookmarks(tree, rules)]
+
+
+def test_unchanged_run_replays_the_first(tmp_path):
+    path = str(tmp_path / 'filter-cache.json')
+    rules = make_rules()
+    first, cache = run(TREE, rules, path)
+    assert first == expected(TREE, make_rules())
+    assert cache.reused == 0
+
+    rules.checked = []
+    second, cache = run(TREE, rules, path)
+    assert second == first
+    assert rules.checked == []
+    assert cache.filtered == 0
+    #Menu, A, Deeper, B and C, the excluded folder is not in the cache entries
+    assert cache.reused == 5
+
+
+def test_changed_folder_is_filtered_again(tmp_path, capsys):
+    path = str(tmp_path / 'filter-cache.json')
+    rules = make_rules()
+    run(TREE, rules, path)
+    tree = copy.deepcopy(TREE)
+    tree[0]['children'][1]['children'].append({'title': 'b3', 'url': 'https://b.com/3'})
+    capsys.readouterr()
+
+    rules.checked = []
+    second, cache = run(tree, rules, path)
+    #Messages come only from the folders filtered again
+    assert capsys.readouterr().out.splitlines() == ['url scheme not included, ignoring: ftp://b.com/2',
+                                                    'skipping folder Private']
+    assert second == expected(tree, make_rules())
+    #Only B and the folder holding it are walked, A with its subfolder and C are replayed
+    assert sorted(rules.checked) == ['ftp://b.com/2', 'https://b.com/1', 'https://b.com/3']
+    assert cache.filtered == 2
+    assert cache.reused == 3
+
+
+def test_changed_rules_drop_the_cache(tmp_path):
+    path = str(tmp_path / 'filter-cache.json')
+    run(TREE, make_rules(), path)
+    rules = make_rules('exclude domain c.com')
+    result, cache = run(TREE, rules, path)
+    assert result == expected(TREE, make_rules('exclude domain c.com'))
+    assert ('https://c.com/1', ('Menu', 'C')) not in result
+    assert cache.reused == 0
+    assert len(rules.checked) == 6
+    with open(path) as cacheFile:
+        assert json.load(cacheFile)['rules'] == rules.fingerprint()
+
+
+def test_corrupt_cache_is_ignored(tmp_path, capsys):
+    path = tmp_path / 'filter-cache.json'
+    path.write_text('{"version": 1, "rules": ')
+    result, cache = run(TREE, make_rules(), str(path))
+    assert result == expected(TREE, make_rules())
+    assert cache.reused == 0
+    assert 'WARNING: ignoring unreadable filter cache' in capsys.readouterr().out
+    #The cache written in its place is used by the next run
+    assert run(TREE, make_rules(), str(path))[1].reused == 5
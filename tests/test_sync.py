@@ -0,0 +1,192 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import TREE, encrypt_bookmarks, key_for
+from xbsync.sync import EXIT_UNCHANGED, get_cached_key, sync_bookmarks, update_key_cache
+
+SYNC_ID = '0123456789abcdef0123456789abcdef'
+PASSWORD = 'correct horse'
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_download_matches_tree(fake_api, tmp_path):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    output = str(tmp_path / 'bookmarks.json')
+    result = sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, output)
+    assert result['status'] == 'updated'
+    assert result['key'] == key_for(SYNC_ID, PASSWORD)
+    assert result['etag']
+    with open(output, 'r') as outputFile:
+        assert json.load(outputFile) == TREE
+    assert not os.path.exists(output + '.tmp')
+
+
+def test_download_without_gzip_in_small_chunks(fake_api, tmp_path, monkeypatch):
+    from xbsync import sync
+    monkeypatch.setattr(sync, 'CHUNK_SIZE', 7)
+    fake_api.gzip = False
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    output = str(tmp_path / 'bookmarks.json')
+    sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, output, output_format='pretty',
+                   cached_key=key_for(SYNC_ID, PASSWORD))
+    with open(output, 'r') as outputFile:
+        assert json.load(outputFile) == TREE
+
+
+def test_in_memory(fake_api):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    result = sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, None, cached_key=key_for(SYNC_ID, PASSWORD))
+    assert result['bookmarks'] == TREE
+    assert result['key_from_cache']
+
+
+def test_unchanged_last_updated_skips_download_and_key(fake_api, tmp_path, monkeypatch):
+    from xbsync import sync
+    fake_api.add_sync(SYNC_ID, PASSWORD, last_updated='2021-05-05T00:00:00.000Z')
+    monkeypatch.setattr(sync, 'derive_key', lambda *arguments: pytest.fail('key derived'))
+    output = str(tmp_path / 'bookmarks.json')
+    result = sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, output,
+                            last_updated='2021-05-05T00:00:00.000Z')
+    assert result['status'] == 'unchanged'
+    assert fake_api.paths() == ['/bookmarks/%s/lastUpdated' % SYNC_ID]
+    assert not os.path.exists(output)
+
+
+def test_changed_last_updated_downloads(fake_api, tmp_path):
+    fake_api.add_sync(SYNC_ID, PASSWORD, last_updated='2021-05-06T00:00:00.000Z')
+    output = str(tmp_path / 'bookmarks.json')
+    result = sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, output, cached_key=key_for(SYNC_ID, PASSWORD),
+                            last_updated='2021-05-05T00:00:00.000Z')
+    assert result['status'] == 'updated'
+    assert result['lastUpdated'] == '2021-05-06T00:00:00.000Z'
+    assert fake_api.paths() == ['/bookmarks/%s/lastUpdated' % SYNC_ID, '/bookmarks/%s' % SYNC_ID]
+    with open(output, 'r') as outputFile:
+        assert json.load(outputFile) == TREE
+
+
+def test_matching_etag_skips_download(fake_api, tmp_path):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    output = str(tmp_path / 'bookmarks.json')
+    first = sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, output, cached_key=key_for(SYNC_ID, PASSWORD))
+    os.remove(output)
+    result = sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, output, etag=first['etag'],
+                            last_updated=first['lastUpdated'])
+    assert result['status'] == 'unchanged'
+    assert result['etag'] == first['etag']
+    assert not os.path.exists(output)
+
+
+def test_wrong_cached_key_is_derived_again(fake_api, tmp_path):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    output = str(tmp_path / 'bookmarks.json')
+    result = sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, output, cached_key=b'\0' * 32)
+    assert not result['key_from_cache']
+    assert result['key'] == key_for(SYNC_ID, PASSWORD)
+    with open(output, 'r') as outputFile:
+        assert json.load(outputFile) == TREE
+
+
+def test_cached_key_is_only_used_with_its_password():
+    key_cache = {}
+    update_key_cache(key_cache, {'sync_id': SYNC_ID, 'key': key_for(SYNC_ID, PASSWORD)}, PASSWORD, 3600)
+    assert get_cached_key(key_cache, SYNC_ID, PASSWORD) == key_for(SYNC_ID, PASSWORD)
+    #A wrong password is not covered up by the key cached for the right one
+    assert get_cached_key(key_cache, SYNC_ID, PASSWORD + 'x') is None
+    #Entries written before the password check are derived again
+    del key_cache[SYNC_ID]['password_check']
+    assert get_cached_key(key_cache, SYNC_ID, PASSWORD) is None
+
+
+def test_truncated_download_leaves_output_untouched(fake_api, tmp_path):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    fake_api.truncate = 1
+    output = tmp_path / 'bookmarks.json'
+    output.write_text('previous')
+    with pytest.raises(Exception):
+        sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, str(output), cached_key=key_for(SYNC_ID, PASSWORD))
+    assert output.read_text() == 'previous'
+    assert os.listdir(str(tmp_path)) == ['bookmarks.json']
+
+
+def test_truncated_bookmarks_leave_output_untouched(fake_api, tmp_path):
+    data = encrypt_bookmarks(TREE, SYNC_ID, PASSWORD)
+    fake_api.set_bookmarks(SYNC_ID, data[:20])
+    output = tmp_path / 'bookmarks.json'
+    output.write_text('previous')
+    with pytest.raises(ValueError, match='truncated'):
+        sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, str(output), cached_key=key_for(SYNC_ID, PASSWORD))
+    assert output.read_text() == 'previous'
+    assert os.listdir(str(tmp_path)) == ['bookmarks.json']
+
+
+@pytest.mark.parametrize('output_format', ['json', 'pretty', 'ndjson'])
+def test_wrong_tag_leaves_output_untouched(fake_api, tmp_path, output_format):
+    data = bytearray(encrypt_bookmarks(TREE, SYNC_ID, PASSWORD))
+    data[-1] ^= 1
+    fake_api.set_bookmarks(SYNC_ID, bytes(data))
+    output = tmp_path / 'bookmarks.json'
+    output.write_text('previous')
+    with pytest.raises(ValueError, match='MAC check failed'):
+        sync_bookmarks(fake_api.url, SYNC_ID, PASSWORD, str(output), output_format=output_format,
+                       cached_key=key_for(SYNC_ID, PASSWORD))
+    assert output.read_text() == 'previous'
+    assert os.listdir(str(tmp_path)) == ['bookmarks.json']
+
+
+def test_cli_exits_unchanged_with_state(fake_api, tmp_path):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    output = str(tmp_path / 'bookmarks.json')
+    command = [sys.executable, os.path.join(REPO, 'get_xbs_bookmarks.py'), '-u', fake_api.url,
+               '-s', SYNC_ID, '-p', PASSWORD, '-o', output, '--state', str(tmp_path / 'state.json')]
+
+    first = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True)
+    assert first.returncode == 0, first.stdout
+    with open(output, 'r') as outputFile:
+        assert json.load(outputFile) == TREE
+    state = json.loads((tmp_path / 'state.json').read_text())
+    assert state[SYNC_ID]['etag']
+
+    os.remove(output)
+    second = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True)
+    assert second.returncode == EXIT_UNCHANGED, second.stdout
+    assert not os.path.exists(output)
+    assert fake_api.requests[-1][2].get('If-None-Match') == state[SYNC_ID]['etag']
+
+
+def test_cli_reports_bookmarks_it_cannot_decrypt(fake_api, tmp_path):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    output = tmp_path / 'bookmarks.json'
+    command = [sys.executable, os.path.join(REPO, 'get_xbs_bookmarks.py'), '-u', fake_api.url,
+               '-s', SYNC_ID, '-o', str(output), '--key-cache', str(tmp_path / 'keys.json')]
+    first = subprocess.run(command + ['-p', PASSWORD], stdout=subprocess.PIPE, universal_newlines=True)
+    assert first.returncode == 0, first.stdout
+
+    #The key cached for the right password is not used for a wrong one
+    output.write_text('previous')
+    wrong = subprocess.run(command + ['-p', PASSWORD + 'x'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           universal_newlines=True)
+    assert wrong.returncode == 1
+    assert 'ERROR: bookmarks cannot be decrypted' in wrong.stdout
+    assert 'Traceback' not in wrong.stderr
+    assert output.read_text() == 'previous'
+
+    fake_api.set_bookmarks(SYNC_ID, encrypt_bookmarks(TREE, SYNC_ID, PASSWORD)[:20])
+    truncated = subprocess.run(command + ['-p', PASSWORD], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    assert truncated.returncode == 1
+    assert 'ERROR: bookmarks cannot be decrypted' in truncated.stdout
+    assert 'Traceback' not in truncated.stderr
+
+
+def test_base64_split_across_chunks():
+    from xbsync.sync import iter_base64_decoded
+    data = os.urandom(1000)
+    encoded = base64.b64encode(data)
+    for size in (1, 3, 5, 64):
+        chunks = [encoded[i:i + size] for i in range(0, len(encoded), size)]
+        assert b''.join(iter_base64_decoded(chunks)) == data
@@ -0,0 +1,71 @@
+import pytest
+
+from xbsync.url_dedup import DiskHashSet, MemoryHashSet, UrlIndex, canonicalize_url, url_digest
+
+
+@pytest.mark.parametrize('url, canonical', [
+    ('HTTPS://Example.COM:443/a/', 'https://example.com/a'),
+    ('http://example.com:8080', 'http://example.com:8080/'),
+    ('http://example.com.:80/?b=2&a=1#top', 'http://example.com/?a=1&b=2'),
+    ('https://example.com/?utm_source=x&UTM_Medium=y&fbclid=z&id=3', 'https://example.com/?id=3'),
+    ('https://user@[::1]:443/x', 'https://user@[::1]/x'),
+    ('https://[::1]:8443/x', 'https://[::1]:8443/x'),
+    ('https://example.com/a%2Fb?q=a%20b', 'https://example.com/a%2Fb?q=a%20b'),
+    ('  ftp://Files.example.com:21/pub/  ', 'ftp://files.example.com/pub'),
+])
+def test_canonicalize_url(url, canonical):
+    assert canonicalize_url(url) == canonical
+
+
+def test_canonicalize_url_options():
+    assert canonicalize_url('https://example.com/a/', strip_trailing_slash=False) == 'https://example.com/a/'
+    assert canonicalize_url('https://example.com/?ref=x&utm_source=y', ['ref']) == 'https://example.com/?utm_source=y'
+
+
+def test_url_digest_is_nonzero():
+    digests = {url_digest('https://example.com/%d' % i) for i in range(1000)}
+    assert len(digests) == 1000
+    assert all(digest and digest < 1 << 64 for digest in digests)
+
+
+def test_memory_hash_set():
+    seen = MemoryHashSet()
+    assert seen.add(5)
+    assert not seen.add(5)
+    assert seen.add(7)
+    assert len(seen) == 2
+    seen.close()
+
+
+def test_disk_hash_set_grows_and_keeps_every_value(tmp_path):
+    seen = DiskHashSet(capacity=4, directory=str(tmp_path))
+    digests = [url_digest('https://example.com/%d' % i) for i in range(5000)]
+    assert all(seen.add(digest) for digest in digests)
+    assert len(seen) == 5000
+    assert seen.capacity == 16384
+    #Every value was rehashed into the grown table, so adding it again finds it
+    assert not any(seen.add(digest) for digest in digests)
+    assert len(seen) == 5000
+    assert sorted(value for value in seen.slots if value) == sorted(digests)
+    seen.close()
+
+
+def test_disk_hash_set_uses_even_home_slots(tmp_path):
+    #Url digests are all odd, their home slots must not be
+    seen = DiskHashSet(capacity=1 << 12, directory=str(tmp_path))
+    for i in range(200):
+        seen.add(url_digest('https://example.com/%d' % i))
+    used = [slot for slot, value in enumerate(seen.slots) if value]
+    assert len([slot for slot in used if slot % 2 == 0]) > 50
+    seen.close()
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+def test_url_index_reports_duplicates(on_disk):
+    index = UrlIndex(on_disk=on_disk)
+    assert index.add('https://Example.com/page/?utm_source=x') == 'https://example.com/page'
+    assert index.add('https://example.com:443/page#top') is None
+    assert index.add('http://example.com/page') == 'http://example.com/page'
+    assert len(index) == 2
+    assert index.duplicates == 1
+    index.close()
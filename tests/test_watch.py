@@ -0,0 +1,185 @@
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import TREE, key_for
+from xbsync import sync as sync_module
+from xbsync.cli import add_filter_arguments, build_rules
+from xbsync.watch import Watcher, WatchedSync, serve_status
+
+SYNC_ID = 'aaaabbbbccccddddaaaabbbbccccdddd'
+PASSWORD = 'watch me'
+URLS = ['https://docs.python.org/3/', 'https://example.com/ü?utm_source=x', 'https://secret.example.org/',
+        'http://example.jp/']
+
+
+def make_args(argv=(), **options):
+    parser = argparse.ArgumentParser()
+    add_filter_arguments(parser)
+    args = parser.parse_args(list(argv))
+    args.command = None
+    args.state = None
+    args.min_interval = 0.01
+    args.max_interval = 0.05
+    args.max_backoff = 0.05
+    args.jitter = 0.0
+    args.max_errors = 2
+    vars(args).update(options)
+    return args
+
+
+def make_watcher(fake_api, tmp_path, argv=(), **options):
+    args = make_args(argv, **options)
+    entry = {'sync_id': SYNC_ID, 'url': fake_api.url, 'urls': str(tmp_path / 'urls.txt'),
+             'snapshot': str(tmp_path / 'urls.snapshot')}
+    watched = WatchedSync(entry, 'https://unused.example.com', PASSWORD, args.min_interval)
+    return Watcher([watched], args, build_rules(args)), watched
+
+
+@pytest.fixture
+def derivations(monkeypatch):
+    """
+    Count key derivations, handing out the key derived once for the whole session.
+    """
+    count = []
+
+    def derive_key(sync_id, password):
+        count.append(sync_id)
+        return key_for(sync_id, password)
+    monkeypatch.setattr(sync_module, 'derive_key', derive_key)
+    return count
+
+
+def test_polls_only_download_changes(fake_api, tmp_path, derivations):
+    fake_api.add_sync(SYNC_ID, PASSWORD, last_updated='2022-01-01T00:00:00.000Z')
+    watcher, watched = make_watcher(fake_api, tmp_path)
+
+    assert watcher.poll(watched)
+    assert (tmp_path / 'urls.txt').read_text().splitlines() == URLS
+    assert watched.last_updated == '2022-01-01T00:00:00.000Z'
+
+    del fake_api.requests[:]
+    assert not watcher.poll(watched)
+    assert fake_api.paths() == ['/bookmarks/%s/lastUpdated' % SYNC_ID]
+
+    tree = json.loads(json.dumps(TREE))
+    tree[1]['children'].append({'title': 'New', 'url': 'https://new.example.net/'})
+    fake_api.add_sync(SYNC_ID, PASSWORD, tree=tree, last_updated='2022-01-02T00:00:00.000Z')
+    assert watcher.poll(watched)
+    #Only the urls added since the snapshot of the previous change
+    assert (tmp_path / 'urls.txt').read_text().splitlines() == ['https://new.example.net/']
+    assert watched.polls == 3
+    assert watched.changes == 2
+    #The key is kept in memory between changes
+    assert derivations == [SYNC_ID]
+    #Both polls and both downloads went over one kept-alive connection
+    assert fake_api.connections == 1
+
+
+def test_intervals_grow_and_back_off():
+    args = make_args(min_interval=10, max_interval=30, max_backoff=100)
+    watched = WatchedSync({'sync_id': SYNC_ID, 'urls': 'urls.txt'}, 'https://x', PASSWORD, 10)
+    watcher = Watcher([watched], args, build_rules(args))
+    intervals = []
+    for _ in range(4):
+        watcher._schedule(watched)
+        intervals.append(watched.interval)
+    assert intervals == [15, 22.5, 30, 30]
+    watcher._schedule(watched, changed=True)
+    assert watched.interval == 10
+    before = time.monotonic()
+    watched.errors = 3
+    watcher._schedule(watched)
+    assert 80 - 1 < watched.next_poll - before < 80 + 1
+    watched.errors = 10
+    watcher._schedule(watched)
+    assert watched.next_poll - before < 100 + 1
+
+
+def test_health_allows_max_errors_in_a_row():
+    args = make_args()
+    watched = WatchedSync({'sync_id': SYNC_ID, 'urls': 'urls.txt'}, 'https://x', PASSWORD, 10)
+    watcher = Watcher([watched], args, build_rules(args))
+    watched.errors = args.max_errors
+    assert watcher.health()['healthy']
+    watched.errors = args.max_errors + 1
+    assert not watcher.health()['healthy']
+
+
+def test_missing_archivebox_index_fails_the_poll(fake_api, tmp_path, derivations):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    watcher, watched = make_watcher(fake_api, tmp_path, ['--archivebox-dir', str(tmp_path / 'missing')])
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        wait_for(lambda: watched.errors > 1)
+        assert thread.is_alive()
+        assert watched.last_error.startswith('ArchiveBoxIndexError')
+    finally:
+        watcher.stop()
+        thread.join()
+    assert not (tmp_path / 'urls.txt').exists()
+
+
+def fetch(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return response.status, response.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode('utf-8')
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_health_and_metrics(fake_api, tmp_path, derivations):
+    fake_api.add_sync(SYNC_ID, PASSWORD)
+    watcher, watched = make_watcher(fake_api, tmp_path)
+    server = serve_status(watcher, '127.0.0.1', 0)
+    status_url = 'http://127.0.0.1:%d' % server.server_address[1]
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        wait_for(lambda: watched.changes == 1 and watched.polls > 2)
+        status, body = fetch(status_url + '/health')
+        assert status == 200
+        health = json.loads(body)
+        assert health['healthy']
+        assert health['syncs'][0]['sync_id'] == SYNC_ID[:8]
+        assert health['syncs'][0]['last_error'] is None
+
+        #An unknown sync is answered with 404, which fails every poll
+        sync_data = fake_api.syncs.pop(SYNC_ID)
+        wait_for(lambda: watched.errors > 2)
+        status, body = fetch(status_url + '/health')
+        assert status == 503
+        assert 'HTTP error 404' in json.loads(body)['syncs'][0]['last_error']
+
+        status, body = fetch(status_url + '/metrics')
+        assert status == 200
+        metrics = dict(line.rsplit(' ', 1) for line in body.splitlines() if not line.startswith('#'))
+        labels = '{urls="%s"}' % watched.urls_path
+        assert float(metrics['xbs_watch_changes_total' + labels]) == 1
+        assert float(metrics['xbs_watch_errors_total' + labels]) >= 3
+        assert float(metrics['xbs_watch_polls_total' + labels]) >= 5
+
+        fake_api.syncs[SYNC_ID] = sync_data
+        wait_for(lambda: watched.errors == 0)
+        assert fetch(status_url + '/health')[0] == 200
+        assert fetch(status_url + '/nothing')[0] == 404
+    finally:
+        watcher.stop()
+        thread.join()
+        server.shutdown()
+        server.server_close()
+    #Nothing changed again once the sync was back
+    assert watched.changes == 1
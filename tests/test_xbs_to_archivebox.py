@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+
+from conftest import encrypt_bookmarks
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYNC_ID = 'fedcba9876543210fedcba9876543210'
+PASSWORD = 'hunter2'
+#Enough urls to fill a pipe buffer several times over
+URLS = ['https://example%d.com/a/fairly/long/path/to/page?id=%06d' % (i % 50, i) for i in range(5000)]
+
+#Stands in for archivebox add: reads its urls slowly, so the writer has to wait for it
+FAKE_ARCHIVEBOX = '''
+import sys, time
+with open(sys.argv[1], "w") as receivedFile:
+    for number, line in enumerate(sys.stdin):
+        if number == int(sys.argv[2]):
+            break
+        if number % 1000 == 0:
+            time.sleep(0.05)
+        receivedFile.write(line)
+sys.exit(int(sys.argv[3]))
+'''
+
+
+def run_pipeline(fake_api, tmp_path, exit_after=-1, status=0, extra=()):
+    tree = [{'title': 'Menu', 'children': [{'title': str(i), 'url': url} for i, url in enumerate(URLS)]}]
+    fake_api.set_bookmarks(SYNC_ID, encrypt_bookmarks(tree, SYNC_ID, PASSWORD))
+    script = tmp_path / 'fake_archivebox.py'
+    script.write_text(FAKE_ARCHIVEBOX)
+    received = tmp_path / 'received.txt'
+    command = '%s %s %s %d %d' % (sys.executable, script, received, exit_after, status)
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, 'xbs_to_archivebox.py'), '-u', fake_api.url, '-s', SYNC_ID,
+         '-p', PASSWORD, '-c', command] + list(extra),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=120)
+    return result, received
+
+
+def test_slow_reader_gets_every_url_in_order(fake_api, tmp_path):
+    result, received = run_pipeline(fake_api, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert received.read_text().splitlines() == URLS
+    #Only the command gets the urls, progress goes to stderr
+    assert result.stdout == ''
+
+
+def test_reader_exiting_early_is_an_error(fake_api, tmp_path):
+    result, received = run_pipeline(fake_api, tmp_path, exit_after=100, status=0)
+    assert result.returncode == 1
+    assert 'ERROR: the url reader exited before all urls were written' in result.stderr
+    assert len(received.read_text().splitlines()) == 100
+
+
+def test_reader_failing_is_an_error(fake_api, tmp_path):
+    result, received = run_pipeline(fake_api, tmp_path, exit_after=len(URLS), status=2)
+    assert result.returncode == 1
+    assert 'exited with status 2' in result.stderr
+
+
+def test_no_intermediate_files(fake_api, tmp_path):
+    result, received = run_pipeline(fake_api, tmp_path, extra=['--snapshot', str(tmp_path / 'urls.snapshot')])
+    assert result.returncode == 0, result.stderr
+    assert sorted(os.listdir(str(tmp_path))) == ['fake_archivebox.py', 'received.txt', 'urls.snapshot']
@@ -1,77 +1,91 @@
-#!/usr/bin/python3
-
-import json
-import argparse
-import re
-
-#Setup args
-parser = argparse.ArgumentParser(
-    description='Get filtered list of urls from XBS bookmark json')
-
-parser.add_argument('-m', '--filter-directories',
-                    nargs='+',
-                    dest='dirs',
-                    help='list of directory names to exclude, space separated, enclose in double quotes, case insensitive'
-                    )
-
-required = parser.add_argument_group('required arguments')
-required.add_argument('-i','--input',
-                      required=True,
-                      help='path to file to get json from',
-                      )
-required.add_argument('-o', '--output',
-                      required=True,
-                      help='output file with urls',
-                      )
-
-#Get args
-args = parser.parse_args()
-
-#Read in bookmark data
-with open(args.input, "r") as inputFile:
-    all_bookmarks_raw = inputFile.read()
-
-all_bookmarks = json.loads(all_bookmarks_raw)
-
-#Get regex match object from args
-blacklist_names = []
-for directory in args.dirs:
-    blacklist_names.append(re.escape(directory.strip("'")))
-blacklist_regex_string = '(?:% s)' % '|'.join(blacklist_names)
-blacklist_regex = re.compile(blacklist_regex_string, re.IGNORECASE)
-
-#filter bookmark folders, return urls in non-blacklisted folders
-def filter_bookmarks(bookmarks, blacklist_regex):
-    urls = []
-    if isinstance(bookmarks, dict):
-        if "children" in bookmarks.keys():
-            match = re.fullmatch(blacklist_regex, bookmarks['title'])
-            if not match:
-                urls.extend(filter_bookmarks(bookmarks['children'], blacklist_regex))
-            else:
-                print('skipping folder ' + bookmarks['title'])
-            if "url" in bookmarks.keys():
-                print('found url in children dict')
-                raise
-        elif "url" in bookmarks.keys():
-            if bookmarks['url'].startswith("http"):
-                urls.append(bookmarks['url'])
-            else:
-                print("url not http, ignoring: " + bookmarks['url'])
-        else:
-            print('did not find children or url in dict')
-            raise
-    elif isinstance(bookmarks, list):
-        for item in bookmarks:
-            urls.extend(filter_bookmarks(item, blacklist_regex))
-    else:
-        print("not sure how you got here, type: ")
-        print(type(bookmarks))
-    return urls
-
-urls = filter_bookmarks(all_bookmarks, blacklist_regex)
-
-with open(args.output, "w") as outputFile:
-    for url in urls:
-        outputFile.write(url + "\n")
-
+#!/usr/bin/python3
+
+import json
+import argparse
+from xbsync.bookmarks import filter_bookmark_events, filter_flat_bookmarks, detect_input_format
+from xbsync.cli import (add_filter_arguments, build_rules, open_archivebox_index, open_snapshot, commit_snapshot,
+                        open_link_checker, filter_tree, save_filter_cache, write_urls)
+from xbsync.stage_stats import NO_STATS, Stats, add_stats_arguments, write_stats
+
+def main():
+    #Setup args
+    parser = argparse.ArgumentParser(
+        description='Get filtered list of urls from XBS bookmark json')
+
+    add_filter_arguments(parser)
+    add_stats_arguments(parser)
+
+    parser.add_argument('-f', '--input-format',
+                        choices=['auto', 'json', 'ndjson', 'stream'],
+                        default='auto',
+                        help='format of the input file, ndjson is read a line at a time, stream reads a json file '
+                             'incrementally from a memory map so huge files fit in little memory, '
+                             'defaults to detecting json or ndjson from the first character',
+                        )
+
+    required = parser.add_argument_group('required arguments')
+    required.add_argument('-i','--input',
+                          required=True,
+                          help='path to file to get json from',
+                          )
+    required.add_argument('-o', '--output',
+                          required=True,
+                          help='output file with urls',
+                          )
+
+    #Get args
+    args = parser.parse_args()
+
+    rules = build_rules(args)
+    #Open the ArchiveBox index before reading any bookmarks
+    archivebox_index = open_archivebox_index(args)
+    snapshot = open_snapshot(args)
+    link_checker = open_link_checker(args, args.dead_links)
+    stats = Stats() if args.stats else NO_STATS
+
+    with open(args.input, "r") as inputFile, open(args.output, "w") as outputFile:
+        input_format = args.input_format
+        if input_format == 'auto':
+            input_format = detect_input_format(inputFile)
+        subtree_cache = None
+        if args.filter_cache and input_format != 'json':
+            parser.error('--filter-cache needs json input')
+
+        if input_format == 'ndjson':
+            bookmarks = stats.iterate('filter', filter_flat_bookmarks(inputFile, rules, args.on_malformed))
+        elif input_format == 'stream':
+            #Parse and filter as the file is read, only one folder's keys or bookmark is held at a time
+            from xbsync.json_stream import iter_tree_events
+            events = stats.iterate('json_parse', iter_tree_events(args.input))
+            bookmarks = stats.iterate('filter', filter_bookmark_events(events, rules, args.on_malformed))
+        else:
+            #Read in bookmark data
+            with stats.stage('read'):
+                text = inputFile.read()
+            with stats.stage('json_parse'):
+                all_bookmarks = json.loads(text)
+            del text
+            bookmarks, subtree_cache = filter_tree(all_bookmarks, rules, args)
+            bookmarks = stats.iterate('filter', bookmarks)
+
+        try:
+            write_urls(bookmarks, outputFile, args, archivebox_index, snapshot, stats=stats,
+                       link_checker=link_checker)
+            if snapshot:
+                commit_snapshot(snapshot, args)
+            if subtree_cache:
+                save_filter_cache(subtree_cache)
+        finally:
+            if snapshot:
+                snapshot.close()
+            if archivebox_index:
+                archivebox_index.close()
+            if link_checker:
+                link_checker.close()
+
+    if args.stats:
+        write_stats(args.stats, args.stats_format, [({'script': 'urls_from_xbs_json'}, stats.report())])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+import sys
+import argparse
+import contextlib
+import http.client
+import shlex
+import subprocess
+from xbsync.cli import (add_filter_arguments, build_rules, open_archivebox_index, open_snapshot, commit_snapshot,
+                        open_link_checker, filter_tree, save_filter_cache, write_urls)
+from xbsync.stage_stats import NO_STATS, Stats, add_stats_arguments, write_stats
+from xbsync.http_transport import BadURL
+from xbsync.sync import (EXIT_UNCHANGED, load_key_cache, save_key_cache, get_cached_key, load_sync_state,
+                         write_json_atomically, sync_bookmarks, update_key_cache, update_sync_state)
+
+def run(args, outputFile):
+    """
+    Sync, filter and write the urls to outputFile, or to the stdin of args.command.
+
+    Returns the exit status.
+    """
+    rules = build_rules(args)
+    archivebox_index = open_archivebox_index(args)
+    snapshot = open_snapshot(args)
+    base_url = args.url.strip().rstrip('/')
+
+    key_cache = load_key_cache(args.key_cache) if args.key_cache else {}
+    sync_state = load_sync_state(args.state) if args.state else {}
+    cached_key = get_cached_key(key_cache, args.sync_id, args.password) if args.key_cache else None
+    previous = sync_state.get(args.sync_id, {})
+    stats = NO_STATS
+    if args.stats or args.profile:
+        stats = Stats(trace_memory=bool(args.stats), profile_stages=['decompress'] if args.profile else [])
+
+    #Download, decrypt and parse the bookmarks in memory
+    try:
+        result = sync_bookmarks(base_url, args.sync_id, args.password, None, cached_key=cached_key,
+                                last_updated=previous.get('lastUpdated'), stats=stats, etag=previous.get('etag'))
+    except (OSError, http.client.HTTPException, BadURL) as e:
+        print("ERROR: URL cannot be reached or is not working correctly.")
+        print("Check that your sync ID is correct.")
+        print("URl: " + base_url)
+        print(e)
+        return 1
+    except ValueError as e:
+        print("ERROR: bookmarks cannot be decrypted: %s" % e)
+        print("Check that your password is correct.")
+        return 1
+
+    if result['status'] == 'unchanged':
+        print("No changes since last sync at %s" % result['lastUpdated'])
+        return EXIT_UNCHANGED
+    if args.key_cache and not result['key_from_cache']:
+        update_key_cache(key_cache, result, args.password, args.key_cache_ttl)
+        save_key_cache(args.key_cache, key_cache)
+
+    #Stream the urls as the tree is walked, writes block while the reader is busy
+    bookmarks, subtree_cache = filter_tree(result.pop('bookmarks'), rules, args)
+    link_checker = open_link_checker(args, args.dead_links)
+    bookmarks = stats.iterate('filter', bookmarks)
+    child = None
+    if args.command:
+        child = subprocess.Popen(shlex.split(args.command), stdin=subprocess.PIPE,
+                                 cwd=args.archivebox_dir, universal_newlines=True)
+        outputFile = child.stdin
+    try:
+        try:
+            write_urls(bookmarks, outputFile, args, archivebox_index, snapshot, flush=True, stats=stats,
+                       link_checker=link_checker)
+            if child:
+                child.stdin.close()
+        except BrokenPipeError:
+            print("ERROR: the url reader exited before all urls were written")
+            return 1
+        finally:
+            if archivebox_index:
+                archivebox_index.close()
+            if link_checker:
+                link_checker.close()
+            if child:
+                with contextlib.suppress(BrokenPipeError):
+                    child.stdin.close()
+                child.wait()
+
+        if child and child.returncode != 0:
+            print("ERROR: %s exited with status %d" % (args.command, child.returncode))
+            return 1
+
+        #Remember what was synced, only once every url has been handed over
+        if snapshot:
+            commit_snapshot(snapshot, args)
+        if subtree_cache:
+            save_filter_cache(subtree_cache)
+    finally:
+        if snapshot:
+            snapshot.close()
+
+    if args.state:
+        update_sync_state(sync_state, result)
+        write_json_atomically(args.state, sync_state)
+    if args.stats:
+        write_stats(args.stats, args.stats_format, [({'script': 'xbs_to_archivebox'}, stats.report())])
+    if args.profile:
+        stats.dump_profile(args.profile)
+    return 0
+
+def main():
+    # Setup arguments
+    parser = argparse.ArgumentParser(
+        description='Get bookmarks from an XBrowserSync api and stream the filtered urls to stdout or into archivebox add, '
+                    'without intermediate files')
+
+    parser.add_argument('-u', '--url',
+                        default='https://api.xbrowsersync.org',
+                        help='url of the xbrowsersync api service, defaults to https://api.xbrowsersync.org',
+                        )
+    parser.add_argument('-k', '--key-cache',
+                        help='file to cache derived decryption keys in, skips the slow key derivation on later runs',
+                        )
+    parser.add_argument('--key-cache-ttl',
+                        type=int,
+                        default=7 * 24 * 60 * 60,
+                        help='seconds a cached key stays valid, defaults to 604800 (7 days)',
+                        )
+    parser.add_argument('--state',
+                        help='file to remember the last synced update time in, exits with status %d without downloading when nothing changed' % EXIT_UNCHANGED,
+                        )
+    parser.add_argument('-c', '--command',
+                        help='command to pipe the urls into instead of stdout, such as "archivebox add", '
+                             'run in the --archivebox-dir directory if one is given',
+                        )
+
+    add_filter_arguments(parser)
+    add_stats_arguments(parser, profile=True)
+
+    required = parser.add_argument_group('required arguments')
+    required.add_argument('-s', '--sync-id',
+                          required=True,
+                          help='sync ID to get bookmarks from',
+                          )
+    required.add_argument('-p', '--password',
+                          required=True,
+                          help='decryption password',
+                          )
+
+    #Get args
+    args = parser.parse_args()
+
+    #Only urls go to stdout, progress and errors go to stderr
+    outputFile = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        status = run(args, outputFile)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+import sys
+import json
+import signal
+import argparse
+from xbsync.cli import add_filter_arguments, build_rules, open_archivebox_index
+from xbsync.sync import (load_key_cache, save_key_cache, get_cached_key, load_sync_state, read_password,
+                         update_key_cache)
+from xbsync.watch import Watcher, WatchedSync, log, serve_status
+
+def main():
+    # Setup arguments
+    parser = argparse.ArgumentParser(
+        description='Watch XBrowserSync accounts and write their filtered urls whenever they change. '
+                    'Connections and decryption keys are kept between polls, so only the small lastUpdated '
+                    'request is made while nothing changes')
+
+    parser.add_argument('-u', '--url',
+                        default='https://api.xbrowsersync.org',
+                        help='url of the xbrowsersync api service, defaults to https://api.xbrowsersync.org',
+                        )
+    parser.add_argument('-k', '--key-cache',
+                        help='file to cache derived decryption keys in, skips the slow key derivation on restarts',
+                        )
+    parser.add_argument('--key-cache-ttl',
+                        type=int,
+                        default=7 * 24 * 60 * 60,
+                        help='seconds a cached key stays valid, defaults to 604800 (7 days)',
+                        )
+    parser.add_argument('--state',
+                        help='file to remember the last synced update times in, so a restart does not reprocess unchanged accounts',
+                        )
+    parser.add_argument('-c', '--command',
+                        help='command to pipe the urls of a changed account into, such as "archivebox add", '
+                             'run in the --archivebox-dir directory if one is given',
+                        )
+    parser.add_argument('--min-interval',
+                        type=float,
+                        default=60,
+                        help='seconds between polls right after a change, defaults to 60',
+                        )
+    parser.add_argument('--max-interval',
+                        type=float,
+                        default=15 * 60,
+                        help='longest seconds between polls of an unchanged account, defaults to 900',
+                        )
+    parser.add_argument('--max-backoff',
+                        type=float,
+                        default=60 * 60,
+                        help='longest seconds to wait after repeated errors, defaults to 3600',
+                        )
+    parser.add_argument('--jitter',
+                        type=float,
+                        default=0.1,
+                        help='fraction of the interval to randomly add or subtract, defaults to 0.1',
+                        )
+    parser.add_argument('--listen',
+                        help='host:port to serve /health and /metrics on, such as 127.0.0.1:9911',
+                        )
+    parser.add_argument('--max-errors',
+                        type=int,
+                        default=3,
+                        help='failures in a row an account may have before /health reports the watcher as unhealthy, defaults to 3',
+                        )
+
+    add_filter_arguments(parser)
+
+    required = parser.add_argument_group('required arguments')
+    required.add_argument('--manifest',
+                          required=True,
+                          help='json file listing the accounts to watch, each with sync_id, password, password_env '
+                               'or password_file, urls (the output file) and optionally url, snapshot, removed and dead_links',
+                          )
+
+    #Get args
+    args = parser.parse_args()
+    if not 0 <= args.jitter < 1:
+        parser.error('--jitter must be at least 0 and less than 1')
+    if args.snapshot or args.removed or args.dead_links:
+        parser.error('give snapshot, removed and dead_links files per account in the manifest instead')
+    if args.filter_cache:
+        parser.error('the filter results of each account are kept in memory, --filter-cache is not needed')
+    if args.min_interval <= 0 or args.max_interval < args.min_interval:
+        parser.error('--min-interval must be positive and not above --max-interval')
+
+    rules = build_rules(args)
+    #Check the ArchiveBox index once before watching, later failures to open it only fail a poll
+    archivebox_index = open_archivebox_index(args)
+    if archivebox_index:
+        archivebox_index.close()
+    key_cache = load_key_cache(args.key_cache) if args.key_cache else {}
+    sync_state = load_sync_state(args.state) if args.state else {}
+
+    with open(args.manifest, "r") as manifestFile:
+        entries = json.load(manifestFile)
+    syncs = []
+    for entry in entries:
+        try:
+            sync = WatchedSync(entry, args.url, read_password(entry), args.min_interval)
+        except (OSError, KeyError, ValueError) as e:
+            print("ERROR: invalid manifest entry %s: %s" % (entry.get('sync_id'), e))
+            sys.exit(1)
+        if args.key_cache:
+            sync.key = get_cached_key(key_cache, sync.sync_id, sync.password)
+        syncs.append(sync)
+    if not syncs:
+        print("ERROR: the manifest lists no accounts")
+        sys.exit(1)
+
+    watcher = Watcher(syncs, args, rules, sync_state)
+    server = None
+    if args.listen:
+        host, _, port = args.listen.rpartition(':')
+        server = serve_status(watcher, host or '127.0.0.1', int(port))
+
+    #Stop between polls on SIGTERM or Ctrl-C, a running pipeline is finished first
+    def stop(signum, frame):
+        log("stopping")
+        watcher.stop()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    log("watching %d accounts" % len(syncs))
+    try:
+        watcher.run()
+    finally:
+        if server:
+            server.shutdown()
+        if args.key_cache:
+            for sync in syncs:
+                if sync.key is not None and get_cached_key(key_cache, sync.sync_id, sync.password) != sync.key:
+                    update_key_cache(key_cache, {'sync_id': sync.sync_id, 'key': sync.key}, sync.password,
+                                     args.key_cache_ttl)
+            save_key_cache(args.key_cache, key_cache)
+
+
+if __name__ == '__main__':
+    main()
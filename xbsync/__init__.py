@@ -0,0 +1,45 @@
+"""
+Download xBrowserSync bookmarks, filter them and prepare them for ArchiveBox.
+
+The main steps are available as functions from the package itself:
+
+    data, fields = fetch_encrypted(base_url, sync_id)
+    key = derive_key(sync_id, password)
+    text = decompress(decrypt(data, key))
+    for bookmark, path in filter(text, rules):
+        ...
+
+Submodules are only imported when one of their functions is first used, so importing
+the package is cheap and filtering never loads Cryptodome or the lzutf8 codec.
+"""
+import importlib
+
+name = "xbsync"
+
+__all__ = ["fetch_encrypted", "derive_key", "decrypt", "decompress", "iter_bookmarks", "filter",
+           "sync_bookmarks", "RuleSet", "RuleError"]
+
+_LAZY_ATTRIBUTES = {
+    "fetch_encrypted": "sync",
+    "derive_key": "sync",
+    "decrypt": "sync",
+    "decompress": "sync",
+    "sync_bookmarks": "sync",
+    "iter_bookmarks": "bookmarks",
+    "filter": "bookmarks",
+    "RuleSet": "bookmark_rules",
+    "RuleError": "bookmark_rules",
+}
+
+
+def __getattr__(attribute):
+    module = _LAZY_ATTRIBUTES.get(attribute)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, attribute))
+    value = getattr(importlib.import_module("." + module, __name__), attribute)
+    globals()[attribute] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,87 @@
+"""
+Look up which urls are already archived in a local ArchiveBox collection by reading
+its index.sqlite3 directly, read-only, in batched queries.
+"""
+import os
+import sqlite3
+import urllib.parse
+
+from .url_dedup import DEFAULT_TRACKING_PARAMS, canonicalize_url, url_digest
+
+INDEX_FILENAME = 'index.sqlite3'
+SNAPSHOT_TABLE = 'core_snapshot'
+#Stay below the SQLite limit of 999 variables per statement of older versions
+BATCH_SIZE = 500
+
+
+class ArchiveBoxIndexError(Exception):
+    pass
+
+
+class ArchiveBoxIndex:
+    """
+    Snapshot urls of the ArchiveBox collection in data_dir. Urls are matched exactly
+    against the snapshot table, or with canonical by their canonical form (see url_dedup),
+    which needs one pass over every snapshot url.
+    """
+
+    def __init__(self, data_dir, canonical=False, tracking_params=DEFAULT_TRACKING_PARAMS):
+        path = os.path.join(data_dir, INDEX_FILENAME)
+        if not os.path.isfile(path):
+            raise ArchiveBoxIndexError('no ArchiveBox index at ' + path)
+        try:
+            self.connection = sqlite3.connect(
+                'file:' + urllib.parse.quote(os.path.abspath(path)) + '?mode=ro', uri=True)
+            self.connection.execute('SELECT url FROM %s LIMIT 1' % SNAPSHOT_TABLE)
+        except sqlite3.Error as e:
+            raise ArchiveBoxIndexError('cannot read %s: %s' % (path, e))
+        self.canonical = canonical
+        self.tracking_params = tracking_params
+        self.canonical_digests = None
+        self.archived = 0
+
+    def _load_canonical_digests(self):
+        digests = set()
+        cursor = self.connection.execute('SELECT url FROM ' + SNAPSHOT_TABLE)
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            for (url,) in rows:
+                digests.add(url_digest(canonicalize_url(url, self.tracking_params)))
+        return digests
+
+    def _missing(self, urls):
+        if self.canonical:
+            if self.canonical_digests is None:
+                self.canonical_digests = self._load_canonical_digests()
+            archived = {url for url in urls
+                        if url_digest(canonicalize_url(url, self.tracking_params)) in self.canonical_digests}
+        else:
+            distinct = list(set(urls))
+            cursor = self.connection.execute(
+                'SELECT url FROM %s WHERE url IN (%s)' % (SNAPSHOT_TABLE, ','.join('?' * len(distinct))),
+                distinct)
+            archived = {url for (url,) in cursor}
+        for url in urls:
+            if url in archived:
+                self.archived += 1
+            else:
+                yield url
+
+    def filter_missing(self, urls, batch_size=BATCH_SIZE):
+        """
+        Yield the urls that are not archived yet, in order, looking them up batch_size
+        at a time.
+        """
+        batch = []
+        for url in urls:
+            batch.append(url)
+            if len(batch) >= batch_size:
+                yield from self._missing(batch)
+                batch = []
+        if batch:
+            yield from self._missing(batch)
+
+    def close(self):
+        self.connection.close()
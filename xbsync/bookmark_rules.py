@@ -0,0 +1,389 @@
+"""
+Include and exclude rules for bookmarks, compiled into lookup structures so that the
+cost of testing a bookmark does not grow with the number of rules.
+
+Rules files have one rule per line, blank lines and lines starting with # are ignored:
+
+    exclude folder Menu/Private          folder path and everything below it, / separated,
+    include folder **/Reading*           case insensitive, * ? [] globs per folder and ** for any depth
+    exclude domain example.com           the domain and all of its subdomains
+    exclude prefix https://example.org/tmp/
+    exclude suffix .pdf
+    exclude regex  ^https?://[^/]+/login
+    include scheme ftp                   only http and https are included unless scheme rules are given
+
+A bookmark is kept if no exclude rule matches it, and, for each kind of rule (folder,
+url and scheme) that has include rules, at least one of those include rules matches.
+"""
+import fnmatch
+import hashlib
+import re
+import urllib.parse
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+ACTIONS = ('include', 'exclude')
+KINDS = ('folder', 'domain', 'prefix', 'suffix', 'regex', 'scheme')
+DEFAULT_SCHEMES = ('http', 'https')
+
+
+class RuleError(ValueError):
+    pass
+
+
+class DomainTrie:
+    """
+    Trie over reversed domain labels, a host matches if it or any parent domain was added.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, domain):
+        node = self.root
+        for label in reversed(domain.lower().strip('.').lstrip('*.').split('.')):
+            node = node.setdefault(label, {})
+        node[None] = True
+
+    def matches(self, host):
+        node = self.root
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def __bool__(self):
+        return bool(self.root)
+
+
+class FolderTrie:
+    """
+    Trie over folder path components. Literal components are looked up in a dict, glob
+    components are tested with fnmatch and ** matches any number of folders.
+
+    Matching is incremental: step() advances a set of active nodes by one folder title,
+    so walking a tree costs one step per folder rather than one full path match.
+    """
+
+    def __init__(self):
+        self.root = self._new_node()
+
+    @staticmethod
+    def _new_node():
+        return {'literals': {}, 'globs': [], 'deep': None, 'end': False}
+
+    def add(self, path):
+        self.add_components(path.strip('/').split('/'))
+
+    def add_components(self, components, literal=False):
+        """
+        Add a path given as a list of components. With literal, components other than a
+        leading ** are matched exactly rather than as globs.
+        """
+        node = self.root
+        for index, component in enumerate(components):
+            #Names matched literally keep their spaces, they must match exactly
+            component = component.lower() if literal else component.strip().lower()
+            if literal and not (index == 0 and component == '**'):
+                node = node['literals'].setdefault(component, self._new_node())
+            elif component == '**':
+                if node['deep'] is None:
+                    node['deep'] = self._new_node()
+                    node['deep']['is_deep'] = True
+                node = node['deep']
+            elif any(char in component for char in '*?['):
+                for pattern, child in node['globs']:
+                    if pattern == component:
+                        node = child
+                        break
+                else:
+                    child = self._new_node()
+                    node['globs'].append((component, child))
+                    node = child
+            else:
+                node = node['literals'].setdefault(component, self._new_node())
+        node['end'] = True
+
+    def _closure(self, nodes):
+        result = []
+        for node in nodes:
+            while node is not None and not any(node is seen for seen in result):
+                result.append(node)
+                node = node['deep']
+        return tuple(result)
+
+    def initial(self):
+        """
+        Return the match state for the root of the tree, a tuple of (active nodes, matched).
+        """
+        nodes = self._closure([self.root])
+        return nodes, any(node['end'] for node in nodes)
+
+    def step(self, state, title):
+        """
+        Return the match state after entering a folder called title. Once a folder
+        matched, every folder below it matches too.
+        """
+        nodes, matched = state
+        if matched:
+            return state
+        title = title.lower()
+        next_nodes = []
+        for node in nodes:
+            child = node['literals'].get(title)
+            if child is not None:
+                next_nodes.append(child)
+            for pattern, child in node['globs']:
+                if fnmatch.fnmatchcase(title, pattern):
+                    next_nodes.append(child)
+            if node.get('is_deep'):
+                next_nodes.append(node)
+        nodes = self._closure(next_nodes)
+        return nodes, any(node['end'] for node in nodes)
+
+    def __bool__(self):
+        return bool(self.root['literals'] or self.root['globs'] or self.root['deep'] or self.root['end'])
+
+
+def _trie_pattern(strings):
+    """
+    Build a regex alternation for literal strings, factored on common prefixes so that
+    the regex engine does not try every alternative in turn.
+    """
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        #Follow chains of single characters without recursing, so long strings stay shallow
+        pattern = ''
+        while len(node) == 1:
+            char, child = next(iter(node.items()))
+            if not char:
+                return pattern
+            pattern += re.escape(char)
+            node = child
+        optional = '' in node
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if len(alternatives) == 1:
+            return pattern + '(?:' + alternatives[0] + ')?'
+        pattern += '(?:' + '|'.join(alternatives) + ')'
+        return pattern + '?' if optional else pattern
+
+    return build(trie)
+
+
+def _has_groupref(parsed):
+    """
+    Return whether a parsed regex refers back to one of its groups, (?P=name), \1 or
+    (?(1)...), anywhere in it.
+    """
+    stack = [parsed]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, sre_parse.SubPattern):
+            for op, av in item:
+                if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+                    return True
+                stack.append(av)
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return False
+
+
+def _joinable(regex, compiled, group_names):
+    """
+    Return whether regex can go into the combined alternation: joining renumbers its
+    groups, so it must not refer back to them, and global flags like (?i) would apply to
+    every alternative.
+    """
+    if compiled.flags != re.compile('').flags:
+        return False
+    if group_names & set(compiled.groupindex):
+        return False
+    return not _has_groupref(sre_parse.parse(regex))
+
+
+class UrlRules:
+    """
+    Domain, prefix, suffix and regex rules for one action. Domains go into a DomainTrie,
+    prefixes, suffixes and regex rules are combined into a single regex. Regex rules that
+    refer back to their groups or set global flags are compiled on their own.
+    """
+
+    def __init__(self):
+        self.domains = DomainTrie()
+        self.prefixes = []
+        self.suffixes = []
+        self.regexes = []
+        self.regex = None
+        self.compiled_regexes = []
+
+    def compile(self):
+        parts = []
+        if self.prefixes:
+            parts.append('^' + _trie_pattern(self.prefixes))
+        if self.suffixes:
+            parts.append(_trie_pattern(self.suffixes) + '$')
+        self.compiled_regexes = []
+        group_names = set()
+        for regex in self.regexes:
+            try:
+                compiled = re.compile(regex)
+            except re.error as e:
+                raise RuleError('invalid regex %r: %s' % (regex, e))
+            if _joinable(regex, compiled, group_names):
+                parts.append('(?:' + regex + ')')
+                group_names.update(compiled.groupindex)
+            else:
+                self.compiled_regexes.append(compiled)
+        self.regex = re.compile('|'.join(parts)) if parts else None
+
+    def matches(self, url, host):
+        if host and self.domains and self.domains.matches(host):
+            return True
+        if self.regex is not None and self.regex.search(url) is not None:
+            return True
+        return any(regex.search(url) is not None for regex in self.compiled_regexes)
+
+    def __bool__(self):
+        return bool(self.domains) or self.regex is not None or bool(self.compiled_regexes)
+
+
+class RuleSet:
+    """
+    Compiled include and exclude rules. Folder matching is incremental, use
+    root_state() and enter_folder() while walking the tree, then check_bookmark()
+    with the state of the folder a bookmark is in.
+    """
+
+    def __init__(self):
+        self.folders = {action: FolderTrie() for action in ACTIONS}
+        self.urls = {action: UrlRules() for action in ACTIONS}
+        self.schemes = {action: set() for action in ACTIONS}
+        #Every rule as it was added, for fingerprint()
+        self.added = []
+        self.compiled = False
+
+    def add_rule(self, action, kind, pattern):
+        if action not in ACTIONS:
+            raise RuleError('unknown rule action: ' + action)
+        if kind not in KINDS:
+            raise RuleError('unknown rule kind: ' + kind)
+        if not pattern:
+            raise RuleError('empty pattern for %s %s rule' % (action, kind))
+        if kind == 'folder':
+            self.folders[action].add(pattern)
+        elif kind == 'domain':
+            self.urls[action].domains.add(pattern)
+        elif kind == 'prefix':
+            self.urls[action].prefixes.append(pattern)
+        elif kind == 'suffix':
+            self.urls[action].suffixes.append(pattern)
+        elif kind == 'regex':
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise RuleError('invalid regex %r: %s' % (pattern, e))
+            self.urls[action].regexes.append(pattern)
+        elif kind == 'scheme':
+            self.schemes[action].add(pattern.lower().rstrip(':'))
+        self.added.append((action, kind, pattern))
+        self.compiled = False
+
+    def exclude_folder_name(self, name):
+        """
+        Exclude every folder called exactly name (case insensitive), at any depth.
+        """
+        self.folders['exclude'].add_components(['**', name], literal=True)
+        self.added.append(('exclude', 'folder name', name))
+        self.compiled = False
+
+    def add_rules_from_lines(self, lines):
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split(None, 2)
+            if len(parts) != 3:
+                raise RuleError('line %d: expected "<include|exclude> <kind> <pattern>": %s' % (number, line))
+            try:
+                self.add_rule(parts[0].lower(), parts[1].lower(), parts[2])
+            except RuleError as e:
+                raise RuleError('line %d: %s' % (number, e))
+
+    def add_rules_from_file(self, path):
+        with open(path, "r") as rulesFile:
+            self.add_rules_from_lines(rulesFile)
+
+    def compile(self):
+        for rules in self.urls.values():
+            rules.compile()
+        self.allowed_schemes = self.schemes['include'] or set(DEFAULT_SCHEMES)
+        self.allowed_schemes = self.allowed_schemes - self.schemes['exclude']
+        self.compiled = True
+        return self
+
+    def fingerprint(self):
+        """
+        Return a hex digest that changes whenever the rules would filter differently.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for rule in self.added:
+            digest.update('\0'.join(rule).encode('utf-8', 'surrogatepass') + b'\n')
+        return digest.hexdigest()
+
+    def root_state(self):
+        if not self.compiled:
+            self.compile()
+        return self.folders['include'].initial(), self.folders['exclude'].initial()
+
+    def enter_folder(self, state, title):
+        """
+        Return the state for the folder title inside the folder with state, or None if
+        the folder is excluded and does not need to be walked.
+        """
+        include_state, exclude_state = state
+        exclude_state = self.folders['exclude'].step(exclude_state, title)
+        if exclude_state[1]:
+            return None
+        return self.folders['include'].step(include_state, title), exclude_state
+
+    def state_for_path(self, path):
+        state = self.root_state()
+        for title in path:
+            state = self.enter_folder(state, title)
+            if state is None:
+                return None
+        return state
+
+    def check_bookmark(self, url, state):
+        """
+        Return None if the bookmark with url, in the folder with state, is kept, otherwise
+        the kind of rule that rejected it: 'folder', 'scheme' or 'url'.
+        """
+        if not self.compiled:
+            self.compile()
+        if self.folders['include'] and not state[0][1]:
+            return 'folder'
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme.lower() not in self.allowed_schemes:
+            return 'scheme'
+        try:
+            host = parts.hostname
+        except ValueError:
+            host = None
+        if self.urls['exclude'] and self.urls['exclude'].matches(url, host):
+            return 'url'
+        if self.urls['include'] and not self.urls['include'].matches(url, host):
+            return 'url'
+        return None
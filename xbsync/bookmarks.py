@@ -0,0 +1,193 @@
+"""
+Walk and filter xBrowserSync bookmark trees.
+
+A bookmark tree is a list of folders, dicts with a "title" and a list of "children", and
+bookmarks, dicts with a "url". Walks yield (bookmark, folder path) pairs, the path being
+a tuple of the titles of the folders the bookmark is in.
+"""
+import json
+
+from .bookmark_rules import RuleSet
+
+#Report a bookmark the rules rejected
+def rejected_bookmark(url, reason):
+    if reason == 'scheme':
+        print("url scheme not included, ignoring: " + url)
+
+#Report a node that is neither a folder nor a bookmark according to on_malformed,
+#which is one of 'warn', 'skip' or 'error'
+def malformed_node(message, on_malformed):
+    if on_malformed == 'error':
+        raise ValueError(message)
+    if on_malformed == 'warn':
+        print(message)
+
+#filter bookmark folders, yield (bookmark, folder path) for bookmarks the rules keep
+def filter_bookmarks(bookmarks, rules, on_malformed='warn'):
+    """
+    Walk the bookmark tree with an explicit stack of child iterators, one per open folder
+    or list, so deep trees neither recurse nor copy results between levels.
+    """
+    path = []
+    states = [rules.root_state()]
+    stack = [(iter([bookmarks]), False)]
+    while stack:
+        children, is_folder = stack[-1]
+        for node in children:
+            break
+        else:
+            stack.pop()
+            if is_folder:
+                path.pop()
+                states.pop()
+            continue
+
+        if isinstance(node, dict):
+            if "children" in node:
+                if "url" in node:
+                    malformed_node('found url in children dict: ' + str(node['url']), on_malformed)
+                title = node.get('title', '')
+                state = rules.enter_folder(states[-1], title)
+                if state is None:
+                    print('skipping folder ' + title)
+                else:
+                    path.append(title)
+                    states.append(state)
+                    folder_children = node['children']
+                    if not isinstance(folder_children, list):
+                        folder_children = [folder_children]
+                    stack.append((iter(folder_children), True))
+            elif "url" in node:
+                reason = rules.check_bookmark(node['url'], states[-1])
+                if reason is None:
+                    yield node, tuple(path)
+                else:
+                    rejected_bookmark(node['url'], reason)
+            else:
+                malformed_node('did not find children or url in dict', on_malformed)
+        elif isinstance(node, list):
+            stack.append((iter(node), False))
+        else:
+            malformed_node('unexpected node of type ' + type(node).__name__, on_malformed)
+
+#filter the events of xbsync.json_stream, yield (bookmark, folder path) like filter_bookmarks
+def filter_bookmark_events(events, rules, on_malformed='warn'):
+    path = []
+    states = [rules.root_state()]
+    #Depth of folders entered below an excluded folder, whose events are ignored
+    skipped_depth = 0
+    for kind, node in events:
+        if skipped_depth:
+            if kind == 'folder':
+                skipped_depth += 1
+            elif kind == 'end':
+                skipped_depth -= 1
+        elif kind == 'folder':
+            if "url" in node:
+                malformed_node('found url in children dict: ' + str(node['url']), on_malformed)
+            title = node.get('title', '')
+            state = rules.enter_folder(states[-1], title)
+            if state is None:
+                print('skipping folder ' + title)
+                skipped_depth = 1
+            else:
+                path.append(title)
+                states.append(state)
+        elif kind == 'end':
+            path.pop()
+            states.pop()
+        elif kind == 'bookmark':
+            if "url" in node:
+                reason = rules.check_bookmark(node['url'], states[-1])
+                if reason is None:
+                    yield node, tuple(path)
+                else:
+                    rejected_bookmark(node['url'], reason)
+            else:
+                malformed_node('did not find children or url in dict', on_malformed)
+        else:
+            malformed_node('unexpected node of type ' + type(node).__name__, on_malformed)
+
+#filter flat bookmark records, one json object per line with the folder titles in "path",
+#yield (bookmark, folder path) like filter_bookmarks
+def filter_flat_bookmarks(lines, rules, on_malformed='warn'):
+    skipped_folders = set()
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            bookmark = json.loads(line)
+        except ValueError as e:
+            malformed_node('invalid json on line %d: %s' % (number, e), on_malformed)
+            continue
+        if not isinstance(bookmark, dict):
+            malformed_node('unexpected record of type %s on line %d' % (type(bookmark).__name__, number), on_malformed)
+            continue
+        if "url" not in bookmark:
+            malformed_node('did not find url in record on line %d' % number, on_malformed)
+            continue
+        path = bookmark.get('path', [])
+        state = rules.root_state()
+        for depth, title in enumerate(path):
+            state = rules.enter_folder(state, title)
+            if state is None:
+                folder = tuple(path[:depth + 1])
+                if folder not in skipped_folders:
+                    skipped_folders.add(folder)
+                    print('skipping folder ' + title)
+                break
+        else:
+            reason = rules.check_bookmark(bookmark['url'], state)
+            if reason is None:
+                yield bookmark, tuple(path)
+            else:
+                rejected_bookmark(bookmark['url'], reason)
+
+#yield the url to write for each bookmark, canonicalized and without duplicates if asked to
+def output_urls(bookmarks, url_index, dedupe=False, canonicalize=False):
+    for bookmark, path in bookmarks:
+        url = bookmark['url']
+        if dedupe:
+            canonical = url_index.add(url)
+            if canonical is None:
+                continue
+        elif canonicalize:
+            canonical = url_index.canonicalize(url)
+        yield canonical if canonicalize else url
+
+#Work out the input format from the first character, a json bookmark tree is a list
+def detect_input_format(inputFile):
+    while True:
+        char = inputFile.read(1)
+        if not char or not char.isspace():
+            break
+    inputFile.seek(0)
+    return 'ndjson' if char == '{' else 'json'
+
+def iter_bookmarks(bookmarks):
+    """
+    Yield (bookmark, folder path) for every bookmark in a tree, given parsed or as json text.
+    """
+    if isinstance(bookmarks, (str, bytes)):
+        bookmarks = json.loads(bookmarks)
+    stack = [(bookmarks, ())]
+    while stack:
+        node, path = stack.pop()
+        if isinstance(node, list):
+            stack.extend((child, path) for child in reversed(node))
+        elif isinstance(node, dict):
+            if "children" in node:
+                stack.append((node["children"], path + (node.get("title", ""),)))
+            elif "url" in node:
+                yield node, path
+
+def filter(bookmarks, rules=None, on_malformed='warn'):
+    """
+    Yield (bookmark, folder path) for the bookmarks of a tree, given parsed or as json
+    text, that a RuleSet keeps. Without rules, every http and https bookmark is kept.
+    """
+    if isinstance(bookmarks, (str, bytes)):
+        bookmarks = json.loads(bookmarks)
+    if rules is None:
+        rules = RuleSet()
+    return filter_bookmarks(bookmarks, rules, on_malformed)
@@ -0,0 +1,276 @@
+"""
+Command line helpers shared by the scripts: argument definitions, setup from the parsed
+arguments and the parts of the scripts that work on them.
+"""
+import json
+import sys
+import time
+
+from .bookmark_rules import RuleSet, RuleError
+from .bookmarks import filter_bookmarks, output_urls
+from .stage_stats import NO_STATS
+from .url_dedup import UrlIndex, DEFAULT_TRACKING_PARAMS
+
+#Filter options, shared with the other scripts that filter bookmarks
+def add_filter_arguments(parser):
+    parser.add_argument('-m', '--filter-directories',
+                        nargs='+',
+                        dest='dirs',
+                        help='list of directory names to exclude, space separated, enclose in double quotes, case insensitive'
+                        )
+
+    parser.add_argument('-r', '--rules',
+                        nargs='+',
+                        help='files with include and exclude rules for folder paths, urls and schemes, see xbsync/bookmark_rules.py for the format',
+                        )
+
+    parser.add_argument('--on-malformed',
+                        choices=['warn', 'skip', 'error'],
+                        default='warn',
+                        help='what to do with entries that are neither folders nor bookmarks: print and skip them, skip them silently, or stop with an error, defaults to warn',
+                        )
+
+    parser.add_argument('--canonicalize',
+                        action='store_true',
+                        help='write urls in canonical form: lowercase host, no default port, no tracking parameters, sorted query, no fragment or trailing slash',
+                        )
+
+    parser.add_argument('--dedupe',
+                        action='store_true',
+                        help='only write the first of several urls with the same canonical form',
+                        )
+
+    parser.add_argument('--dedupe-on-disk',
+                        action='store_true',
+                        help='keep the de-duplication index in a temporary file instead of memory, for very large bookmark sets, implies --dedupe',
+                        )
+
+    parser.add_argument('--tracking-params',
+                        nargs='+',
+                        default=list(DEFAULT_TRACKING_PARAMS),
+                        help='query parameters to strip when canonicalizing, * globs allowed, defaults to ' + ' '.join(DEFAULT_TRACKING_PARAMS),
+                        )
+
+    parser.add_argument('-a', '--archivebox-dir',
+                        help='ArchiveBox data directory, only write urls that are not in its index yet',
+                        )
+
+    parser.add_argument('--archivebox-canonical',
+                        action='store_true',
+                        help='compare urls with the ArchiveBox index by their canonical form rather than exactly',
+                        )
+
+    parser.add_argument('--snapshot',
+                        help='file with the urls written by the previous run, only urls added since then are written, '
+                             'the file is updated once all urls have been written',
+                        )
+
+    parser.add_argument('--removed',
+                        help='with --snapshot, file to write the urls removed since the previous run to',
+                        )
+
+    parser.add_argument('--filter-cache',
+                        help='file to keep the filter results of each folder in, folders unchanged since the '
+                             'previous run with the same rules are not filtered again',
+                        )
+
+    parser.add_argument('--check-links',
+                        action='store_true',
+                        help='check every url that would be written and skip those whose host does not exist or whose page is gone',
+                        )
+
+    parser.add_argument('--dead-links',
+                        help='file to add the urls skipped as dead to, implies --check-links',
+                        )
+
+    parser.add_argument('--link-cache',
+                        help='file to keep link check results in, urls checked less than --link-cache-ttl ago are not checked again',
+                        )
+
+    parser.add_argument('--link-cache-ttl',
+                        type=int,
+                        default=7 * 24 * 3600,
+                        help='seconds link check results are kept for, defaults to a week',
+                        )
+
+    parser.add_argument('--link-concurrency',
+                        type=int,
+                        default=32,
+                        help='number of link checks to run at once, defaults to 32',
+                        )
+
+    parser.add_argument('--link-timeout',
+                        type=float,
+                        default=5,
+                        help='seconds to wait for a host to connect and answer before its url is kept unchecked, defaults to 5',
+                        )
+
+#Compile filter rules from args, exits on invalid rules
+def build_rules(args):
+    rules = RuleSet()
+    for directory in args.dirs or []:
+        rules.exclude_folder_name(directory.strip("'"))
+    try:
+        for rules_path in args.rules or []:
+            rules.add_rules_from_file(rules_path)
+        return rules.compile()
+    except (OSError, RuleError) as e:
+        print("ERROR: cannot load rules: " + str(e))
+        sys.exit(1)
+
+#Open the ArchiveBox index given in args, if any, exits if it cannot be read
+def open_archivebox_index(args):
+    if not args.archivebox_dir:
+        return None
+    from .archivebox_index import ArchiveBoxIndex, ArchiveBoxIndexError
+    try:
+        return ArchiveBoxIndex(args.archivebox_dir, args.archivebox_canonical, args.tracking_params)
+    except ArchiveBoxIndexError as e:
+        print("ERROR: " + str(e))
+        sys.exit(1)
+
+#Open the snapshot given in args, if any
+def open_snapshot(args):
+    if not args.snapshot:
+        return None
+    from .snapshot_store import UrlSnapshot
+    return UrlSnapshot(args.snapshot)
+
+#Set up checking urls for dead links if args ask for it, dead urls go to dead_path
+def open_link_checker(args, dead_path=None):
+    if not (args.check_links or dead_path):
+        return None
+    from .link_check import LinkCache, LinkChecker
+    return LinkChecker(args.link_concurrency, timeout=args.link_timeout,
+                       cache=LinkCache(args.link_cache, args.link_cache_ttl), dead_path=dead_path)
+
+#Filter a bookmark tree, through the filter cache given in args if any.
+#Returns the filtered bookmarks and the cache to save once they have been used, or None
+def filter_tree(bookmarks, rules, args):
+    if not args.filter_cache:
+        return filter_bookmarks(bookmarks, rules, args.on_malformed), None
+    from .subtree_cache import SubtreeCache
+    subtree_cache = SubtreeCache(rules, args.filter_cache)
+    return subtree_cache.filter(bookmarks, args.on_malformed), subtree_cache
+
+#Save the filter cache and report how much of the tree it saved filtering
+def save_filter_cache(subtree_cache):
+    print('reused the filter results of %d folders, filtered %d' % (subtree_cache.reused, subtree_cache.filtered))
+    subtree_cache.save()
+
+#Write the removed urls if asked to and replace the snapshot, once the new urls were written
+def commit_snapshot(snapshot, args):
+    if args.removed:
+        with open(args.removed, "w") as removedFile:
+            for url in snapshot.removed_urls():
+                removedFile.write(url + "\n")
+    snapshot.commit()
+
+def write_urls(bookmarks, outputFile, args, archivebox_index=None, snapshot=None, flush=False, stats=NO_STATS,
+               link_checker=None):
+    """
+    Write the url of each filtered bookmark to outputFile, applying the de-duplication,
+    snapshot, ArchiveBox and link check options in args, then print what was skipped. With flush,
+    every url is flushed as soon as it is written. Each stage is counted in stats.
+    """
+    url_index = UrlIndex(on_disk=args.dedupe_on_disk, tracking_params=args.tracking_params)
+    dedupe = args.dedupe or args.dedupe_on_disk
+    try:
+        urls = stats.iterate('dedupe', output_urls(bookmarks, url_index, dedupe, args.canonicalize))
+        if snapshot:
+            urls = stats.iterate('snapshot', snapshot.diff(urls), source='dedupe')
+        if archivebox_index:
+            urls = stats.iterate('archivebox', archivebox_index.filter_missing(urls))
+        if link_checker:
+            #Dead urls stay out of the snapshot, so that they are checked again next time
+            urls = stats.iterate('links', link_checker.filter_alive(urls, snapshot.exclude if snapshot else None))
+        with stats.stage('write'):
+            for url in urls:
+                outputFile.write(url + "\n")
+                if flush:
+                    outputFile.flush()
+    finally:
+        url_index.close()
+
+    if dedupe:
+        print('skipped %d duplicate urls' % url_index.duplicates)
+    if snapshot:
+        print('skipped %d urls already in the snapshot, %d removed since' % (
+            snapshot.unchanged, len(snapshot.removed_offsets)))
+    if archivebox_index:
+        print('skipped %d urls already in ArchiveBox' % archivebox_index.archived)
+    if link_checker:
+        print('skipped %d dead urls (%s), kept %d that could not be checked (%s), checked %d urls, '
+              '%d known from the link cache' % (
+                  sum(link_checker.dead.values()),
+                  ', '.join('%d %s' % (count, reason) for reason, count in sorted(link_checker.dead.items())) or 'none',
+                  sum(link_checker.failed.values()),
+                  ', '.join('%d %s' % (count, reason) for reason, count in sorted(link_checker.failed.items())) or 'none',
+                  link_checker.checked, link_checker.cached))
+
+def read_manifest(path):
+    with open(path, "r") as manifestFile:
+        return json.load(manifestFile)
+
+def run_manifest(args, key_cache, sync_state, stats_reports=None):
+    """
+    Sync every account in the manifest file, spreading them over a pool of processes.
+
+    If stats_reports is a list, the stage statistics of each account are appended to it.
+    Returns the number of accounts that failed.
+    """
+    import concurrent.futures
+    from .sync import (get_cached_key, read_password, sync_bookmarks, sync_bookmarks_with_stats,
+                       update_key_cache, update_sync_state)
+    entries = read_manifest(args.manifest)
+
+    start_time = time.perf_counter()
+    failures = 0
+    total_bytes = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for entry in entries:
+            sync_id = entry.get('sync_id')
+            try:
+                password = read_password(entry)
+                base_url = entry.get('url', args.url).strip().rstrip('/')
+                arguments = (base_url, entry['sync_id'], password, entry['output'], entry.get('format', args.format))
+            except (OSError, KeyError, ValueError) as e:
+                print("FAILED    %s: invalid manifest entry: %s" % (sync_id, e))
+                failures += 1
+                continue
+            cached_key = get_cached_key(key_cache, sync_id, password) if args.key_cache else None
+            previous = sync_state.get(sync_id, {})
+            conditions = (cached_key, previous.get('lastUpdated'))
+            if stats_reports is None:
+                future = executor.submit(sync_bookmarks, *arguments, *conditions, etag=previous.get('etag'))
+            else:
+                future = executor.submit(sync_bookmarks_with_stats, *arguments, *conditions, etag=previous.get('etag'))
+            futures[future] = (sync_id, password)
+
+        for future in concurrent.futures.as_completed(futures):
+            sync_id, password = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print("FAILED    %s: %s: %s" % (sync_id, type(e).__name__, e))
+                failures += 1
+                continue
+            if stats_reports is not None:
+                stats_reports.append(({'script': 'get_xbs_bookmarks', 'output': result['output']}, result['stats']))
+            if result['status'] == 'unchanged':
+                print("UNCHANGED %s: no changes since %s" % (sync_id, result['lastUpdated']))
+                continue
+            total_bytes += result['bytes']
+            print("UPDATED   %s: %d bytes written to %s, key setup %.3f s (%s)" % (
+                sync_id, result['bytes'], result['output'], result['key_setup_time'],
+                'cached' if result['key_from_cache'] else 'derived'))
+            if args.key_cache and not result['key_from_cache']:
+                update_key_cache(key_cache, result, password, args.key_cache_ttl)
+            if args.state:
+                update_sync_state(sync_state, result)
+
+    elapsed = time.perf_counter() - start_time
+    print("%d accounts, %d failed, %d bytes in %.2f s (%.0f bytes/s)" % (
+        len(entries), failures, total_bytes, elapsed, total_bytes / max(elapsed, 1e-9)))
+    return failures
@@ -0,0 +1,162 @@
+"""
+Small HTTP client for the sync api, built on http.client.
+
+Connections are kept open in a pool, one per scheme and host, and reused by later
+requests of the same process. Responses are requested gzip compressed and decompressed
+as they are read. Failed connections, resets and 5xx or 429 responses are retried a
+few times with exponential backoff, as long as nothing of the response was used yet.
+"""
+import contextlib
+import http.client
+import time
+import urllib.parse
+import zlib
+
+#Seconds to wait for a connection, and for each read from it
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+#Retries after the first attempt, and the wait before the first of them, doubled each time
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+#Longest Retry-After of a server that is honoured, in seconds
+MAX_RETRY_AFTER = 30
+
+
+class BadURL(Exception):
+    pass
+
+
+class NotModified(Exception):
+    """
+    Raised for a 304 response to a request with an etag.
+    """
+
+
+class DecodedResponse:
+    """
+    Wraps an http.client response and undoes its gzip or deflate Content-Encoding while
+    it is read. read() returns b'' only at the end of the body.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        encoding = (response.getheader('Content-Encoding') or '').strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.decompressor = zlib.decompressobj()
+        else:
+            self.decompressor = None
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, size=-1):
+        try:
+            return self._read(size)
+        except zlib.error as e:
+            raise BadURL("invalid compressed response: %s" % e)
+
+    def _read(self, size):
+        if self.decompressor is None:
+            return self.response.read() if size is None or size < 0 else self.response.read(size)
+        if size is None or size < 0:
+            data = self.decompressor.unconsumed_tail + self.response.read()
+            return self.decompressor.decompress(data) + self.decompressor.flush()
+        while True:
+            data = self.decompressor.unconsumed_tail or self.response.read(size)
+            if not data:
+                return self.decompressor.flush()
+            data = self.decompressor.decompress(data, size)
+            if data:
+                return data
+
+
+#Persistent connections to the api, one per scheme and host, kept open between
+#requests made by the same process
+connection_pool = {}
+
+
+def _connect(parts, connect_timeout, timeout):
+    if parts.scheme == 'https':
+        connection = http.client.HTTPSConnection(parts.netloc, timeout=connect_timeout)
+    else:
+        connection = http.client.HTTPConnection(parts.netloc, timeout=connect_timeout)
+    connection.connect()
+    connection.sock.settimeout(timeout)
+    return connection
+
+
+def _release(pool_key, connection, response):
+    if response.isclosed() and not response.will_close:
+        connection_pool[pool_key] = connection
+    else:
+        connection.close()
+
+
+def _retry_delay(attempt, response=None):
+    delay = RETRY_BACKOFF * 2 ** attempt
+    retry_after = response.getheader('Retry-After') if response is not None else None
+    if retry_after and retry_after.strip().isdigit():
+        delay = max(delay, min(int(retry_after), MAX_RETRY_AFTER))
+    return delay
+
+
+@contextlib.contextmanager
+def open_url(url, timeout=READ_TIMEOUT, connect_timeout=CONNECT_TIMEOUT, retries=RETRIES, etag=None):
+    """
+    GET url over a pooled keep-alive connection and yield the response as a
+    DecodedResponse.
+
+    The connection goes back to the pool once the response has been read completely.
+    With etag, the request is conditional and NotModified is raised if it still matches.
+    Raises BadURL for any other status than 200, once retries are used up for 5xx and 429.
+    """
+    parts = urllib.parse.urlsplit(url)
+    pool_key = (parts.scheme, parts.netloc)
+    path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+    if etag:
+        headers['If-None-Match'] = etag
+
+    attempt = 0
+    while True:
+        connection = connection_pool.pop(pool_key, None)
+        reused = connection is not None
+        try:
+            if connection is None:
+                connection = _connect(parts, connect_timeout, timeout)
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException):
+            if connection is not None:
+                connection.close()
+            if reused:
+                #The server may have dropped an idle pooled connection, try again on a new one
+                continue
+            if attempt >= retries:
+                raise
+            time.sleep(_retry_delay(attempt))
+            attempt += 1
+            continue
+
+        if (response.status >= 500 or response.status == 429) and attempt < retries:
+            response.read()
+            _release(pool_key, connection, response)
+            time.sleep(_retry_delay(attempt, response))
+            attempt += 1
+            continue
+        break
+
+    try:
+        if response.status == 304 and etag:
+            response.read()
+            raise NotModified(url)
+        if response.status != 200:
+            response.read()
+            raise BadURL("HTTP error %d %s: %s" % (response.status, response.reason, url))
+        yield DecodedResponse(response)
+    finally:
+        _release(pool_key, connection, response)
@@ -0,0 +1,264 @@
+"""
+Read a json bookmark tree incrementally from a memory-mapped file.
+
+Only a window of about a megabyte of the file is decoded at a time. Folders are parsed
+key by key, so their children are never held in memory at once, while each bookmark is
+handed to json's C scanner in one call. The tree comes out as a stream of events:
+
+    ('folder', node)    a folder, node holds its keys up to "children"
+    ('end', None)       the end of the folder most recently started
+    ('bookmark', node)  any other dict, normally a bookmark with a "url"
+    ('value', value)    a node that is neither a dict nor a list
+
+Lists are transparent, their nodes come out in order without events of their own.
+"""
+import codecs
+import json
+import json.scanner
+import mmap
+import os
+import re
+
+#Bytes decoded at a time
+CHUNK_SIZE = 1 << 20
+#Characters kept ahead of the parse position, so that no token is cut by the window end
+MARGIN = 1 << 16
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class MappedJsonReader:
+    """
+    Window of decoded text over a memory-mapped utf-8 file, and json scanning within it.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.inputFile = open(path, "rb")
+        size = os.fstat(self.inputFile.fileno()).st_size
+        self.mapped = mmap.mmap(self.inputFile.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.eof = not size
+        self.text = ''
+        self.pos = 0
+        self.scan_once = json.scanner.make_scanner(json.JSONDecoder())
+        self._fill(MARGIN)
+        if self.text.startswith('\ufeff'):
+            self.pos = 1
+
+    def _fill(self, minimum):
+        """
+        Drop the text before pos and decode until at least minimum characters are
+        ahead of it, or the file ends.
+        """
+        text = self.text[self.pos:]
+        while len(text) < minimum and not self.eof:
+            chunk = self.mapped[self.offset:self.offset + self.chunk_size]
+            if hasattr(mmap, 'MADV_DONTNEED') and isinstance(self.mapped, mmap.mmap):
+                #The chunk has been copied, drop its pages so they do not count towards our RSS
+                start = self.offset - self.offset % mmap.PAGESIZE
+                self.mapped.madvise(mmap.MADV_DONTNEED, start, self.offset + len(chunk) - start)
+            self.offset += len(chunk)
+            self.eof = self.offset >= len(self.mapped)
+            text += self.decoder.decode(chunk, self.eof)
+        self.text = text
+        self.pos = 0
+
+    def error(self, message):
+        line_start = self.text.rfind('\n', 0, self.pos) + 1
+        return ValueError('%s near %r' % (message, self.text[line_start:self.pos + 40]))
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character, or '' at the end of the file.
+        """
+        while True:
+            if len(self.text) - self.pos < MARGIN and not self.eof:
+                self._fill(max(MARGIN, self.chunk_size))
+            self.pos = WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text) or self.eof:
+                return self.text[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self.error('expected %r' % char)
+        self.pos += 1
+
+    def value(self):
+        """
+        Parse the json value at pos, growing the window if it does not fit.
+        """
+        self.peek()
+        while True:
+            try:
+                value, self.pos = self.scan_once(self.text, self.pos)
+                return value
+            except (StopIteration, json.JSONDecodeError):
+                if self.eof:
+                    raise self.error('invalid json value')
+                self._fill(len(self.text) - self.pos + self.chunk_size)
+
+    def flat_dict_end(self):
+        """
+        Return where the dict at pos ends if it holds no nested dict and no "children" key
+        within the window, otherwise -1. A } inside a string can end the search early, the
+        caller checks the parsed dict again.
+        """
+        end = self.text.find('}', self.pos)
+        if end == -1 or self.text.find('{', self.pos + 1, end) != -1:
+            return -1
+        if self.text.find('"children"', self.pos, end) != -1:
+            return -1
+        return end
+
+    def close(self):
+        if isinstance(self.mapped, mmap.mmap):
+            self.mapped.close()
+        self.inputFile.close()
+
+
+def iter_node_events(node):
+    """
+    Yield the events of a bookmark tree that is already in memory.
+    """
+    stack = [(iter([node]), False)]
+    while stack:
+        children, is_folder = stack[-1]
+        for node in children:
+            break
+        else:
+            stack.pop()
+            if is_folder:
+                yield 'end', None
+            continue
+        if isinstance(node, dict):
+            if "children" in node:
+                yield 'folder', node
+                children = node['children']
+                stack.append((iter(children if isinstance(children, list) else [children]), True))
+            else:
+                yield 'bookmark', node
+        elif isinstance(node, list):
+            stack.append((iter(node), False))
+        else:
+            yield 'value', node
+
+
+def iter_tree_events(path, chunk_size=CHUNK_SIZE):
+    """
+    Yield the events of the bookmark tree in the json file at path, without loading
+    the whole file or tree.
+
+    A folder whose "children" come before its "title" is parsed into memory on its own
+    and its events are yielded once it is complete.
+    """
+    reader = MappedJsonReader(path, chunk_size)
+    try:
+        #One entry per open list or folder, a folder stays open until its closing }
+        stack = []
+        while True:
+            #Parse one node
+            char = reader.peek()
+            if char == '[':
+                reader.pos += 1
+                if reader.peek() == ']':
+                    reader.pos += 1
+                else:
+                    stack.append('list')
+                    continue
+            elif char == '{':
+                end = reader.flat_dict_end()
+                if end != -1:
+                    node = reader.value()
+                    if "children" in node:
+                        yield from iter_node_events(node)
+                    else:
+                        yield 'bookmark', node
+                else:
+                    node = yield from _parse_dict(reader, stack)
+                    if node is None:
+                        #Inside the children of a folder
+                        continue
+            elif char:
+                yield 'value', reader.value()
+            else:
+                raise reader.error('unexpected end of file')
+
+            #The node is complete, carry on with the list or folder it is in
+            while stack:
+                if stack[-1] == 'list':
+                    char = reader.peek()
+                    reader.pos += 1
+                    if char == ',':
+                        break
+                    if char != ']':
+                        raise reader.error("expected ',' or ']'")
+                    stack.pop()
+                else:
+                    stack.pop()
+                    yield 'end', None
+                    _skip_dict_rest(reader)
+            else:
+                if reader.peek():
+                    raise reader.error('extra data after the bookmark tree')
+                return
+    finally:
+        reader.close()
+
+
+def _parse_dict(reader, stack):
+    """
+    Parse the dict at pos key by key. When "children" follows a "title", yield the
+    folder event and return None with the folder pushed onto stack and pos at its
+    children. Otherwise parse the whole dict, yield its events and return it.
+    """
+    reader.pos += 1
+    node = {}
+    if reader.peek() == '}':
+        reader.pos += 1
+        yield 'bookmark', node
+        return node
+    while True:
+        if reader.peek() != '"':
+            raise reader.error('expected a key')
+        key = reader.value()
+        reader.expect(':')
+        if key == 'children' and 'title' in node:
+            yield 'folder', node
+            stack.append('folder')
+            if reader.peek() == '[':
+                reader.pos += 1
+                if reader.peek() == ']':
+                    reader.pos += 1
+                    stack.pop()
+                    yield 'end', None
+                    _skip_dict_rest(reader)
+                    return {}
+                stack.append('list')
+            return None
+        node[key] = reader.value()
+        char = reader.peek()
+        reader.pos += 1
+        if char == '}':
+            break
+        if char != ',':
+            raise reader.error("expected ',' or '}'")
+    yield from iter_node_events(node)
+    return node
+
+
+def _skip_dict_rest(reader):
+    """
+    Skip the keys of a folder that follow its children, up to and including its }.
+    """
+    while True:
+        char = reader.peek()
+        reader.pos += 1
+        if char == '}':
+            return
+        if char != ',':
+            raise reader.error("expected ',' or '}'")
+        reader.value()
+        reader.expect(':')
+        reader.value()
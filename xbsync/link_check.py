@@ -0,0 +1,307 @@
+"""
+Check urls for dead links before they are handed to ArchiveBox.
+
+Urls are checked concurrently on an asyncio event loop with a small HTTP/1.1 client:
+a HEAD request first, and a GET if the server refuses HEAD or answers it with an
+error, following redirects. Host names are resolved once per run, and keep-alive
+connections are reused for later urls of the same host. A url is only dead if its host
+does not exist (NXDOMAIN) or the page is gone (404 or 410). Timeouts, refused
+connections and other failures may go away again, so those urls are kept and checked
+again on the next run. Answers are kept in a cache file for a while, so known dead and
+known live urls are not checked again on every run.
+"""
+import asyncio
+import json
+import socket
+import ssl
+import time
+import urllib.parse
+
+#Statuses that mean the page is gone rather than temporarily unavailable
+DEAD_STATUSES = (404, 410)
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+#Reasons of failed checks, which say nothing lasting about a url and are not cached
+UNCACHED_REASONS = ('timeout', 'connect', 'dns', 'error', 'unchecked')
+#Urls checked per run of the event loop, so that results come out while checking
+BATCH_SIZE = 1000
+USER_AGENT = 'Mozilla/5.0 (compatible; xbs-link-check)'
+
+
+class LinkCache:
+    """
+    Results of earlier checks, {url: [dead, reason, time checked]}, that expire after ttl
+    seconds.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        if path:
+            try:
+                with open(path, "r") as cacheFile:
+                    self.entries = json.load(cacheFile)
+            except FileNotFoundError:
+                pass
+            except ValueError:
+                print("WARNING: ignoring unreadable link cache " + path)
+
+    def get(self, url, now):
+        entry = self.entries.get(url)
+        if entry is not None and entry[2] + self.ttl > now and entry[1] not in UNCACHED_REASONS:
+            return entry
+        return None
+
+    def set(self, url, dead, reason, now):
+        if reason not in UNCACHED_REASONS:
+            self.entries[url] = [dead, reason, now]
+
+    def save(self):
+        if self.path:
+            from .sync import write_json_atomically
+            now = time.time()
+            write_json_atomically(self.path, {url: entry for url, entry in self.entries.items()
+                                              if entry[2] + self.ttl > now})
+
+
+class LinkChecker:
+    """
+    Filters urls down to the live ones, adding the dead ones to the file at dead_path if
+    given. Call close() when done to save the cache and close the connections.
+    """
+
+    def __init__(self, concurrency=32, per_host=2, timeout=5.0, cache=None, dead_path=None):
+        self.timeout = timeout
+        self.cache = cache if cache is not None else LinkCache(None, 0)
+        #Urls already in the dead links file from earlier runs are not written again
+        self.known_dead = set()
+        self.deadFile = None
+        if dead_path:
+            try:
+                with open(dead_path, "r") as deadFile:
+                    self.known_dead.update(line.rstrip("\n") for line in deadFile)
+            except FileNotFoundError:
+                pass
+            self.deadFile = open(dead_path, "a")
+        self.loop = asyncio.new_event_loop()
+        #Semaphores are made once the loop runs, before Python 3.10 they bind to the current loop
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.per_host = per_host
+        self.host_semaphores = {}
+        #Resolved addresses, or the exception resolving failed with, per (host, port)
+        self.addresses = {}
+        #Idle keep-alive connections per (scheme, host, port)
+        self.idle = {}
+        #The certificate of a host does not matter for whether it is up
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.checked = 0
+        self.cached = 0
+        self.dead = {}
+        #Urls kept because they could not be checked, per reason
+        self.failed = {}
+
+    def filter_alive(self, urls, on_dead=None):
+        """
+        Yield the urls that are not dead, in order, and call on_dead with each dead one if
+        given. Urls are checked a batch at a time.
+        """
+        batch = []
+        for url in urls:
+            batch.append(url)
+            if len(batch) >= BATCH_SIZE:
+                yield from self._filter_batch(batch, on_dead)
+                batch = []
+        if batch:
+            yield from self._filter_batch(batch, on_dead)
+
+    def _filter_batch(self, urls, on_dead):
+        now = time.time()
+        results = {}
+        unknown = []
+        for url in urls:
+            entry = self.cache.get(url, now)
+            if entry is None:
+                unknown.append(url)
+            else:
+                self.cached += 1
+                results[url] = entry
+        if unknown:
+            checked = self.loop.run_until_complete(self._check_all(unknown))
+            for url, (dead, reason) in zip(unknown, checked):
+                self.checked += 1
+                self.cache.set(url, dead, reason, now)
+                results[url] = (dead, reason)
+        for url in urls:
+            dead, reason = results[url][:2]
+            if dead:
+                self.dead[reason] = self.dead.get(reason, 0) + 1
+                if self.deadFile is not None and url not in self.known_dead:
+                    self.known_dead.add(url)
+                    self.deadFile.write(url + "\n")
+                if on_dead is not None:
+                    on_dead(url)
+            else:
+                if reason in UNCACHED_REASONS and reason != 'unchecked':
+                    self.failed[reason] = self.failed.get(reason, 0) + 1
+                yield url
+
+    async def _check_all(self, urls):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._check(url) for url in urls))
+
+    async def _check(self, url):
+        """
+        Return (dead, reason) for url. Failures that may be temporary keep the url.
+        """
+        try:
+            return await self._follow(url)
+        except asyncio.TimeoutError:
+            return False, 'timeout'
+        except OSError as e:
+            if isinstance(e, (ssl.SSLError, ConnectionResetError)):
+                #Something answered, ArchiveBox may do better than this client
+                return False, 'error'
+            return False, 'connect'
+        except (ValueError, asyncio.IncompleteReadError):
+            return False, 'error'
+
+    async def _follow(self, url):
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            try:
+                if parts.scheme not in ('http', 'https') or not parts.hostname:
+                    return False, 'unchecked'
+                await asyncio.wait_for(self._resolve(parts), self.timeout)
+            except asyncio.TimeoutError:
+                raise
+            except socket.gaierror as e:
+                #Only a name that does not exist is final, a failing resolver is not
+                if e.errno == socket.EAI_NONAME:
+                    return True, 'nxdomain'
+                return False, 'dns'
+            except (OSError, ValueError):
+                return False, 'dns'
+            status, headers = await self._request('HEAD', parts)
+            if status >= 400:
+                #Plenty of servers get HEAD wrong, ask again the way a browser would
+                status, headers = await self._request('GET', parts)
+            if status in REDIRECT_STATUSES and 'location' in headers:
+                url = urllib.parse.urljoin(url, headers['location'])
+                continue
+            if status in DEAD_STATUSES:
+                return True, 'status %d' % status
+            return False, 'status %d' % status
+        return False, 'redirects'
+
+    async def _resolve(self, parts):
+        """
+        Return the addresses to connect to for parts and the port, resolving each host
+        only once.
+        """
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.hostname, port)
+        if key not in self.addresses:
+            self.addresses[key] = asyncio.ensure_future(
+                self.loop.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM))
+        addresses = await asyncio.shield(self.addresses[key])
+        return list(dict.fromkeys(address[4][0] for address in addresses)), port
+
+    async def _connect(self, parts):
+        """
+        Open a connection to the first address of the host that accepts one. Each address
+        gets its share of the timeout, so that one that does not answer leaves time for
+        the others.
+        """
+        addresses, port = await self._resolve(parts)
+        https = parts.scheme == 'https'
+        error = None
+        for address in addresses:
+            try:
+                return await asyncio.wait_for(asyncio.open_connection(
+                    address, port, ssl=self.ssl_context if https else None,
+                    server_hostname=parts.hostname if https else None), self.timeout / len(addresses))
+            except (OSError, asyncio.TimeoutError) as e:
+                error = e
+        raise error
+
+    async def _request(self, method, parts):
+        """
+        Send one request and return its status and lowercased headers, waiting at most
+        timeout seconds once a connection to the host may be used.
+        """
+        key = (parts.scheme, parts.hostname, parts.port)
+        if key not in self.host_semaphores:
+            self.host_semaphores[key] = asyncio.Semaphore(self.per_host)
+        async with self.host_semaphores[key], self.semaphore:
+            return await asyncio.wait_for(self._send(method, parts, key), self.timeout)
+
+    async def _send(self, method, parts, key):
+        """
+        Send one request on an idle connection to the host, or a new one. Connections are
+        kept for reuse after a HEAD, a GET's body is never read so its connection is closed.
+        """
+        idle = self.idle.setdefault(key, [])
+        while True:
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
+            else:
+                reader, writer = await self._connect(parts)
+            try:
+                status, headers = await self._exchange(method, parts, reader, writer)
+                break
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                writer.close()
+                if not reused:
+                    raise
+                #An idle connection the server has closed, try again on a new one
+            except BaseException:
+                writer.close()
+                raise
+        if method == 'HEAD' and headers.get('connection', '').lower() != 'close':
+            idle.append((reader, writer))
+        else:
+            writer.close()
+        return status, headers
+
+    async def _exchange(self, method, parts, reader, writer):
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        host = parts.hostname if ':' not in parts.hostname else '[%s]' % parts.hostname
+        if parts.port:
+            host += ':%d' % parts.port
+        writer.write(('%s %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nAccept: */*\r\n\r\n' % (
+            method, path, host, USER_AGENT)).encode('latin-1', 'replace'))
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed before the response')
+        fields = status_line.split(None, 2)
+        if len(fields) < 2 or not fields[0].startswith(b'HTTP/') or not fields[1].isdigit():
+            raise ValueError('not an HTTP response: %r' % status_line[:80])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if fields[0] == b'HTTP/1.0' and headers.get('connection', '').lower() != 'keep-alive':
+            headers['connection'] = 'close'
+        return int(fields[1]), headers
+
+    def close(self):
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self.idle.clear()
+        #Let the closed transports finish before the loop goes away
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        if self.deadFile is not None:
+            self.deadFile.close()
+        self.cache.save()
@@ -0,0 +1,168 @@
+"""
+Snapshot of the urls written by the previous run, to only output the ones added since.
+
+A snapshot file holds a header, a table of the 64 bit digests of its urls sorted and
+paired with the offset of each url in the text that follows, one url per line, all
+integers in native byte order:
+
+    magic (8 bytes) | count (8 bytes) | count * (digest, offset) | urls
+
+The previous snapshot is memory-mapped rather than read, and the new urls are compared
+with it in bulk: their digests are sorted and merged with its table in a single pass.
+"""
+import array
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+from .url_dedup import url_digest
+
+MAGIC = b'XBSSNAP1'
+HEADER = struct.Struct('=8sQ')
+
+
+class UrlSnapshot:
+    """
+    Compares urls with the snapshot at path, see diff(), and replaces it with the new
+    urls on commit(). Until then the snapshot file is left untouched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.records = memoryview(array.array('Q'))
+        self.strings_start = 0
+        self.new_strings = None
+        self.new_records = None
+        self.removed_offsets = array.array('Q')
+        self.added = 0
+        self.unchanged = 0
+        #Digests of urls to leave out of the new snapshot, see exclude()
+        self.excluded = set()
+        self._open()
+
+    def _open(self):
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        try:
+            size = os.fstat(self.file.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError('file too short')
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count = HEADER.unpack_from(self.map)
+            self.strings_start = HEADER.size + count * 16
+            if magic != MAGIC or self.strings_start > size:
+                raise ValueError('not a snapshot file')
+            self.records = memoryview(self.map)[HEADER.size:self.strings_start].cast('Q')
+        except (OSError, ValueError):
+            print("WARNING: ignoring unreadable snapshot: " + self.path)
+            self.close()
+
+    def diff(self, urls):
+        """
+        Consume urls and yield, in their original order, the ones that are not in the
+        snapshot. Nothing is yielded before all urls have been read. Repeated urls are
+        only yielded once.
+        """
+        digests = array.array('Q')
+        offsets = array.array('Q')
+        self.new_strings = tempfile.TemporaryFile()
+        position = 0
+        for url in urls:
+            line = url.encode('utf-8') + b'\n'
+            self.new_strings.write(line)
+            digests.append(url_digest(url))
+            offsets.append(position)
+            position += len(line)
+
+        #Merge the sorted new digests with the sorted snapshot table
+        old = self.records
+        old_length = len(old)
+        added = bytearray(len(digests))
+        self.new_records = array.array('Q')
+        self.removed_offsets = array.array('Q')
+        j = 0
+        previous = None
+        for i in sorted(range(len(digests)), key=digests.__getitem__):
+            digest = digests[i]
+            if digest == previous:
+                continue
+            previous = digest
+            self.new_records.append(digest)
+            self.new_records.append(offsets[i])
+            while j < old_length and old[j] < digest:
+                self.removed_offsets.append(old[j + 1])
+                j += 2
+            if j < old_length and old[j] == digest:
+                j += 2
+                self.unchanged += 1
+            else:
+                added[i] = 1
+                self.added += 1
+        while j < old_length:
+            self.removed_offsets.append(old[j + 1])
+            j += 2
+        del digests, offsets
+
+        self.new_strings.seek(0)
+        for index, line in enumerate(self.new_strings):
+            if added[index]:
+                yield line[:-1].decode('utf-8')
+
+    def removed_urls(self):
+        """
+        Yield the urls of the snapshot that were missing from the urls given to diff().
+        """
+        for offset in self.removed_offsets:
+            start = self.strings_start + offset
+            yield self.map[start:self.map.find(b'\n', start)].decode('utf-8')
+
+    def exclude(self, url):
+        """
+        Leave url out of the snapshot written by commit(), so that the next run sees it as
+        added again.
+        """
+        self.excluded.add(url_digest(url))
+
+    def commit(self):
+        """
+        Atomically replace the snapshot file with the urls given to diff(), other than the
+        excluded ones.
+        """
+        records = self.new_records
+        if self.excluded:
+            records = array.array('Q')
+            for i in range(0, len(self.new_records), 2):
+                if self.new_records[i] not in self.excluded:
+                    records.append(self.new_records[i])
+                    records.append(self.new_records[i + 1])
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as snapshotFile:
+                snapshotFile.write(HEADER.pack(MAGIC, len(records) // 2))
+                records.tofile(snapshotFile)
+                self.new_strings.seek(0)
+                shutil.copyfileobj(self.new_strings, snapshotFile)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def close(self):
+        self.records.release()
+        self.records = memoryview(array.array('Q'))
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.new_strings is not None:
+            self.new_strings.close()
+            self.new_strings = None
@@ -0,0 +1,226 @@
+"""
+Per-stage wall time, CPU time, bytes and peak traced memory for the sync and filter
+pipelines, written as a json document or a Prometheus textfile.
+
+Stages nest: a generator stage pulls from the stage before it, so the time a stage
+spends waiting on a nested stage is subtracted from its own. Peak memory is the highest
+memory traced by tracemalloc while the stage, or a stage nested in it, was running.
+tracemalloc and cProfile are only imported once statistics are collected.
+"""
+import contextlib
+import json
+import os
+import time
+
+STATS_FORMATS = ('json', 'prometheus')
+
+METRICS = (
+    ('calls', 'Number of times the stage was entered'),
+    ('wall_seconds', 'Wall time spent in the stage, excluding nested stages'),
+    ('cpu_seconds', 'CPU time spent in the stage, excluding nested stages'),
+    ('items_out', 'Number of items produced by the stage'),
+    ('bytes_in', 'Bytes consumed by the stage'),
+    ('bytes_out', 'Bytes produced by the stage'),
+    ('peak_traced_bytes', 'Peak memory traced while the stage was running'),
+)
+
+
+def add_stats_arguments(parser, profile=False):
+    parser.add_argument('--stats',
+                        help='file to write per-stage timing and memory statistics to',
+                        )
+    parser.add_argument('--stats-format',
+                        choices=STATS_FORMATS,
+                        default='json',
+                        help='format of the --stats file, json or a Prometheus textfile, defaults to json',
+                        )
+    if profile:
+        parser.add_argument('--profile',
+                            help='file to write a cProfile dump of the lzutf8 decompression to, for use with pstats, not used with --manifest',
+                            )
+
+
+def _size(item):
+    if isinstance(item, (bytes, bytearray)):
+        return len(item)
+    if isinstance(item, str):
+        return len(item.encode('utf-8'))
+    return 0
+
+
+class Stats:
+    """
+    Collects statistics per stage name. Use stage() for a block of code and iterate()
+    for a generator stage. With profile_stages, a cProfile profiler runs while those
+    stages run, but not while the stages nested in them do.
+    """
+
+    def __init__(self, trace_memory=True, profile_stages=()):
+        self.stages = {}
+        self.sources = {}
+        self.trace_memory = trace_memory
+        self.profile_stages = set(profile_stages)
+        self.profiler = None
+        if profile_stages:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self._frames = []
+        self._started = time.perf_counter()
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def _record(self, name):
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = dict.fromkeys((metric for metric, _ in METRICS), 0)
+        return record
+
+    def _enter(self, name):
+        import tracemalloc
+        parent = self._frames[-1] if self._frames else None
+        if parent is not None:
+            if parent['profiled']:
+                self.profiler.disable()
+            if self.trace_memory:
+                parent['peak'] = max(parent['peak'], tracemalloc.get_traced_memory()[1])
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        frame = {'name': name, 'wall': time.perf_counter(), 'cpu': time.process_time(),
+                 'child_wall': 0.0, 'child_cpu': 0.0, 'peak': 0,
+                 'profiled': name in self.profile_stages}
+        self._frames.append(frame)
+        if frame['profiled']:
+            self.profiler.enable()
+        return frame
+
+    def _exit(self, frame):
+        import tracemalloc
+        if frame['profiled']:
+            self.profiler.disable()
+        wall = time.perf_counter() - frame['wall']
+        cpu = time.process_time() - frame['cpu']
+        peak = frame['peak']
+        if self.trace_memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        self._frames.pop()
+
+        record = self._record(frame['name'])
+        record['wall_seconds'] += wall - frame['child_wall']
+        record['cpu_seconds'] += cpu - frame['child_cpu']
+        record['peak_traced_bytes'] = max(record['peak_traced_bytes'], peak)
+
+        parent = self._frames[-1] if self._frames else None
+        if parent is not None:
+            parent['child_wall'] += wall
+            parent['child_cpu'] += cpu
+            parent['peak'] = max(parent['peak'], peak)
+            if parent['profiled']:
+                self.profiler.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name, bytes_in=0, bytes_out=0):
+        frame = self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit(frame)
+            record = self.stages[name]
+            record['calls'] += 1
+            record['bytes_in'] += bytes_in
+            record['bytes_out'] += bytes_out
+
+    def iterate(self, name, iterable, source=None):
+        """
+        Yield the items of iterable, counting the time spent producing each of them
+        against the stage name, as well as their number and size. If source is given,
+        the bytes produced by that stage are reported as this stage's input.
+        """
+        record = self._record(name)
+        record['calls'] += 1
+        if source:
+            self.sources[name] = source
+        iterator = iter(iterable)
+        while True:
+            frame = self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(frame)
+            record['items_out'] += 1
+            record['bytes_out'] += _size(item)
+            yield item
+
+    def report(self):
+        """
+        Return the statistics as a json serializable dict.
+        """
+        stages = {}
+        for name, record in self.stages.items():
+            record = dict(record)
+            if name in self.sources and self.sources[name] in self.stages:
+                record['bytes_in'] = self.stages[self.sources[name]]['bytes_out']
+            stages[name] = record
+        return {'wall_seconds': time.perf_counter() - self._started, 'stages': stages}
+
+    def dump_profile(self, path):
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+
+
+class NoStats:
+    """
+    Stand-in for Stats that records nothing, so callers do not need to check for it.
+    """
+
+    def stage(self, name, bytes_in=0, bytes_out=0):
+        return contextlib.nullcontext()
+
+    def iterate(self, name, iterable, source=None):
+        return iterable
+
+
+NO_STATS = NoStats()
+
+
+def _prometheus_labels(labels):
+    return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for key, value in labels.items())
+
+
+def format_prometheus(reports, prefix='xbs'):
+    """
+    Format reports, a list of (labels, report) pairs, as a Prometheus textfile.
+    """
+    lines = []
+    for metric, description in METRICS:
+        name = '%s_stage_%s' % (prefix, metric)
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s gauge' % name)
+        for labels, report in reports:
+            for stage, record in report['stages'].items():
+                stage_labels = dict(labels, stage=stage)
+                lines.append('%s{%s} %s' % (name, _prometheus_labels(stage_labels), repr(record[metric])))
+    name = '%s_run_wall_seconds' % prefix
+    lines.append('# HELP %s Wall time of the whole run' % name)
+    lines.append('# TYPE %s gauge' % name)
+    for labels, report in reports:
+        lines.append('%s{%s} %r' % (name, _prometheus_labels(labels), report['wall_seconds']))
+    return '\n'.join(lines) + '\n'
+
+
+def write_stats(path, stats_format, reports):
+    """
+    Atomically write reports, a list of (labels, report) pairs, to path in stats_format.
+    """
+    if stats_format == 'prometheus':
+        text = format_prometheus(reports)
+    else:
+        text = json.dumps([dict(report, labels=labels) for labels, report in reports], indent=4) + '\n'
+    temp_path = path + '.tmp'
+    with open(temp_path, "w") as statsFile:
+        statsFile.write(text)
+    os.replace(temp_path, path)
@@ -0,0 +1,258 @@
+"""
+Submit urls to ArchiveBox in batches, over several concurrent `archivebox add` workers.
+
+Urls are queued per domain. Batches are filled from all the domains that are ready, best
+priority first, and a domain only goes into another batch once the last batch with its
+urls has finished and its interval has passed, so a site with thousands of bookmarks
+does not hold up the others or get hammered.
+Every finished batch is appended to a journal, which a restarted run reads to skip the
+urls that were already submitted.
+"""
+import concurrent.futures
+import heapq
+import json
+import os
+import subprocess
+import time
+import urllib.parse
+
+from .bookmark_rules import FolderTrie
+from .bookmarks import iter_bookmarks
+from .url_dedup import canonicalize_url
+
+
+def domain_of(url):
+    try:
+        return (urllib.parse.urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return ''
+
+
+class SubmissionJournal:
+    """
+    Append-only log of submitted batches, one "<status>\\t<url>" line per url. Each batch
+    is written and synced in one go, a torn last line from a crash is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.failed = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding='utf-8') as journalFile:
+                for line in journalFile:
+                    if not line.endswith("\n"):
+                        break
+                    status, _, url = line.rstrip("\n").partition("\t")
+                    if status == 'done':
+                        self.done.add(url)
+                        self.failed.discard(url)
+                    elif status == 'failed':
+                        self.failed.add(url)
+        self.journalFile = open(path, "a", encoding='utf-8')
+
+    def record(self, status, urls):
+        self.journalFile.write(''.join('%s\t%s\n' % (status, url) for url in urls))
+        self.journalFile.flush()
+        os.fsync(self.journalFile.fileno())
+        if status == 'done':
+            self.done.update(urls)
+            self.failed.difference_update(urls)
+        else:
+            self.failed.update(urls)
+
+    def close(self):
+        self.journalFile.close()
+
+
+def bookmark_priorities(bookmarks, first_folders=(), newest_first=False):
+    """
+    Return a function giving the priority of a url from the bookmarks it came from, lower
+    is submitted first. Urls in the first of first_folders come first, then those in the
+    second and so on. With newest_first, newer bookmarks come first within that, going by
+    their ids, which xBrowserSync hands out in increasing order.
+    """
+    folders = []
+    for pattern in first_folders:
+        trie = FolderTrie()
+        trie.add(pattern)
+        folders.append(trie)
+
+    def folder_rank(path):
+        for rank, trie in enumerate(folders):
+            state = trie.initial()
+            for title in path:
+                state = trie.step(state, title)
+            if state[1]:
+                return rank
+        return len(folders)
+
+    priorities = {}
+    for bookmark, path in bookmarks:
+        bookmark_id = bookmark.get('id')
+        newest = -bookmark_id if newest_first and isinstance(bookmark_id, int) else 0
+        priority = (folder_rank(path), newest)
+        for url in (bookmark['url'], canonicalize_url(bookmark['url'])):
+            if url not in priorities or priority < priorities[url]:
+                priorities[url] = priority
+    unknown = (len(folders), 0)
+
+    def priority(url):
+        return priorities.get(url) or priorities.get(canonicalize_url(url), unknown)
+    return priority
+
+
+def load_bookmarks_file(path):
+    """
+    Yield (bookmark, folder path) from a json tree or ndjson file of get_xbs_bookmarks.py.
+    """
+    with open(path, "r") as bookmarksFile:
+        char = bookmarksFile.read(1)
+        while char.isspace():
+            char = bookmarksFile.read(1)
+        bookmarksFile.seek(0)
+        if char == '{':
+            for line in bookmarksFile:
+                if line.strip():
+                    bookmark = json.loads(line)
+                    yield bookmark, tuple(bookmark.get('path', ()))
+        else:
+            yield from iter_bookmarks(json.load(bookmarksFile))
+
+
+class SubmissionQueue:
+    """
+    Urls waiting to be submitted, kept in one priority heap per domain. Domains that may
+    be submitted to are in the ready heap, ordered by their best url, the others wait in
+    the timer heap until their interval has passed.
+
+    With a domain_interval, a batch takes urls from every ready domain in turn, and the
+    domains in it are held back until finished() is called for the batch and then for
+    domain_interval seconds more, so that no two workers visit a site at once. Without
+    one, batches simply take the best urls.
+    """
+
+    def __init__(self, urls, priority=None, domain_interval=0.0):
+        self.domain_interval = domain_interval
+        self.domains = {}
+        self.ready = []
+        self.waiting = []
+        #Domains in batches that have not finished yet
+        self.busy = set()
+        for position, url in enumerate(urls):
+            key = (priority(url) if priority else (), position)
+            self.domains.setdefault(domain_of(url), []).append((key, url))
+        for domain, urls in self.domains.items():
+            heapq.heapify(urls)
+            self.ready.append((urls[0][0], domain))
+        heapq.heapify(self.ready)
+
+    def __len__(self):
+        return sum(len(urls) for urls in self.domains.values())
+
+    def _take(self, domain, batch):
+        urls = self.domains[domain]
+        batch.append(heapq.heappop(urls)[1])
+        if not urls:
+            del self.domains[domain]
+            return False
+        return True
+
+    def next_batch(self, size, now):
+        """
+        Return (batch, wait): up to size urls that may be submitted now, and if there are
+        none, the seconds until a waiting domain is ready, or None if nothing is waiting.
+        """
+        while self.waiting and self.waiting[0][0] <= now:
+            _, domain = heapq.heappop(self.waiting)
+            heapq.heappush(self.ready, (self.domains[domain][0][0], domain))
+
+        batch = []
+        if self.domain_interval > 0:
+            #Take one url of each ready domain per round, best domains first
+            turn = self.ready
+            self.ready = []
+            while turn and len(batch) < size:
+                next_turn = []
+                while turn and len(batch) < size:
+                    _, domain = heapq.heappop(turn)
+                    self.busy.add(domain)
+                    if self._take(domain, batch):
+                        heapq.heappush(next_turn, (self.domains[domain][0][0], domain))
+                #Domains the batch did not get to stay ready
+                for entry in turn:
+                    heapq.heappush(next_turn if entry[1] in self.busy else self.ready, entry)
+                turn = next_turn
+        else:
+            while self.ready and len(batch) < size:
+                _, domain = heapq.heappop(self.ready)
+                if self._take(domain, batch):
+                    heapq.heappush(self.ready, (self.domains[domain][0][0], domain))
+
+        wait = None
+        if not batch and self.waiting:
+            wait = max(self.waiting[0][0] - now, 0)
+        return batch, wait
+
+    def finished(self, batch, now):
+        """
+        Let the domains of a batch from next_batch() be handed out again once the
+        interval has passed.
+        """
+        for domain in set(map(domain_of, batch)):
+            if domain not in self.busy:
+                continue
+            self.busy.discard(domain)
+            if domain in self.domains:
+                heapq.heappush(self.waiting, (now + self.domain_interval, domain))
+
+
+def run_batch(command, urls, cwd=None):
+    """
+    Pipe urls into command and return its exit status.
+    """
+    completed = subprocess.run(command, input=''.join(url + "\n" for url in urls), cwd=cwd,
+                               universal_newlines=True)
+    return completed.returncode
+
+
+def submit(queue, journal, command, batch_size=100, workers=1, cwd=None, log=print):
+    """
+    Submit every url in queue in batches over up to workers concurrent commands, recording
+    each batch in journal as soon as it finishes. Returns the number of failed batches.
+    """
+    failures = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while True:
+            wait = None
+            while len(running) < workers:
+                batch, wait = queue.next_batch(batch_size, time.monotonic())
+                if not batch:
+                    break
+                running[executor.submit(run_batch, command, batch, cwd)] = batch
+            if not running:
+                if wait is None:
+                    break
+                time.sleep(wait)
+                continue
+
+            done, _ = concurrent.futures.wait(running, timeout=wait,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                batch = running.pop(future)
+                queue.finished(batch, time.monotonic())
+                try:
+                    status = future.result()
+                except OSError as e:
+                    log("ERROR: cannot run %s: %s" % (' '.join(command), e))
+                    status = None
+                if status == 0:
+                    journal.record('done', batch)
+                    log("submitted %d urls, %d left" % (len(batch), len(queue) + sum(map(len, running.values()))))
+                else:
+                    journal.record('failed', batch)
+                    failures += 1
+                    log("ERROR: batch of %d urls failed with status %s, starting with %s" % (len(batch), status,
+                                                                                            batch[0]))
+    return failures
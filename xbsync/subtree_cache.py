@@ -0,0 +1,214 @@
+"""
+Cache of filter results per folder, so that unchanged folders are not filtered again.
+
+Every folder gets a Merkle hash of its title, the urls of its bookmarks and the hashes
+of its subfolders. The cache maps the hash of a folder at a given path to the positions
+of the children the rules kept: bookmarks that are written and subfolders that are
+entered. When a folder's hash is found on a later run, its kept bookmarks are yielded
+straight from those positions, without evaluating any rule in it or below it.
+
+Hashing only looks at each url once, so a run over a mostly unchanged tree costs one
+cheap pass plus the rule checks of the folders that changed. The cache is only valid
+for the rules it was built with and starts over when their fingerprint changes.
+"""
+import hashlib
+import json
+
+from .bookmarks import malformed_node, rejected_bookmark
+
+#Bump when the meaning of cache entries changes
+CACHE_VERSION = 1
+
+
+def subtree_hashes(bookmarks):
+    """
+    Return a dict from the id() of every folder dict in the tree to the digest of its
+    subtree, or None for folders that cannot be cached because they, or a folder below
+    them, hold something other than a list of dicts.
+    """
+    digests = {}
+    #Frames of [folder or None for plain lists, child iterator, parts to hash or None]
+    stack = [[None, iter([bookmarks]), None]]
+    while stack:
+        frame = stack[-1]
+        for node in frame[1]:
+            break
+        else:
+            stack.pop()
+            folder, _, parts = frame
+            if folder is not None:
+                digest = None
+                if parts is not None:
+                    text = '\0'.join(parts).encode('utf-8', 'surrogatepass')
+                    digest = hashlib.blake2b(text, digest_size=16).hexdigest()
+                digests[id(folder)] = digest
+                parent = stack[-1]
+                if parent[2] is not None:
+                    if digest is None:
+                        parent[2] = None
+                    else:
+                        parent[2].append('F' + digest)
+            continue
+
+        if isinstance(node, dict) and "children" in node:
+            if isinstance(node['children'], list):
+                stack.append([node, iter(node['children']), [str(node.get('title', ''))]])
+            else:
+                digests[id(node)] = None
+                frame[2] = None
+        elif isinstance(node, list):
+            frame[2] = None
+            stack.append([None, iter(node), None])
+        elif frame[2] is not None:
+            if isinstance(node, dict) and "url" in node:
+                frame[2].append('U' + str(node['url']))
+            elif isinstance(node, dict):
+                frame[2].append('M')
+            else:
+                frame[2] = None
+    return digests
+
+
+class SubtreeCache:
+    """
+    Folder filter results of the previous run, loaded from path if given. Use filter() in
+    place of xbsync.bookmarks.filter_bookmarks, then save() once the results were used.
+    Only the folders seen by the last filter() are kept.
+    """
+
+    def __init__(self, rules, path=None):
+        self.rules = rules
+        self.path = path
+        self.fingerprint = rules.fingerprint()
+        self.entries = {}
+        self.reused = 0
+        self.filtered = 0
+        if path:
+            try:
+                with open(path, "r") as cacheFile:
+                    data = json.load(cacheFile)
+            except FileNotFoundError:
+                data = {}
+            except ValueError:
+                print("WARNING: ignoring unreadable filter cache " + path)
+                data = {}
+            if data.get('version') == CACHE_VERSION and data.get('rules') == self.fingerprint:
+                self.entries = data['folders']
+
+    def _key(self, path, title, digest):
+        if digest is None:
+            return None
+        location = json.dumps(path + [title], ensure_ascii=False) + digest
+        return hashlib.blake2b(location.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+    def filter(self, bookmarks, on_malformed='warn'):
+        """
+        Yield (bookmark, folder path) for the bookmarks the rules keep, like filter_bookmarks.
+        Messages about skipped folders and urls are only printed for folders that changed.
+        """
+        self.reused = 0
+        self.filtered = 0
+        digests = subtree_hashes(bookmarks)
+        entries = {}
+        yield from self._walk([bookmarks], [], self.rules.root_state(), digests, entries, on_malformed)
+        self.entries = entries
+
+    def _walk(self, nodes, path, state, digests, entries, on_malformed):
+        """
+        Filter nodes, the contents of the folder at path with rule state, recording the
+        kept positions of every cacheable folder below it in entries.
+        """
+        rules = self.rules
+        path = list(path)
+        states = [state]
+        #Frames of (enumerated children, (key, kept positions) for folders or None for lists)
+        stack = [(enumerate(nodes), None)]
+        while stack:
+            children, folder = stack[-1]
+            for index, node in children:
+                break
+            else:
+                stack.pop()
+                if folder is not None:
+                    path.pop()
+                    states.pop()
+                    key, kept = folder
+                    if key is not None:
+                        entries[key] = kept
+                continue
+
+            kept = folder[1] if folder is not None else None
+            if isinstance(node, dict):
+                if "children" in node:
+                    if "url" in node:
+                        malformed_node('found url in children dict: ' + str(node['url']), on_malformed)
+                    title = node.get('title', '')
+                    key = self._key(path, title, digests.get(id(node)))
+                    if key is not None and key in self.entries:
+                        if kept is not None:
+                            kept.append(index)
+                        yield from self._replay(node, path + [title], key, digests, entries, on_malformed)
+                        continue
+                    state = rules.enter_folder(states[-1], title)
+                    if state is None:
+                        print('skipping folder ' + title)
+                        continue
+                    if kept is not None:
+                        kept.append(index)
+                    self.filtered += 1
+                    path.append(title)
+                    states.append(state)
+                    folder_children = node['children']
+                    if not isinstance(folder_children, list):
+                        folder_children = [folder_children]
+                    stack.append((enumerate(folder_children), (key, [])))
+                elif "url" in node:
+                    reason = rules.check_bookmark(node['url'], states[-1])
+                    if reason is None:
+                        if kept is not None:
+                            kept.append(index)
+                        yield node, tuple(path)
+                    else:
+                        rejected_bookmark(node['url'], reason)
+                else:
+                    malformed_node('did not find children or url in dict', on_malformed)
+            elif isinstance(node, list):
+                stack.append((enumerate(node), None))
+            else:
+                malformed_node('unexpected node of type ' + type(node).__name__, on_malformed)
+
+    def _replay(self, folder, path, key, digests, entries, on_malformed):
+        """
+        Yield the kept bookmarks of an unchanged folder from its cache entry, and those of
+        its unchanged subfolders in turn. A subfolder missing from the cache is filtered.
+        """
+        self.reused += 1
+        entries[key] = self.entries[key]
+        stack = [(folder['children'], iter(self.entries[key]), path)]
+        while stack:
+            children, positions, path = stack[-1]
+            for index in positions:
+                break
+            else:
+                stack.pop()
+                continue
+            node = children[index]
+            if "children" not in node:
+                yield node, tuple(path)
+                continue
+            title = node.get('title', '')
+            key = self._key(path, title, digests.get(id(node)))
+            if key in self.entries:
+                self.reused += 1
+                entries[key] = self.entries[key]
+                stack.append((node['children'], iter(self.entries[key]), path + [title]))
+            else:
+                state = self.rules.state_for_path(path)
+                if state is not None:
+                    yield from self._walk([node], path, state, digests, entries, on_malformed)
+
+    def save(self):
+        if self.path:
+            from .sync import write_json_atomically
+            write_json_atomically(self.path, {'version': CACHE_VERSION, 'rules': self.fingerprint,
+                                              'folders': self.entries})
@@ -0,0 +1,401 @@
+"""
+Download, decrypt and decompress the bookmarks of an xBrowserSync sync.
+
+Cryptodome and the lzutf8 codec are only imported once they are needed, so that
+importing this module, for example to filter bookmarks, stays cheap.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import stat
+import time
+
+from .bookmarks import iter_bookmarks
+from .http_transport import NotModified, open_url
+from .stage_stats import NO_STATS, Stats
+
+#Exit status used when --state is given and the bookmarks have not changed
+EXIT_UNCHANGED = 3
+
+#Size of the chunks read from the api and passed along the download pipeline
+CHUNK_SIZE = 65536
+
+#Derived key cache, keyed by sync ID. Entries hold a fingerprint of the key, and a check
+#of the password keyed with the derived key, so that a different password given on a
+#later run is noticed without deriving the key again. A key that no longer decrypts the
+#bookmarks, after a password change elsewhere, is derived again
+def key_fingerprint(sync_id, key):
+    return hmac.new(key, sync_id.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def password_check(key, password):
+    return hmac.new(key, b'password\0' + password.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def load_key_cache(path):
+    try:
+        if os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            print("WARNING: ignoring key cache readable by other users: " + path)
+            return {}
+        with open(path, "r") as cacheFile:
+            return json.load(cacheFile)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        print("WARNING: ignoring unreadable key cache: " + path)
+        return {}
+
+def write_json_atomically(path, data, mode=0o644):
+    temp_path = path + '.tmp'
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "w") as jsonFile:
+        json.dump(data, jsonFile)
+    os.replace(temp_path, path)
+
+def save_key_cache(path, cache):
+    now = time.time()
+    cache = {sync_id: entry for sync_id, entry in cache.items() if entry['expires'] > now}
+    write_json_atomically(path, cache, 0o600)
+
+def get_cached_key(cache, sync_id, password):
+    """
+    Return the cached key of sync_id, or None if there is none, it expired, or it was
+    cached for another password.
+    """
+    entry = cache.get(sync_id)
+    if not entry or entry['expires'] <= time.time():
+        return None
+    try:
+        key = base64.b64decode(entry['key'])
+    except ValueError:
+        return None
+    if not hmac.compare_digest(entry.get('fingerprint', ''), key_fingerprint(sync_id, key)):
+        return None
+    if not hmac.compare_digest(entry.get('password_check', ''), password_check(key, password)):
+        return None
+    return key
+
+#Sync state, the lastUpdated value and version of each sync ID at its last download
+def load_sync_state(path):
+    try:
+        with open(path, "r") as stateFile:
+            return json.load(stateFile)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        print("WARNING: ignoring unreadable state file: " + path)
+        return {}
+
+def get_last_updated(sync_id_url):
+    with open_url(sync_id_url + "/lastUpdated") as response:
+        return json.loads(response.read().decode('utf-8'))["lastUpdated"]
+
+#Download pipeline, each stage is a generator of chunks so that the payload is never
+#held in memory as a whole
+def iter_response_chunks(response):
+    while True:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_bookmarks_field(chunks, other_fields):
+    """
+    Yield the base64 text of the "bookmarks" string in the api's json response.
+
+    The rest of the response is small, it is parsed once the stream ends and stored in other_fields.
+    """
+    field_start = re.compile(rb'"bookmarks"\s*:\s*"')
+    head = b''
+    rest = b''
+    in_field = False
+    done = False
+    for chunk in chunks:
+        if done:
+            rest += chunk
+            continue
+        if not in_field:
+            head += chunk
+            match = field_start.search(head)
+            if not match:
+                continue
+            chunk = head[match.end():]
+            head = head[:match.end()]
+            in_field = True
+        end = chunk.find(b'"')
+        if end == -1:
+            yield chunk.replace(b'\\', b'')
+        else:
+            yield chunk[:end].replace(b'\\', b'')
+            rest = chunk[end:]
+            done = True
+    if not done:
+        raise ValueError("no bookmarks found in api response")
+    other_fields.update(json.loads((head + rest).decode('utf-8')))
+
+def iter_base64_decoded(chunks):
+    remainder = b''
+    for chunk in chunks:
+        chunk = remainder + chunk
+        usable = len(chunk) - len(chunk) % 4
+        remainder = chunk[usable:]
+        if usable:
+            yield base64.b64decode(chunk[:usable])
+    if remainder:
+        yield base64.b64decode(remainder)
+
+def iter_decrypted(chunks, key):
+    """
+    Decrypt AES-GCM data laid out as a 16 byte nonce, the ciphertext and a 16 byte tag.
+
+    Plaintext is yielded before the tag has been checked, the tag is verified once the
+    stream ends and a ValueError is raised if it does not match.
+    """
+    from Cryptodome.Cipher import AES
+    buffer = b''
+    cipher = None
+    for chunk in chunks:
+        buffer += chunk
+        if cipher is None:
+            if len(buffer) < 16:
+                continue
+            cipher = AES.new(key, AES.MODE_GCM, nonce=buffer[:16])
+            buffer = buffer[16:]
+        if len(buffer) > 16:
+            yield cipher.decrypt(buffer[:-16])
+            buffer = buffer[-16:]
+    if cipher is None or len(buffer) != 16:
+        raise ValueError("encrypted bookmarks are truncated")
+    cipher.verify(buffer)
+
+def iter_flat_bookmarks(bookmarks):
+    """
+    Yield every bookmark in the tree as a flat dict with all of its own fields and a
+    "path" list holding the titles of the folders it is in.
+    """
+    for node, path in iter_bookmarks(bookmarks):
+        record = dict(node)
+        record["path"] = list(path)
+        yield record
+
+def iter_bookmarks_text(response, key, other_fields, stats=NO_STATS):
+    """
+    Chain the download pipeline stages over response, counting each of them in stats.
+
+    Returns the decrypted chunks and the text chunks, both generators.
+    """
+    from lzutf8 import Decompressor
+    chunks = stats.iterate('download', iter_response_chunks(response))
+    decoded_chunks = stats.iterate('base64', iter_base64_decoded(iter_bookmarks_field(chunks, other_fields)),
+                                   source='download')
+    decrypted_chunks = stats.iterate('decrypt', iter_decrypted(decoded_chunks, key), source='base64')
+    text_chunks = stats.iterate('decompress', Decompressor().decompressStream(decrypted_chunks), source='decrypt')
+    return decrypted_chunks, text_chunks
+
+def download_bookmarks(response, key, output_path, output_format, stats=NO_STATS):
+    """
+    Stream the bookmarks in an api response through decryption and decompression into
+    output_path.
+
+    The output is written to a temporary file that only replaces output_path once the
+    authentication tag has been verified. Returns the other fields of the api response.
+    """
+    other_fields = {}
+    temp_path = output_path + '.tmp'
+    try:
+        decrypted_chunks, text_chunks = iter_bookmarks_text(response, key, other_fields, stats)
+        with open(temp_path, "w") as outputFile:
+            try:
+                if output_format == 'pretty':
+                    #Prettify decrypted bookmark data
+                    text = ''.join(text_chunks)
+                    with stats.stage('json_parse'):
+                        all_bookmarks_json = json.loads(text)
+                    del text
+                    with stats.stage('json_dump'):
+                        json.dump(all_bookmarks_json, outputFile, indent=4)
+                elif output_format == 'ndjson':
+                    #One compact line per bookmark
+                    text = ''.join(text_chunks)
+                    with stats.stage('json_parse'):
+                        all_bookmarks_json = json.loads(text)
+                    del text
+                    with stats.stage('json_dump'):
+                        for record in iter_flat_bookmarks(all_bookmarks_json):
+                            outputFile.write(json.dumps(record, ensure_ascii=False) + "\n")
+                else:
+                    with stats.stage('write'):
+                        for text in text_chunks:
+                            outputFile.write(text)
+            except (IndexError, ValueError):
+                #Plaintext that cannot be decoded usually means a wrong key, let
+                #the tag check at the end of the stream report that instead
+                for _ in decrypted_chunks:
+                    pass
+                raise
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return other_fields
+
+def load_bookmarks(response, key, stats=NO_STATS):
+    """
+    Parse the bookmarks in an api response in memory, without writing anything.
+
+    The whole stream, including the authentication tag, is checked before parsing.
+    Returns the bookmark tree and the other fields of the api response.
+    """
+    other_fields = {}
+    decrypted_chunks, text_chunks = iter_bookmarks_text(response, key, other_fields, stats)
+    try:
+        text = ''.join(text_chunks)
+    except (IndexError, ValueError):
+        for _ in decrypted_chunks:
+            pass
+        raise
+    with stats.stage('json_parse'):
+        return json.loads(text), other_fields
+
+def fetch_encrypted(base_url, sync_id, timeout=60):
+    """
+    Download the encrypted bookmarks of a sync.
+
+    Returns the encrypted bytes, to pass to decrypt(), and the other fields of the api response.
+    """
+    other_fields = {}
+    with open_url(base_url.rstrip('/') + "/bookmarks/" + sync_id, timeout) as response:
+        data = b''.join(iter_base64_decoded(iter_bookmarks_field(iter_response_chunks(response), other_fields)))
+    return data, other_fields
+
+def decrypt(data, key):
+    """
+    Decrypt and authenticate encrypted bookmarks, returning the compressed bytes.
+    Raises ValueError if the key is wrong or the data was tampered with.
+    """
+    return b''.join(iter_decrypted([data], key))
+
+def decompress(data):
+    """
+    Decompress decrypted bookmarks into their json text.
+    """
+    from lzutf8 import Decompressor
+    return Decompressor().decompressBlockToString(data)
+
+def derive_key(sync_id, password):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(
+        'utf-8'), sync_id.encode('utf-8'), 250000, 32)
+
+def sync_bookmarks(base_url, sync_id, password, output_path, output_format='json',
+                   cached_key=None, last_updated=None, stats=NO_STATS, etag=None):
+    """
+    Download the bookmarks of one sync into output_path, or if output_path is None parse
+    them in memory and return the tree in the result's "bookmarks".
+
+    With the etag of an earlier download, the download is conditional and nothing is
+    downloaded if the bookmarks did not change. Otherwise, if last_updated is given and
+    the api reports the same value, nothing is downloaded either. A cached_key is tried
+    before deriving the key from the password. Returns a dict describing the outcome,
+    including the key used so that the caller can cache it. Each stage is counted in stats.
+    """
+    sync_id_url = base_url + "/bookmarks/" + sync_id
+    result = {'sync_id': sync_id, 'output': output_path, 'status': 'updated'}
+
+    def read_response(response, key):
+        result['etag'] = response.getheader('ETag')
+        if output_path is None:
+            result['bookmarks'], sync_data = load_bookmarks(response, key, stats)
+            return sync_data
+        return download_bookmarks(response, key, output_path, output_format, stats)
+
+    def setup_key():
+        key_start_time = time.perf_counter()
+        key = cached_key
+        if key is None:
+            with stats.stage('derive_key'):
+                key = derive_key(sync_id, password)
+        result['key_setup_time'] = time.perf_counter() - key_start_time
+        return key
+
+    #Check whether anything changed since the last run with the cheap lastUpdated
+    #endpoint, unless the download itself can be made conditional
+    if last_updated and not etag:
+        try:
+            with stats.stage('last_updated'):
+                current = get_last_updated(sync_id_url)
+        except Exception as e:
+            print("WARNING: could not get last update time, downloading anyway: " + str(e))
+            current = None
+        if current and current == last_updated:
+            result['status'] = 'unchanged'
+            result['lastUpdated'] = current
+            return result
+
+    #Download, decrypt, decompress and write bookmark data. The key is only set up once
+    #the api has answered, so an unchanged sync never pays for deriving it. If a cached
+    #key no longer works, derive it again and download again.
+    key = None
+    try:
+        with open_url(sync_id_url, etag=etag) as response:
+            key = setup_key()
+            sync_data = read_response(response, key)
+    except NotModified:
+        result['status'] = 'unchanged'
+        result['lastUpdated'] = last_updated
+        result['etag'] = etag
+        return result
+    except ValueError as e:
+        if key is not cached_key or str(e) != "MAC check failed":
+            raise
+        print("Cached key failed to decrypt, deriving it again")
+        cached_key = None
+        key = setup_key()
+        with open_url(sync_id_url) as response:
+            sync_data = read_response(response, key)
+
+    result['key'] = key
+    result['key_from_cache'] = key is cached_key
+    result['lastUpdated'] = sync_data.get("lastUpdated")
+    result['version'] = sync_data.get("version")
+    if output_path is not None:
+        result['bytes'] = os.path.getsize(output_path)
+    return result
+
+def sync_bookmarks_with_stats(*arguments, etag=None):
+    """
+    Run sync_bookmarks with a new Stats, for worker processes, and add its report to
+    the result as "stats".
+    """
+    stats = Stats()
+    result = sync_bookmarks(*arguments, stats=stats, etag=etag)
+    result['stats'] = stats.report()
+    return result
+
+def read_password(entry):
+    """
+    Get the password of a manifest entry from password, password_env or password_file.
+    """
+    if 'password' in entry:
+        return entry['password']
+    if 'password_env' in entry:
+        return os.environ[entry['password_env']]
+    if 'password_file' in entry:
+        with open(entry['password_file'], "r") as passwordFile:
+            return passwordFile.read().rstrip('\n')
+    raise ValueError("no password, password_env or password_file given")
+
+def update_key_cache(key_cache, result, password, ttl):
+    key_cache[result['sync_id']] = {
+        'fingerprint': key_fingerprint(result['sync_id'], result['key']),
+        'password_check': password_check(result['key'], password),
+        'key': base64.b64encode(result['key']).decode('ascii'),
+        'expires': time.time() + ttl,
+    }
+
+def update_sync_state(sync_state, result):
+    sync_state[result['sync_id']] = {
+        'lastUpdated': result['lastUpdated'],
+        'version': result['version'],
+        'etag': result.get('etag'),
+    }
@@ -0,0 +1,181 @@
+"""
+URL canonicalization and a de-duplication index for bookmark urls.
+
+Urls are reduced to a canonical form (lowercase scheme and host, no default port, no
+tracking query parameters, sorted query, no fragment and optionally no trailing slash)
+and indexed by a 64 bit hash of that form, either in memory or in a compact on-disk
+open addressing table for very large runs.
+"""
+import fnmatch
+import hashlib
+import mmap
+import urllib.parse
+
+DEFAULT_TRACKING_PARAMS = (
+    'utm_*', 'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'igshid',
+    '_hsenc', '_hsmi', 'yclid', 'ref_src', 'spm',
+)
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+
+def canonicalize_url(url, tracking_params=DEFAULT_TRACKING_PARAMS, strip_trailing_slash=True):
+    """
+    Return the canonical form of url. tracking_params are query parameter names to
+    remove, compared case insensitively, with fnmatch globs such as utm_*.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    netloc = parts.netloc
+    if netloc:
+        userinfo, _, hostport = netloc.rpartition('@')
+        host, port = hostport, None
+        if hostport.startswith('['):
+            end = hostport.find(']')
+            host, port = hostport[:end + 1], hostport[end + 2:] if hostport[end + 1:end + 2] == ':' else None
+        elif ':' in hostport:
+            host, port = hostport.rsplit(':', 1)
+        host = host.lower().rstrip('.')
+        if port is not None and (not port or (port.isdigit() and int(port) == DEFAULT_PORTS.get(scheme))):
+            port = None
+        netloc = (userinfo + '@' if userinfo else '') + host + (':' + port if port else '')
+
+    path = parts.path
+    if strip_trailing_slash:
+        path = path.rstrip('/')
+    if not path and scheme in ('http', 'https'):
+        path = '/'
+
+    #Work on the raw query pairs so that the original percent encoding is kept
+    pairs = []
+    patterns = [param.lower() for param in tracking_params]
+    for pair in parts.query.split('&'):
+        if not pair:
+            continue
+        name = urllib.parse.unquote_plus(pair.split('=', 1)[0]).lower()
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+            continue
+        pairs.append(pair)
+    query = '&'.join(sorted(pairs))
+
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, ''))
+
+
+def url_digest(canonical_url):
+    """
+    Return a nonzero 64 bit hash of a canonical url.
+    """
+    digest = hashlib.blake2b(canonical_url.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') | 1
+
+
+class DiskHashSet:
+    """
+    Set of nonzero 64 bit integers stored in a memory-mapped open addressing table with
+    linear probing, so that memory use stays flat no matter how many values are added.
+    The table doubles in size when it gets half full.
+    """
+    SLOT_SIZE = 8
+
+    def __init__(self, capacity=1 << 20, directory=None):
+        self.directory = directory
+        self.count = 0
+        self._open(capacity)
+
+    def _open(self, capacity):
+        import tempfile
+        self.capacity = capacity
+        self.file = tempfile.TemporaryFile(dir=self.directory)
+        self.file.truncate(capacity * self.SLOT_SIZE)
+        self.table = mmap.mmap(self.file.fileno(), capacity * self.SLOT_SIZE)
+        self.slots = memoryview(self.table).cast('Q')
+
+    def _grow(self):
+        old_slots, old_table, old_file = self.slots, self.table, self.file
+        self._open(self.capacity * 2)
+        for value in old_slots:
+            if value:
+                self._insert(value)
+        old_slots.release()
+        old_table.close()
+        old_file.close()
+
+    def _insert(self, value):
+        mask = self.capacity - 1
+        #The lowest bit of a url digest is always set, start from the bits above it
+        slot = (value >> 1) & mask
+        slots = self.slots
+        while True:
+            current = slots[slot]
+            if current == 0:
+                slots[slot] = value
+                return True
+            if current == value:
+                return False
+            slot = (slot + 1) & mask
+
+    def add(self, value):
+        """
+        Add value, returning True if it was not in the set yet.
+        """
+        if (self.count + 1) * 2 > self.capacity:
+            self._grow()
+        added = self._insert(value)
+        if added:
+            self.count += 1
+        return added
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.slots.release()
+        self.table.close()
+        self.file.close()
+
+
+class MemoryHashSet(set):
+    """
+    In memory counterpart of DiskHashSet.
+    """
+
+    def add(self, value):
+        if value in self:
+            return False
+        super().add(value)
+        return True
+
+    def close(self):
+        pass
+
+
+class UrlIndex:
+    """
+    Remembers the canonical form of every url seen, to report duplicates.
+    """
+
+    def __init__(self, on_disk=False, tracking_params=DEFAULT_TRACKING_PARAMS, strip_trailing_slash=True):
+        self.seen = DiskHashSet() if on_disk else MemoryHashSet()
+        self.tracking_params = tracking_params
+        self.strip_trailing_slash = strip_trailing_slash
+        self.duplicates = 0
+
+    def canonicalize(self, url):
+        return canonicalize_url(url, self.tracking_params, self.strip_trailing_slash)
+
+    def add(self, url):
+        """
+        Add url to the index, returning its canonical form if it was new, or None if an
+        equivalent url was added before.
+        """
+        canonical = self.canonicalize(url)
+        if self.seen.add(url_digest(canonical)):
+            return canonical
+        self.duplicates += 1
+        return None
+
+    def __len__(self):
+        return len(self.seen)
+
+    def close(self):
+        self.seen.close()
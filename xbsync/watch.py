@@ -0,0 +1,248 @@
+"""
+Watch several syncs and run the filter pipeline whenever one of them changes.
+
+Each sync is polled on its cheap lastUpdated endpoint over the pooled keep-alive
+connections of xbsync.sync, and its derived key is kept in memory, so between changes
+a poll costs one small request. Poll intervals grow while a sync stays unchanged, drop
+back to the minimum when it changes and back off exponentially on errors, with random
+jitter so that many syncs do not end up polled in lockstep.
+"""
+import json
+import os
+import random
+import shlex
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .cli import open_link_checker, write_urls
+from .subtree_cache import SubtreeCache
+from .sync import get_last_updated, sync_bookmarks, update_sync_state, write_json_atomically
+
+#How much faster the poll interval grows while a sync is unchanged
+INTERVAL_GROWTH = 1.5
+
+
+def log(message):
+    print(time.strftime('%Y-%m-%d %H:%M:%S ') + message, flush=True)
+
+
+class WatchedSync:
+    """
+    Polling state of one sync, built from a manifest entry.
+    """
+
+    def __init__(self, entry, base_url, password, min_interval):
+        self.sync_id = entry['sync_id']
+        self.base_url = entry.get('url', base_url).strip().rstrip('/')
+        self.password = password
+        self.urls_path = entry['urls']
+        self.snapshot_path = entry.get('snapshot')
+        self.removed_path = entry.get('removed')
+        self.dead_links_path = entry.get('dead_links')
+        self.key = None
+        self.last_updated = None
+        self.interval = min_interval
+        self.next_poll = 0.0
+        self.errors = 0
+        self.last_error = None
+        self.last_success = None
+        self.polls = 0
+        self.changes = 0
+        self.error_count = 0
+
+    @property
+    def sync_id_url(self):
+        return self.base_url + "/bookmarks/" + self.sync_id
+
+
+class Watcher:
+    """
+    Polls a list of WatchedSync until stop() is called. args holds the filter options
+    of xbsync.cli.add_filter_arguments and the polling options of the watch script.
+    """
+
+    def __init__(self, syncs, args, rules, sync_state=None):
+        self.syncs = syncs
+        self.args = args
+        self.rules = rules
+        self.sync_state = sync_state if sync_state is not None else {}
+        self.stopping = threading.Event()
+        self.started = time.time()
+        for sync in syncs:
+            sync.last_updated = self.sync_state.get(sync.sync_id, {}).get('lastUpdated')
+            #Folders that did not change since the last poll are not filtered again
+            sync.subtree_cache = SubtreeCache(rules)
+
+    def _jitter(self, interval):
+        return interval * random.uniform(1 - self.args.jitter, 1 + self.args.jitter)
+
+    def _schedule(self, sync, changed=False):
+        if sync.errors:
+            interval = min(self.args.min_interval * 2 ** sync.errors, self.args.max_backoff)
+        elif changed:
+            interval = sync.interval = self.args.min_interval
+        else:
+            interval = sync.interval = min(sync.interval * INTERVAL_GROWTH, self.args.max_interval)
+        sync.next_poll = time.monotonic() + self._jitter(interval)
+
+    def emit(self, sync, bookmarks):
+        """
+        Filter bookmarks into the sync's url file, and pipe that file into the command if
+        one was given. The url file is only replaced once it has been written completely.
+        """
+        from .snapshot_store import UrlSnapshot
+        archivebox_index = None
+        if self.args.archivebox_dir:
+            #Opened again for every change to see what was archived since, an index that
+            #went missing fails this poll rather than exiting like open_archivebox_index
+            from .archivebox_index import ArchiveBoxIndex
+            archivebox_index = ArchiveBoxIndex(self.args.archivebox_dir, self.args.archivebox_canonical,
+                                               self.args.tracking_params)
+        snapshot = UrlSnapshot(sync.snapshot_path) if sync.snapshot_path else None
+        link_checker = open_link_checker(self.args, sync.dead_links_path)
+        temp_path = sync.urls_path + '.tmp'
+        try:
+            with open(temp_path, "w") as outputFile:
+                write_urls(sync.subtree_cache.filter(bookmarks, self.args.on_malformed), outputFile, self.args,
+                           archivebox_index, snapshot, link_checker=link_checker)
+            if self.args.command:
+                with open(temp_path, "r") as urlsFile:
+                    subprocess.run(shlex.split(self.args.command), stdin=urlsFile, cwd=self.args.archivebox_dir,
+                                   check=True)
+            os.replace(temp_path, sync.urls_path)
+            if snapshot:
+                if sync.removed_path:
+                    with open(sync.removed_path, "w") as removedFile:
+                        for url in snapshot.removed_urls():
+                            removedFile.write(url + "\n")
+                snapshot.commit()
+        finally:
+            if snapshot:
+                snapshot.close()
+            if archivebox_index:
+                archivebox_index.close()
+            if link_checker:
+                link_checker.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def poll(self, sync):
+        """
+        Check one sync for changes and run the pipeline if it changed. Returns True if
+        the sync changed and was processed.
+        """
+        sync.polls += 1
+        current = get_last_updated(sync.sync_id_url)
+        if current and current == sync.last_updated:
+            return False
+
+        log("%s changed (last update %s), downloading" % (sync.sync_id, current))
+        result = sync_bookmarks(sync.base_url, sync.sync_id, sync.password, None, cached_key=sync.key)
+        sync.key = result['key']
+        self.emit(sync, result.pop('bookmarks'))
+
+        sync.last_updated = result['lastUpdated'] or current
+        update_sync_state(self.sync_state, result)
+        if self.args.state:
+            write_json_atomically(self.args.state, self.sync_state)
+        sync.changes += 1
+        return True
+
+    def run(self):
+        while not self.stopping.is_set():
+            sync = min(self.syncs, key=lambda sync: sync.next_poll)
+            delay = sync.next_poll - time.monotonic()
+            if delay > 0:
+                self.stopping.wait(delay)
+                continue
+            try:
+                changed = self.poll(sync)
+            except Exception as e:
+                sync.errors += 1
+                sync.error_count += 1
+                sync.last_error = '%s: %s' % (type(e).__name__, e)
+                log("%s failed (%d in a row): %s" % (sync.sync_id, sync.errors, sync.last_error))
+                self._schedule(sync)
+                continue
+            sync.errors = 0
+            sync.last_success = time.time()
+            self._schedule(sync, changed)
+
+    def stop(self):
+        self.stopping.set()
+
+    def health(self):
+        """
+        Return a json serializable summary of every sync. The watcher is healthy as long
+        as no sync has failed more than max_errors times in a row.
+        """
+        syncs = []
+        for sync in self.syncs:
+            syncs.append({
+                'sync_id': sync.sync_id[:8],
+                'urls': sync.urls_path,
+                'last_updated': sync.last_updated,
+                'last_success': sync.last_success,
+                'last_error': sync.last_error,
+                'errors_in_a_row': sync.errors,
+                'next_poll_in_seconds': max(sync.next_poll - time.monotonic(), 0),
+            })
+        healthy = all(sync.errors <= self.args.max_errors for sync in self.syncs)
+        return {'healthy': healthy, 'uptime_seconds': time.time() - self.started, 'syncs': syncs}
+
+    def metrics(self):
+        """
+        Return the counters of every sync as Prometheus text.
+        """
+        lines = []
+        for name, kind, description, value in (
+                ('xbs_watch_polls_total', 'counter', 'Polls of the lastUpdated endpoint', lambda sync: sync.polls),
+                ('xbs_watch_changes_total', 'counter', 'Changes downloaded and filtered', lambda sync: sync.changes),
+                ('xbs_watch_errors_total', 'counter', 'Failed polls or downloads', lambda sync: sync.error_count),
+                ('xbs_watch_errors_in_a_row', 'gauge', 'Consecutive failures', lambda sync: sync.errors),
+                ('xbs_watch_poll_interval_seconds', 'gauge', 'Current poll interval', lambda sync: sync.interval),
+                ('xbs_watch_last_success_timestamp_seconds', 'gauge', 'Time of the last successful poll',
+                 lambda sync: sync.last_success or 0)):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for sync in self.syncs:
+                lines.append('%s{urls="%s"} %r' % (name, sync.urls_path.replace('\\', '\\\\').replace('"', '\\"'),
+                                                    value(sync)))
+        return '\n'.join(lines) + '\n'
+
+
+def serve_status(watcher, host, port):
+    """
+    Serve /health as json and /metrics as Prometheus text from a background thread.
+    Returns the server, call shutdown() on it to stop.
+    """
+    class StatusHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *arguments):
+            pass
+
+        def do_GET(self):
+            if self.path == '/health':
+                health = watcher.health()
+                body = json.dumps(health).encode('utf-8')
+                status = 200 if health['healthy'] else 503
+                content_type = 'application/json'
+            elif self.path == '/metrics':
+                body = watcher.metrics().encode('utf-8')
+                status = 200
+                content_type = 'text/plain; version=0.0.4'
+            else:
+                body = b'not found\n'
+                status = 404
+                content_type = 'text/plain'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), StatusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server